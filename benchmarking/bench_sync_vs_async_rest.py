@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import httpx
+
+# Side-by-side load test of the sync (main:app) and async (main_async:app) REST nodes.
+# Both sides are one uvicorn process hit directly, with no nginx hop and no
+# in-flight cap (the async node has none), on the same Redis. The "bench"
+# profile publishes a single sync node on port 8002; node-async is on 8001:
+#   docker compose -f layered-rest/docker-compose.yml --profile bench up --build -d
+#   python benchmarking/bench_sync_vs_async_rest.py --concurrency 200 400
+SYNC_URL = "http://localhost:8002"
+ASYNC_URL = "http://localhost:8001"
+
+
+# --- Load generator ---
+async def worker(client, base_url, deadline, latencies, errors, read_ratio, track_ids):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if random.random() < read_ratio:
+                resp = await client.get(f"{base_url}/queue", params={"limit": 20})
+            else:
+                resp = await client.post(f"{base_url}/vote", json={"id": random.choice(track_ids)})
+            if resp.status_code >= 400:
+                errors.append(resp.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+async def bench(base_url, concurrency, duration, read_ratio, queue_size):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=10, limits=limits) as client:
+        await client.post(f"{base_url}/clear")
+        track_ids = list(range(1, queue_size + 1))
+        for track_id in track_ids:
+            await client.post(f"{base_url}/add_track",
+                              json={"id": track_id, "title": f"Song{track_id}", "artist": "A", "duration": 200})
+        latencies, errors = [], []
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            worker(client, base_url, deadline, latencies, errors, read_ratio, track_ids)
+            for _ in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    pct = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else float("nan")
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": pct(0.50),
+        "p99": pct(0.99),
+        "errors": len(errors),
+    }
+
+
+# --- Main Experiment ---
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and async REST node throughput")
+    parser.add_argument("--sync-url", default=SYNC_URL)
+    parser.add_argument("--async-url", default=ASYNC_URL)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[200, 400])
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per run")
+    parser.add_argument("--read-ratio", type=float, default=0.9, help="share of GET /queue vs POST /vote")
+    parser.add_argument("--queue-size", type=int, default=200)
+    parser.add_argument("--out", default="benchmarking/experimental/sync_vs_async.csv")
+    args = parser.parse_args()
+
+    rows = []
+    for concurrency in args.concurrency:
+        for label, url in (("sync", args.sync_url), ("async", args.async_url)):
+            print(f"\nTesting {label} node at {url} with {concurrency} concurrent clients...")
+            result = asyncio.run(bench(url, concurrency, args.duration, args.read_ratio, args.queue_size))
+            rows.append((label, concurrency, result))
+            print(f"{label:>5} c={concurrency}: {result['rps']:.1f} req/s, "
+                  f"p50 {result['p50']:.1f} ms, p99 {result['p99']:.1f} ms, {result['errors']} errors")
+
+    print("\nimpl   concurrency    req/s    p50 ms    p99 ms  errors")
+    for label, concurrency, r in rows:
+        print(f"{label:<6} {concurrency:>11} {r['rps']:>8.1f} {r['p50']:>9.1f} {r['p99']:>9.1f} {r['errors']:>7}")
+
+    os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, "w") as f:
+        f.write("impl,concurrency,rps,p50_ms,p99_ms,errors\n")
+        for label, concurrency, r in rows:
+            f.write(f"{label},{concurrency},{r['rps']},{r['p50']},{r['p99']},{r['errors']}\n")
+    print(f"Raw results saved to {args.out}")
+
+if __name__ == "__main__":
+    main()
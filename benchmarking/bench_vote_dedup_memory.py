@@ -0,0 +1,89 @@
+import argparse
+import os
+import random
+import sys
+import uuid
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "layered-rest", "node"))
+from votes import CLAIM_VOTES, claim_args  # noqa: E402
+
+# Redis memory taken by VOTE_DEDUP voter keys, measured with MEMORY USAGE
+# after a number of claims made through the node's own CLAIM_VOTES script.
+# Writes only bench_dedup:* keys and deletes them afterwards:
+#   python benchmarking/bench_vote_dedup_memory.py --port 6379
+PREFIX = "bench_dedup:"
+QUEUE = PREFIX + "queue"
+BATCH = 1000  # claims per script run
+
+
+# --- Workloads: (track id, listener) claims ---
+def one_track(claims, listener_ids):
+    return [(1, listener) for listener in listener_ids(claims)]
+
+def spread(claims, listener_ids, tracks=1000):
+    per_track = claims // tracks
+    return [(track_id, listener) for track_id in range(1, tracks + 1) for listener in listener_ids(per_track)]
+
+def dense_ids(n):
+    return [str(i) for i in range(n)]
+
+def random_ids(n, top=2 ** 20 - 1):
+    return [str(i) for i in random.sample(range(top + 1), n)]
+
+def uuid_ids(n):
+    return [str(uuid.uuid4()) for _ in range(n)]
+
+
+def measure(client, mode, claims):
+    voters = lambda track_id: f"{PREFIX}{mode}:{track_id}"
+    track_ids = sorted({track_id for track_id, _ in claims})
+    client.zadd(QUEUE, {str(track_id): 0 for track_id in track_ids})
+    script = client.register_script(CLAIM_VOTES)
+    for i in range(0, len(claims), BATCH):
+        keys, args = claim_args(QUEUE, mode, 86400, [
+            (voters(track_id), str(track_id), listener) for track_id, listener in claims[i:i + BATCH]
+        ])
+        script(keys, args)
+    pipe = client.pipeline(transaction=False)
+    for track_id in track_ids:
+        pipe.memory_usage(voters(track_id), samples=0)
+    total = sum(pipe.execute())
+    client.delete(QUEUE, *[voters(track_id) for track_id in track_ids])
+    return len(track_ids), total
+
+
+# --- Main Experiment ---
+def main():
+    parser = argparse.ArgumentParser(description="Measure VOTE_DEDUP memory per mode")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--claims", type=int, default=1_000_000)
+    parser.add_argument("--out", default="benchmarking/experimental/vote_dedup_memory.csv")
+    args = parser.parse_args()
+    client = redis.Redis(host=args.host, port=args.port)
+    random.seed(1)
+
+    runs = [
+        ("set", "one track", "dense ints", one_track(args.claims, dense_ids)),
+        ("bitmap", "one track", "dense ints", one_track(args.claims, dense_ids)),
+        ("set", "1000 tracks", "random ints < 2^20", spread(args.claims, random_ids)),
+        ("bitmap", "1000 tracks", "random ints < 2^20", spread(args.claims, random_ids)),
+        ("set", "1000 tracks", "uuid strings", spread(args.claims, uuid_ids)),
+    ]
+    rows = []
+    for mode, layout, ids, claims in runs:
+        keys, total = measure(client, mode, claims)
+        rows.append((mode, layout, ids, len(claims), keys, total))
+        print(f"{mode:>6} {layout:>11} {ids:>18}: {total / 2 ** 20:8.2f} MiB, {total / len(claims):6.2f} B/claim")
+
+    os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, "w") as f:
+        f.write("mode,layout,ids,claims,keys,bytes,bytes_per_claim\n")
+        for mode, layout, ids, n, keys, total in rows:
+            f.write(f"{mode},{layout},{ids},{n},{keys},{total},{total / n:.2f}\n")
+    print(f"Raw results saved to {args.out}")
+
+if __name__ == "__main__":
+    main()
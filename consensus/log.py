@@ -0,0 +1,83 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Copy of layered-rest/node/log.py, the canonical version: make fixes there
+# first and carry them over. Only the header, LOG_FORMAT and DEFAULT_SAMPLE
+# differ, and the httpx logger is left alone (these nodes do not use httpx).
+#
+# Leveled logging shared by the Raft and 2PC nodes. Records go through an
+# in-memory queue to one background writer thread, so RPC handlers and
+# heartbeat loops never block on stdout, and a call below LOG_LEVEL returns
+# before its message is formatted.
+#   LOG_LEVEL   DEBUG | INFO (default) | WARNING | ERROR; WARNING drops the per-RPC trace
+#   LOG_SAMPLE  records per second allowed for any one message (default 0 = no limit,
+#               since the per-RPC trace lines are the nodes' expected output)
+LOG_FORMAT = "%(message)s"
+DEFAULT_SAMPLE = 0
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class SampleFilter(logging.Filter):
+    """Passes at most `per_second` records per logger and message template each
+    second, and notes how many were dropped on the next one let through."""
+
+    def __init__(self, per_second: int):
+        super().__init__()
+        self.per_second = per_second
+        self._windows = {}  # (logger, template) -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                self._windows[key] = [now, 1, 0]
+                if window is not None and window[2]:
+                    record.msg = f"{record.msg} ({window[2]} similar suppressed)"
+                return True
+            if window[1] < self.per_second:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def _level(name: str) -> int:
+    level = logging.getLevelName(name.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown LOG_LEVEL {name!r}")
+    return level
+
+def _start() -> logging.handlers.QueueListener:
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    sample = int(os.getenv("LOG_SAMPLE", str(DEFAULT_SAMPLE)))
+    if sample > 0:
+        handler.addFilter(SampleFilter(sample))
+    root = logging.getLogger()
+    root.setLevel(_level(os.getenv("LOG_LEVEL", "INFO")))
+    root.addHandler(handler)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(records, stream)
+    listener.start()
+    atexit.register(listener.stop)  # drains what is still queued
+    return listener
+
+
+def get_logger(name: str) -> logging.Logger:
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            _listener = _start()
+    return logging.getLogger(name)
@@ -8,14 +8,17 @@ from typing import Dict, List, Optional
 import grpc
 
 from . import raft_pb2, raft_pb2_grpc
+from ..log import get_logger
+
+log = get_logger(__name__)
 
 
 def log_client(node_id: str, rpc_name: str, target_node: str) -> None:
-    print(f"Node {node_id} sends RPC {rpc_name} to Node {target_node}.")
+    log.info("Node %s sends RPC %s to Node %s.", node_id, rpc_name, target_node)
 
 
 def log_server(node_id: str, rpc_name: str, caller_node: str) -> None:
-    print(f"Node {node_id} runs RPC {rpc_name} called by Node {caller_node}.")
+    log.info("Node %s runs RPC %s called by Node %s.", node_id, rpc_name, caller_node)
 
 
 class RaftNode(raft_pb2_grpc.RaftConsensusServicer, raft_pb2_grpc.RaftClientServicer):
@@ -251,7 +254,7 @@ class RaftNode(raft_pb2_grpc.RaftConsensusServicer, raft_pb2_grpc.RaftClientServ
                 self.voted_for = None
                 self.last_heartbeat = time.monotonic()
                 self.election_timeout = self._new_election_timeout()
-                print(f"Node {self.node_id} became leader for term {self.current_term} with {votes} votes")
+                log.info("Node %s became leader for term %d with %d votes", self.node_id, self.current_term, votes)
         else:
             with self.lock:
                 self.state = "follower"
@@ -311,7 +314,7 @@ def serve() -> None:
     server.add_insecure_port(f"{host}:{port}")
     server.start()
     node.start()
-    print(f"Raft node {node_id} serving on port {port}")
+    log.info("Raft node %s serving on port %d", node_id, port)
 
     try:
         while True:
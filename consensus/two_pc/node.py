@@ -7,17 +7,22 @@ from typing import Dict, List, Set
 import grpc
 
 from . import two_pc_pb2, two_pc_pb2_grpc
+from ..log import get_logger
+
+log = get_logger(__name__)
 
 
 def log_client(phase_name: str, node_id: str, rpc_name: str, target_phase: str, target_node: str) -> None:
-    print(
-        f"Phase {phase_name} of Node {node_id} sends RPC {rpc_name} to Phase {target_phase} of Node {target_node}."
+    log.info(
+        "Phase %s of Node %s sends RPC %s to Phase %s of Node %s.",
+        phase_name, node_id, rpc_name, target_phase, target_node,
     )
 
 
 def log_server(phase_name: str, node_id: str, rpc_name: str, caller_phase: str, caller_node: str) -> None:
-    print(
-        f"Phase {phase_name} of Node {node_id} runs RPC {rpc_name} called by Phase {caller_phase} of Node {caller_node}."
+    log.info(
+        "Phase %s of Node %s runs RPC %s called by Phase %s of Node %s.",
+        phase_name, node_id, rpc_name, caller_phase, caller_node,
     )
 
 
@@ -214,9 +219,9 @@ def serve() -> None:
     vote_server.start()
     coordinator_service.start()
 
-    print(
-        f"Node {node_id} started vote phase on port {vote_port}, decision phase on port {decision_port}, "
-        f"control on port {vote_port + 100}."
+    log.info(
+        "Node %s started vote phase on port %d, decision phase on port %d, control on port %d.",
+        node_id, vote_port, decision_port, vote_port + 100,
     )
 
     try:
@@ -0,0 +1,115 @@
+import math
+from typing import Iterable
+
+from starlette.concurrency import run_in_threadpool
+
+from log import get_logger
+from rooms import split_room_path
+
+log = get_logger(__name__)
+
+# Two token buckets (per client, per room) checked and charged in one atomic
+# step. A bucket is a hash {tokens, ts}; it refills at `rate` tokens/second up
+# to `burst` and expires once it would be full again. Time comes from the Redis
+# server, so every replica sees the same clock.
+# KEYS: client bucket, room bucket
+# ARGV: client rate, client burst, room rate, room burst (rate 0 = no limit)
+# Returns {1, 0} if admitted, else {0, milliseconds until it would be}.
+_TOKEN_BUCKETS = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local levels, wait = {}, 0
+for i = 1, 2 do
+  local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+  if rate > 0 then
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+    levels[i] = tokens
+    if tokens < 1 then
+      wait = math.max(wait, math.ceil((1 - tokens) * 1000 / rate))
+    end
+  end
+end
+if wait > 0 then
+  return {0, wait}
+end
+for i = 1, 2 do
+  local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+  if levels[i] then
+    redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i] - 1), 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(burst * 1000 / rate) + 1000)
+  end
+end
+return {1, 0}
+"""
+
+MAX_ROOM_LENGTH = 64
+
+
+class AdmissionMiddleware:
+    """Plain ASGI middleware that turns overload into fast 429s.
+
+    A request is first checked against the number of requests this process
+    is already handling (`max_inflight`, no Redis involved), then against the
+    per-client and per-room token buckets in Redis. Either limit answers 429
+    with a Retry-After header before the endpoint runs. Paths under `exempt`
+    (peer sync, metrics, the event stream) are never limited. If Redis cannot
+    be reached the buckets let requests through rather than failing them."""
+
+    def __init__(self, app, redis_client, client_rate: float, client_burst: int,
+                 room_rate: float, room_burst: int, max_inflight: int,
+                 exempt: Iterable[str], prefix: str, rejected):
+        self.app = app
+        self.redis = redis_client
+        self.limits = [client_rate, client_burst, room_rate, room_burst]
+        self.buckets = client_rate > 0 or room_rate > 0
+        self.max_inflight = max_inflight
+        self.exempt = tuple(exempt)
+        self.prefix = prefix
+        self.rejected = rejected  # metrics Counter labelled by reason
+        self.inflight = 0  # only touched on the event loop thread
+        self._script = redis_client.register_script(_TOKEN_BUCKETS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt):
+            return await self.app(scope, receive, send)
+        if self.max_inflight and self.inflight >= self.max_inflight:
+            self.rejected.inc("inflight")
+            return await self._reject(send, 1, "Too many requests in progress")
+        self.inflight += 1
+        try:
+            if self.buckets:
+                wait_ms = await run_in_threadpool(self._take, scope)
+                if wait_ms:
+                    self.rejected.inc("rate")
+                    return await self._reject(send, math.ceil(wait_ms / 1000), "Rate limit exceeded")
+            await self.app(scope, receive, send)
+        finally:
+            self.inflight -= 1
+
+    def _take(self, scope) -> int:
+        headers = dict(scope["headers"])
+        client = headers.get(b"x-real-ip") or (scope["client"][0] if scope.get("client") else "unknown")
+        client = client.decode() if isinstance(client, bytes) else client
+        # Room-scoped paths name their room; unscoped requests may set X-Room
+        room, _ = split_room_path(scope["path"])
+        room = (room or headers.get(b"x-room", b"default").decode())[:MAX_ROOM_LENGTH]
+        keys = [f"{self.prefix}client:{client}", f"{self.prefix}room:{room}"]
+        try:
+            allowed, wait_ms = self._script(keys, self.limits)
+        except Exception as e:
+            log.warning("Rate limiter unavailable, admitting request: %s", e)
+            return 0
+        return 0 if allowed else max(int(wait_ms), 1)
+
+    @staticmethod
+    async def _reject(send, retry_after: int, detail: str):
+        body = b'{"detail":"%s"}' % detail.encode()
+        await send({"type": "http.response.start", "status": 429, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,159 @@
+import bisect
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+from schema import HISTORY_COUNT_KEY, HISTORY_KEY, HISTORY_TIMES_KEY
+
+# Cold tier of the play history. Entries the archiver moves out of Redis are
+# stored as append-only segments in one SQLite file: each row holds a run of
+# consecutive play indexes as a zlib-compressed blob of (play time, encoded
+# record) entries, indexed by first index and by last play time. Records keep
+# their Redis encoding (see codec.py), so decode_record reads them back.
+
+_ENTRY = struct.Struct("<dI")  # play time, record length
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    first INTEGER PRIMARY KEY,
+    last INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    first_played REAL NOT NULL,
+    last_played REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_last_played ON segments (last_played);
+"""
+
+
+# Position in the Redis tier of the first entry played at or after a time,
+# by binary search over the play times list (appended in order), so a
+# ?since= lookup costs O(log n) LINDEX calls instead of reading every time.
+# KEYS: history, history count, play times; ARGV: unix time
+# Returns {position in the times list, times length, history length, total played}.
+INDEX_SINCE = """
+local target = tonumber(ARGV[1])
+local lo, hi = 0, redis.call('LLEN', KEYS[3])
+local n = hi
+while lo < hi do
+  local mid = math.floor((lo + hi) / 2)
+  if tonumber(redis.call('LINDEX', KEYS[3], mid)) < target then
+    lo = mid + 1
+  else
+    hi = mid
+  end
+end
+return {lo, n, redis.call('LLEN', KEYS[1]), tonumber(redis.call('GET', KEYS[2]) or '0')}
+"""
+
+
+def _pack(entries: List[Tuple[float, bytes]]) -> bytes:
+    return zlib.compress(b"".join(_ENTRY.pack(played, len(body)) + body for played, body in entries))
+
+
+def _unpack(first: int, data: bytes) -> List[Tuple[int, float, bytes]]:
+    raw = zlib.decompress(data)
+    entries, offset, index = [], 0, first
+    while offset < len(raw):
+        played, size = _ENTRY.unpack_from(raw, offset)
+        offset += _ENTRY.size
+        entries.append((index, played, raw[offset:offset + size]))
+        offset += size
+        index += 1
+    return entries
+
+
+class HistoryArchive:
+    """Archived history entries by absolute play index (the /history cursor).
+
+    Indexes are never reused, so segments only ever get appended; there may be
+    gaps where entries were trimmed from Redis before archiving was enabled."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._db().executescript(_SCHEMA)
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets readers run while the archiver appends
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def next_index(self) -> int:
+        last, = self._db().execute("SELECT MAX(last) FROM segments").fetchone()
+        return 0 if last is None else last + 1
+
+    def entries(self) -> int:
+        count, = self._db().execute("SELECT COALESCE(SUM(count), 0) FROM segments").fetchone()
+        return count
+
+    def append(self, first: int, entries: List[Tuple[float, bytes]]):
+        self._db().execute(
+            "INSERT INTO segments (first, last, count, first_played, last_played, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (first, first + len(entries) - 1, len(entries), entries[0][0], entries[-1][0], _pack(entries)))
+
+    def read(self, start: int, stop: int, limit: Optional[int] = None) -> List[Tuple[int, bytes]]:
+        """(index, encoded record) for archived entries with start <= index < stop, at most `limit`."""
+        rows = self._db().execute(
+            "SELECT first, data FROM segments WHERE last >= ? AND first < ? ORDER BY first", (start, stop))
+        found = []
+        for first, data in rows:
+            for index, _, body in _unpack(first, data):
+                if start <= index < stop:
+                    found.append((index, body))
+                    if limit is not None and len(found) >= limit:
+                        return found
+        return found
+
+    def index_since(self, played_at: float) -> Optional[int]:
+        """Index of the first archived entry played at or after `played_at`, if any."""
+        row = self._db().execute(
+            "SELECT first, data FROM segments WHERE last_played >= ? ORDER BY first LIMIT 1", (played_at,)).fetchone()
+        if row is None:
+            return None
+        for index, played, _ in _unpack(*row):
+            if played >= played_at:
+                return index
+        return None
+
+    def clear(self):
+        self._db().execute("DELETE FROM segments")
+
+
+def archive_step(client, archive: HistoryArchive, keep: int, max_age: float, batch: int) -> int:
+    """Move up to `batch` of the oldest Redis history entries into `archive`.
+
+    Entries go when more than `keep` are in Redis, or when they were played
+    over `max_age` seconds ago (0 = no age limit). The segment is written
+    before the entries are trimmed from Redis; if a crash falls in between,
+    the next step finds them already archived and only trims. Only one
+    archiver may run at a time, and writers must not trim the history list
+    themselves, since this trims by position from the left."""
+    pipe = client.pipeline()
+    pipe.llen(HISTORY_KEY)
+    pipe.get(HISTORY_COUNT_KEY)
+    pipe.lrange(HISTORY_TIMES_KEY, 0, batch - 1)
+    length, total, times = pipe.execute()
+    times = [float(t) for t in times]
+    n = max(length - keep, 0)
+    if max_age > 0:
+        n = max(n, bisect.bisect_left(times, time.time() - max_age))
+    n = min(n, batch, length, len(times))
+    if n == 0:
+        return 0
+    base = max(int(total or 0) - length, 0)  # index of the oldest entry in Redis
+    bodies = client.lrange(HISTORY_KEY, 0, n - 1)
+    done = max(archive.next_index() - base, 0)
+    if done < n:
+        archive.append(base + done, list(zip(times[done:n], bodies[done:n])))
+    pipe = client.pipeline()
+    pipe.ltrim(HISTORY_KEY, n, -1)
+    pipe.ltrim(HISTORY_TIMES_KEY, n, -1)
+    pipe.execute()
+    return n
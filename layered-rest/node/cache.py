@@ -0,0 +1,67 @@
+import threading
+from typing import Any, Callable, Dict, Set, Tuple
+
+
+class ReadCache:
+    """Process-local cache of derived read results, keyed by a version counter.
+
+    Every invalidation bumps the version. A value is only stored if the version
+    did not move while it was being built, so a read that overlaps a write can
+    never cache pre-write data. The cache starts disabled and only serves hits
+    while at least one source of remote-write notifications is live (see
+    `enable`)."""
+
+    def __init__(self):
+        self.version = 0
+        self._sources: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[int, Any]] = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._sources)
+
+    def enable(self, source: str):
+        """`source` now reports every remote write; writes it missed are dropped."""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._sources.add(source)
+
+    def disable(self, source: str):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._sources.discard(source)
+
+    def peek(self, key: str) -> Any:
+        """The cached value for `key` if it is current, else None (never builds)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == self.version:
+                self.hits += 1
+                return entry[1]
+            return None
+
+    def get(self, key: str, build: Callable[[], Any]) -> Any:
+        with self._lock:
+            version = self.version
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            enabled = self.enabled
+        value = build()
+        if enabled:
+            with self._lock:
+                if self.version == version and self.enabled:
+                    self._entries[key] = (version, value)
+        return value
@@ -0,0 +1,88 @@
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+import redis
+
+from schema import CHANGES_CHANNEL, CHANGES_VERSION_KEY, STORE_ID_KEY
+
+# Nodes on one Redis already see each other's writes, so instead of HTTP
+# syncs they only tell each other "the queue changed": every change bumps a
+# version counter and publishes "<version> <node id>" on CHANGES_CHANNEL in
+# one script, and subscribers drop their read caches. Which peers share a
+# store is found by comparing store ids in the membership health checks.
+
+# KEYS: version counter; ARGV: channel, node id. Returns the new version.
+ANNOUNCE = """
+local version = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], version .. ' ' .. ARGV[2])
+return version
+"""
+
+
+# KEYS: clock counter; ARGV: a peer's clock. Moves the counter up to the
+# peer's clock if that is ahead and returns the result.
+RAISE_CLOCK = """
+local clock = tonumber(redis.call('GET', KEYS[1]) or '0')
+local seen = tonumber(ARGV[1])
+if seen > clock then
+  redis.call('SET', KEYS[1], ARGV[1])
+  return seen
+end
+return clock
+"""
+
+
+def announce_args(node_id: str) -> Tuple[list, list]:
+    return [CHANGES_VERSION_KEY], [CHANGES_CHANNEL, node_id]
+
+
+def parse_change(data) -> Optional[Tuple[int, str]]:
+    """(version, node id) from a CHANGES_CHANNEL message, or None if malformed."""
+    if isinstance(data, bytes):
+        data = data.decode()
+    version, _, node = data.partition(" ")
+    try:
+        return int(version), node
+    except ValueError:
+        return None
+
+
+def store_id(client) -> str:
+    """This Redis' store id. `client` decodes responses.
+
+    A random key created on first use, plus the server's run id: a server
+    restored from another one's backup holds the same key, but it is not the
+    same store. The run id changes on restart too, which only costs peers a
+    few redundant syncs until they recheck."""
+    found = client.get(STORE_ID_KEY)
+    if found is None:
+        client.set(STORE_ID_KEY, uuid.uuid4().hex, nx=True)
+        found = client.get(STORE_ID_KEY)
+    try:
+        run_id = client.info("server").get("run_id")
+    except redis.ResponseError:
+        run_id = None  # INFO disabled: the key alone
+    return f"{found}:{run_id}" if run_id else found
+
+
+class StoreId:
+    """store_id(client), re-read at most every `ttl` seconds.
+
+    Sync payloads carry it so that a receiver on the same Redis can drop
+    writes it already has; re-reading notices a store wiped and re-created."""
+
+    def __init__(self, client, ttl: float):
+        self.client = client
+        self.ttl = ttl
+        self._value: Optional[str] = None
+        self._read = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> str:
+        with self._lock:
+            if self._value is None or time.monotonic() - self._read >= self.ttl:
+                self._value = store_id(self.client)
+                self._read = time.monotonic()
+            return self._value
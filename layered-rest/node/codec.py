@@ -0,0 +1,93 @@
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:  # optional; only needed for TRACK_CODEC=msgpack
+    msgpack = None
+
+
+# Track records as stored in Redis. Every encoding is self-identifying by its
+# first byte, so records written with any codec (including the original
+# pydantic .json() text) can be read back whatever TRACK_CODEC is set to now.
+MSGPACK_TAG = b"\x01"
+STRUCT_TAG = b"\x02"
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, record: dict) -> bytes:
+        return json.dumps(record, separators=(",", ":")).encode()
+
+    def decode(self, data: bytes) -> dict:
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ValueError("TRACK_CODEC=msgpack requires the msgpack package")
+
+    def encode(self, record: dict) -> bytes:
+        fields = [record["id"], record["title"], record["artist"], record["duration"], record.get("votes", 0)]
+        return MSGPACK_TAG + msgpack.packb(fields)
+
+    def decode(self, data: bytes) -> dict:
+        track_id, title, artist, duration, votes = msgpack.unpackb(data[1:])
+        return {"id": track_id, "title": title, "artist": artist, "duration": duration, "votes": votes}
+
+
+class StructCodec:
+    """Fixed header (id, duration, votes, string lengths) followed by UTF-8 title and artist."""
+
+    name = "struct"
+    header = struct.Struct("<qiqHH")
+
+    def encode(self, record: dict) -> bytes:
+        title = record["title"].encode()
+        artist = record["artist"].encode()
+        head = self.header.pack(record["id"], record["duration"], record.get("votes", 0), len(title), len(artist))
+        return STRUCT_TAG + head + title + artist
+
+    def decode(self, data: bytes) -> dict:
+        track_id, duration, votes, title_len, artist_len = self.header.unpack_from(data, 1)
+        offset = 1 + self.header.size
+        title = data[offset:offset + title_len].decode()
+        artist = data[offset + title_len:offset + title_len + artist_len].decode()
+        return {"id": track_id, "title": title, "artist": artist, "duration": duration, "votes": votes}
+
+
+CODECS = {"json": JsonCodec, "msgpack": MsgpackCodec, "struct": StructCodec}
+
+_json = JsonCodec()
+_struct = StructCodec()
+_msgpack = None
+
+
+def get_codec(name: str):
+    if name not in CODECS:
+        raise ValueError(f"Unknown TRACK_CODEC {name!r}, expected one of {sorted(CODECS)}")
+    return CODECS[name]()
+
+
+def encode_record(codec, record: dict) -> bytes:
+    try:
+        return codec.encode(record)
+    except (struct.error, OverflowError):
+        # Values outside the fixed layout (e.g. ids beyond 64 bits) fall back to JSON
+        return _json.encode(record)
+
+
+def decode_record(data: bytes) -> dict:
+    global _msgpack
+    tag = data[:1]
+    if tag == STRUCT_TAG:
+        return _struct.decode(data)
+    if tag == MSGPACK_TAG:
+        if _msgpack is None:
+            _msgpack = MsgpackCodec()
+        return _msgpack.decode(data)
+    return _json.decode(data)
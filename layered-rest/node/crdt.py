@@ -0,0 +1,281 @@
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from codec import decode_record, encode_record
+from schema import (
+    CRDT_IDS_KEY, CRDT_PLAYED_KEY, QUEUE_KEY, TRACKS_KEY,
+    crdt_keys, member_track_id, queue_member,
+)
+
+# Queue state as CRDTs (SYNC_MODE=crdt), so every node can write to its own
+# Redis and merge peer state in any order, any number of times.
+#
+# Per track id:
+#   adds    OR-set add entries, unique tag -> encoded record
+#   removed OR-set tombstones: tags observed when the track was removed/played
+#   votes   PN-counter components, "<tag>|<node>|p" or "...|n" -> count; each
+#           node only ever increments its own components, merges take the max
+# and globally a played log (sorted set of add tag -> first play time).
+#
+# A track is queued while any add tag is not tombstoned; its votes are the
+# counters of its live tags, so re-adding a removed track starts from the
+# new add's votes. Every script ends by materializing that id into the normal
+# music_queue:order / music_queue:tracks keys, so all read paths are unchanged.
+
+_MATERIALIZE = """
+local function live_tags()
+  local adds = redis.call('HGETALL', KEYS[1])
+  local live, first, body = {}, nil, nil
+  for i = 1, #adds, 2 do
+    if redis.call('SISMEMBER', KEYS[2], adds[i]) == 0 then
+      live[adds[i]] = true
+      if first == nil or adds[i] < first then
+        first, body = adds[i], adds[i + 1]
+      end
+    end
+  end
+  return live, first, body
+end
+
+local function materialize()
+  local live, first, body = live_tags()
+  if first == nil then
+    redis.call('ZREM', KEYS[4], ARGV[1])
+    redis.call('HDEL', KEYS[5], ARGV[2])
+    return false
+  end
+  local total = 0
+  local counters = redis.call('HGETALL', KEYS[3])
+  for i = 1, #counters, 2 do
+    local tag, sign = string.match(counters[i], '^([^|]*)|[^|]*|([pn])$')
+    if live[tag] then
+      if sign == 'p' then
+        total = total + tonumber(counters[i + 1])
+      else
+        total = total - tonumber(counters[i + 1])
+      end
+    end
+  end
+  redis.call('HSET', KEYS[5], ARGV[2], body)
+  redis.call('ZADD', KEYS[4], -total, ARGV[1])
+  return total
+end
+
+local function tombstone_all()
+  local tombstoned = {}
+  for _, tag in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if redis.call('SADD', KEYS[2], tag) == 1 then
+      table.insert(tombstoned, tag)
+    end
+  end
+  return tombstoned
+end
+"""
+
+# KEYS: adds, removed, votes, queue, tracks, ids, played
+# ARGV: member, id, tag, body, initial votes field ('' for none), its count
+_ADD = _MATERIALIZE + """
+local replaced = #tombstone_all()
+redis.call('HSET', KEYS[1], ARGV[3], ARGV[4])
+if ARGV[5] ~= '' then
+  redis.call('HSET', KEYS[3], ARGV[5], ARGV[6])
+end
+redis.call('SADD', KEYS[6], ARGV[2])
+materialize()
+return replaced
+"""
+
+# ARGV: member, id, play time ('' when removed rather than played)
+_REMOVE = _MATERIALIZE + """
+local tombstoned = tombstone_all()
+if #tombstoned > 0 and ARGV[3] ~= '' then
+  table.sort(tombstoned)
+  redis.call('ZADD', KEYS[7], 'NX', ARGV[3], tombstoned[1])
+end
+materialize()
+return #tombstoned
+"""
+
+# ARGV: member, id, node, delta
+_VOTE = _MATERIALIZE + """
+local live, first = live_tags()
+if first == nil then
+  return false
+end
+local delta = tonumber(ARGV[4])
+local sign = 'p'
+if delta < 0 then
+  sign, delta = 'n', -delta
+end
+redis.call('HINCRBY', KEYS[3], first .. '|' .. ARGV[3] .. '|' .. sign, delta)
+return materialize()
+"""
+
+# ARGV: member, id, then counted sections: adds (tag, body), tombstones (tag),
+# vote counters (field, count), plays (tag, time).
+# Returns {votes before or false, votes after or false, newly played tags}.
+_MERGE = _MATERIALIZE + """
+local before = redis.call('ZSCORE', KEYS[4], ARGV[1])
+local i = 3
+local n = tonumber(ARGV[i]); i = i + 1
+for _ = 1, n do
+  redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1]); i = i + 2
+end
+n = tonumber(ARGV[i]); i = i + 1
+for _ = 1, n do
+  redis.call('SADD', KEYS[2], ARGV[i]); i = i + 1
+end
+n = tonumber(ARGV[i]); i = i + 1
+for _ = 1, n do
+  local current = tonumber(redis.call('HGET', KEYS[3], ARGV[i]) or '0')
+  if tonumber(ARGV[i + 1]) > current then
+    redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 1])
+  end
+  i = i + 2
+end
+local played = {}
+n = tonumber(ARGV[i]); i = i + 1
+for _ = 1, n do
+  if redis.call('ZADD', KEYS[7], 'NX', ARGV[i + 1], ARGV[i]) == 1 then
+    table.insert(played, ARGV[i])
+  else
+    redis.call('ZADD', KEYS[7], 'LT', ARGV[i + 1], ARGV[i])
+  end
+  i = i + 2
+end
+redis.call('SADD', KEYS[6], ARGV[2])
+if before then
+  before = -tonumber(before)
+end
+return {before, materialize(), played}
+"""
+
+
+def tag_votes(counters: dict, tag: str) -> int:
+    """Net votes recorded against one add tag."""
+    total = 0
+    for field, count in counters.items():
+        counter_tag, _, sign = field.split("|")
+        if counter_tag == tag:
+            total += count if sign == "p" else -count
+    return total
+
+
+class CrdtQueue:
+    """The queue as an OR-set of tracks with PN-counter votes, stored in one
+    node's own Redis (see the layout above). Local writes and peer merges are
+    single Lua scripts, so each one is atomic and leaves the materialized
+    queue keys consistent with the CRDT state."""
+
+    def __init__(self, client, node_id: str, codec):
+        self.client = client  # raw-bytes client: adds hold encoded records
+        self.node_id = node_id
+        self.codec = codec
+        self._add = client.register_script(_ADD)
+        self._remove = client.register_script(_REMOVE)
+        self._vote = client.register_script(_VOTE)
+        self._merge = client.register_script(_MERGE)
+
+    def _keys(self, track_id: int) -> List[str]:
+        return [*crdt_keys(track_id), QUEUE_KEY, TRACKS_KEY, CRDT_IDS_KEY, CRDT_PLAYED_KEY]
+
+    def _new_tag(self) -> str:
+        return f"{self.node_id}.{uuid.uuid4().hex[:16]}"
+
+    def _add_args(self, record: dict) -> list:
+        tag = self._new_tag()
+        votes = record.get("votes", 0)
+        field = f"{tag}|{self.node_id}|{'p' if votes >= 0 else 'n'}" if votes else ""
+        body = encode_record(self.codec, {**record, "votes": 0})
+        return [queue_member(record["id"]), str(record["id"]), tag, body, field, abs(votes)]
+
+    def add_many(self, records: List[dict]) -> List[bool]:
+        """Add (or replace) tracks; True for each id that was not queued before."""
+        pipe = self.client.pipeline()
+        for record in records:
+            self._add(self._keys(record["id"]), self._add_args(record), client=pipe)
+        return [replaced == 0 for replaced in pipe.execute()]
+
+    def remove(self, track_id: int, played_at: Optional[float] = None) -> bool:
+        args = [queue_member(track_id), str(track_id), "" if played_at is None else repr(played_at)]
+        return self._remove(self._keys(track_id), args) > 0
+
+    def vote_many(self, deltas: List[Tuple[int, int]]) -> List[Optional[int]]:
+        """Apply (id, delta) pairs to this node's counters; new totals, None where not queued."""
+        pipe = self.client.pipeline()
+        for track_id, delta in deltas:
+            self._vote(self._keys(track_id), [queue_member(track_id), str(track_id), self.node_id, delta],
+                       client=pipe)
+        return pipe.execute()
+
+    def pop(self) -> Optional[Tuple[bytes, float]]:
+        """Remove the top track and log it as played; (record body, score) or None."""
+        while True:
+            top = self.client.zrange(QUEUE_KEY, 0, 0, withscores=True)
+            if not top:
+                return None
+            member, score = top[0]
+            track_id = member_track_id(member)
+            body = self.client.hget(TRACKS_KEY, str(track_id))
+            # Lost a race with another remove: try the new top
+            if self.remove(track_id, played_at=time.time()) and body is not None:
+                return body, score
+
+    def live_ids(self) -> List[int]:
+        """Ids currently queued, from the materialized queue."""
+        return [member_track_id(m) for m in self.client.zrange(QUEUE_KEY, 0, -1)]
+
+    def export(self, track_ids: Optional[List[int]] = None) -> dict:
+        """CRDT state of the given ids (all ids if None) in the /sync/crdt format."""
+        if track_ids is None:
+            track_ids = sorted(int(i) for i in self.client.smembers(CRDT_IDS_KEY))
+        pipe = self.client.pipeline(transaction=False)
+        for track_id in track_ids:
+            adds_key, removed_key, votes_key = crdt_keys(track_id)
+            pipe.hgetall(adds_key)
+            pipe.smembers(removed_key)
+            pipe.hgetall(votes_key)
+        replies = pipe.execute()
+        tracks = {}
+        for n, track_id in enumerate(track_ids):
+            adds, removed, votes = replies[3 * n:3 * n + 3]
+            if not adds:
+                continue
+            tracks[track_id] = {
+                "adds": {tag.decode(): decode_record(body) for tag, body in adds.items()},
+                "removed": sorted(tag.decode() for tag in removed),
+                "votes": {field.decode(): int(count) for field, count in votes.items()},
+            }
+        tags = [tag for state in tracks.values() for tag in state["removed"]]
+        times = self.client.zmscore(CRDT_PLAYED_KEY, tags) if tags else []
+        played = dict(zip(tags, times))
+        for state in tracks.values():
+            state["played"] = {tag: played[tag] for tag in state["removed"] if played[tag] is not None}
+        return {"tracks": tracks}
+
+    def merge(self, state: dict) -> List[Tuple[int, Optional[int], Optional[int], List[dict]]]:
+        """Merge exported state; per id (id, votes before, votes after, newly played records)."""
+        track_ids = list(state["tracks"])
+        pipe = self.client.pipeline()
+        for track_id in track_ids:
+            s = state["tracks"][track_id]
+            args = [queue_member(track_id), str(track_id), len(s["adds"])]
+            for tag, record in s["adds"].items():
+                args += [tag, encode_record(self.codec, {**record, "votes": 0})]
+            args.append(len(s["removed"]))
+            args += s["removed"]
+            args.append(len(s["votes"]))
+            for field, count in s["votes"].items():
+                args += [field, count]
+            args.append(len(s["played"]))
+            for tag, played_at in s["played"].items():
+                args += [tag, repr(float(played_at))]
+            self._merge(self._keys(track_id), args, client=pipe)
+        results = []
+        for track_id, (before, after, played) in zip(track_ids, pipe.execute()):
+            s = state["tracks"][track_id]
+            played = sorted((tag.decode() for tag in played), key=lambda tag: s["played"][tag])
+            records = [{**s["adds"][tag], "votes": tag_votes(s["votes"], tag)} for tag in played if tag in s["adds"]]
+            results.append((track_id, before, after, records))
+        return results
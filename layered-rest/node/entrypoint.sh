@@ -24,6 +24,8 @@ else
   echo "[entrypoint] Using default PEER_NODES: $PEER_NODES"
 fi
 
-echo "[entrypoint] Starting FastAPI app with uvicorn..."
-exec uvicorn main:app --host 0.0.0.0 --port 8000
+# APP_MODULE=main_async:app runs the asyncio implementation instead
+APP_MODULE=${APP_MODULE:-main:app}
+echo "[entrypoint] Starting FastAPI app $APP_MODULE with uvicorn..."
+exec uvicorn "$APP_MODULE" --host 0.0.0.0 --port 8000
 
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+
+class ChangeFeed:
+    """Fans queue change events from one Redis pub/sub subscription out to
+    local streaming listeners.
+
+    Each event is rendered into a Server-Sent Events frame once, then handed
+    to every listener's bounded asyncio queue on that listener's event loop.
+    A listener that falls `queue_size` events behind gets a single `None`
+    marker and is expected to resync from GET /queue."""
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self.events = 0
+        self._listeners: Dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def listeners(self) -> int:
+        return len(self._listeners)
+
+    def subscribe(self) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._listeners[q] = asyncio.get_running_loop()
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        with self._lock:
+            self._listeners.pop(q, None)
+
+    def dispatch(self, message: str):
+        """Called from the subscriber thread with one published event."""
+        event = json.loads(message)
+        frame = f"event: {event.pop('type')}\ndata: {json.dumps(event)}\n\n"
+        self.events += 1
+        with self._lock:
+            listeners = list(self._listeners.items())
+        for q, loop in listeners:
+            loop.call_soon_threadsafe(self._offer, q, frame)
+
+    def _offer(self, q: asyncio.Queue, frame: Optional[str]):
+        try:
+            q.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Too far behind: replace the backlog with a single resync marker
+            while not q.empty():
+                q.get_nowait()
+            q.put_nowait(None)
+            self.unsubscribe(q)
+
+    def run(self, redis_client, channel: str):
+        """Blocking subscriber loop; run it on one daemon thread per process."""
+        while True:
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                log.info("Change feed subscribed to %s", channel)
+                for message in pubsub.listen():
+                    self.dispatch(message["data"])
+            except Exception as e:
+                log.error("Change feed subscription failed: %s", e)
+                # Listeners may have missed events while we were disconnected
+                with self._lock:
+                    listeners = list(self._listeners.items())
+                for q, loop in listeners:
+                    loop.call_soon_threadsafe(self._offer, q, None)
+                time.sleep(1)
@@ -0,0 +1,83 @@
+from typing import Iterable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from rooms import split_room_path
+
+HEADER = b"idempotency-key"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyMiddleware:
+    """Plain ASGI middleware that makes retried POSTs safe.
+
+    A request to one of `paths` (or its /rooms/{room} form) carrying an Idempotency-Key header first
+    reserves `<prefix><path>:<key>` in Redis with SET NX for `lock_ttl`
+    seconds. The first request runs normally and its response (status,
+    content type, body) replaces the reservation for `ttl` seconds. Later
+    requests with the same key get that stored response back with
+    Idempotent-Replayed: true, without reaching the endpoint; while the first
+    one is still running they get 409. If the process dies mid-request, the
+    reservation lapses after `lock_ttl` and a retry runs again. Responses
+    with a 5xx status are not stored, so those can be retried."""
+
+    def __init__(self, app, redis_client, paths: Iterable[str], ttl: int, lock_ttl: int, prefix: str):
+        self.app = app
+        self.redis = redis_client  # raw-bytes client
+        self.paths = frozenset(paths)
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        value = self._header(scope) if scope["type"] == "http" else None
+        if value is None:
+            return await self.app(scope, receive, send)
+        if not value or len(value) > MAX_KEY_LENGTH:
+            return await self._send(send, 400, b"application/json",
+                                    b'{"detail":"Idempotency-Key must be 1 to 255 characters"}')
+        key = b"%s%s:%s" % (self.prefix.encode(), scope["path"].encode(), value)
+
+        reserved = await run_in_threadpool(self.redis.set, key, b"", nx=True, ex=self.lock_ttl)
+        if not reserved:
+            stored = await run_in_threadpool(self.redis.get, key)
+            if not stored:
+                return await self._send(send, 409, b"application/json",
+                                        b'{"detail":"A request with this Idempotency-Key is in progress"}')
+            status, content_type, body = stored.split(b"\n", 2)
+            return await self._send(send, int(status), content_type, body, replayed=True)
+
+        response = {"status": 500, "content_type": b"", "body": []}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["content_type"] = dict(message.get("headers", [])).get(b"content-type", b"")
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            if response["status"] < 500:
+                stored = b"%d\n%s\n%s" % (response["status"], response["content_type"], b"".join(response["body"]))
+                await run_in_threadpool(self.redis.set, key, stored, ex=self.ttl)
+            else:
+                await run_in_threadpool(self.redis.delete, key)
+
+    def _header(self, scope) -> Optional[bytes]:
+        if scope["method"] != "POST" or split_room_path(scope["path"])[1] not in self.paths:
+            return None
+        for name, value in scope["headers"]:
+            if name == HEADER:
+                return value
+        return None
+
+    @staticmethod
+    async def _send(send, status: int, content_type: bytes, body: bytes, replayed: bool = False):
+        headers = [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]
+        if replayed:
+            headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,83 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Canonical copy: consensus/log.py and microservices-grpc/queue-service/log.py
+# are copies of this file, so carry fixes over to them.
+#
+# Leveled logging for the REST node. Records go through an in-memory queue to
+# one background writer thread, so a request never blocks on stdout, and a
+# call below LOG_LEVEL returns before its message is formatted. Pass values as
+# arguments (log.debug("queue: %s", queue)), not f-strings, to keep that free.
+#   LOG_LEVEL   DEBUG | INFO (default) | WARNING | ERROR; production runs at WARNING
+#   LOG_SAMPLE  records per second allowed for any one message (default 10, 0 = no limit)
+LOG_FORMAT = "[%(levelname)s] %(message)s"
+DEFAULT_SAMPLE = 10
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class SampleFilter(logging.Filter):
+    """Passes at most `per_second` records per logger and message template each
+    second, and notes how many were dropped on the next one let through."""
+
+    def __init__(self, per_second: int):
+        super().__init__()
+        self.per_second = per_second
+        self._windows = {}  # (logger, template) -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                self._windows[key] = [now, 1, 0]
+                if window is not None and window[2]:
+                    record.msg = f"{record.msg} ({window[2]} similar suppressed)"
+                return True
+            if window[1] < self.per_second:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def _level(name: str) -> int:
+    level = logging.getLevelName(name.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown LOG_LEVEL {name!r}")
+    return level
+
+def _start() -> logging.handlers.QueueListener:
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    sample = int(os.getenv("LOG_SAMPLE", str(DEFAULT_SAMPLE)))
+    if sample > 0:
+        handler.addFilter(SampleFilter(sample))
+    root = logging.getLogger()
+    root.setLevel(_level(os.getenv("LOG_LEVEL", "INFO")))
+    root.addHandler(handler)
+    # httpx logs every request at INFO; only its warnings belong in our output
+    logging.getLogger("httpx").setLevel(max(root.level, logging.WARNING))
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(records, stream)
+    listener.start()
+    atexit.register(listener.stop)  # drains what is still queued
+    return listener
+
+
+def get_logger(name: str) -> logging.Logger:
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            _listener = _start()
+    return logging.getLogger(name)
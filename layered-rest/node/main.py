@@ -1,153 +1,1308 @@
 
+import asyncio
+import hashlib
 import os
-import requests
+import socket
+import threading
+import time
+import uuid
 import redis
 import json
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
+from admission import AdmissionMiddleware
+from archive import INDEX_SINCE, HistoryArchive, archive_step
+from cache import ReadCache
+from changes import ANNOUNCE, RAISE_CLOCK, StoreId, announce_args, parse_change
+from crdt import CrdtQueue
+from codec import decode_record, encode_record, get_codec
+from feed import ChangeFeed
+from idempotency import IdempotencyMiddleware
+from log import get_logger
+from membership import Membership, parse_peers
+from metrics import (
+    SIZE_BUCKETS, Callback, Counter, Histogram, MetricsMiddleware, Registry, instrument_redis,
+)
+from models import CrdtState, SyncOp, Track, TrackAction, Vote
+from schema import (
+    ARCHIVER_LOCK_KEY, CHANGES_CHANNEL, CLOCK_KEY, CRDT_KEY_PREFIX, EVENTS_CHANNEL, HISTORY_COUNT_KEY, HISTORY_TIMES_KEY, IDEMPOTENCY_KEY_PREFIX, RATE_LIMIT_KEY_PREFIX, HISTORY_KEY, LEGACY_QUEUE_KEY, QUEUE_KEY, TRACKS_KEY,
+    STATS_KEY_PREFIX, TOP_ARTISTS_KEY, TOP_TRACKS_KEY, VOTERS_KEY_PREFIX, member_track_id, queue_member, ranked_record, voters_key,
+)
+from peers import Broadcaster, Coalescer
+from replicas import ReplicaRouter, parse_replicas
+from topk import HeavyHitters
+from rooms import RoomStore, ShardedRooms, parse_shards, valid_room
+from votes import CLAIM_VOTES, VoteAccumulator, claim_args, claim_results
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Optional, Tuple
+
+log = get_logger(__name__)
+
+
+# Prometheus metrics, served at GET /metrics (see metrics.py)
+metrics = Registry()
+http_latency = metrics.register(Histogram(
+    "http_request_duration_seconds", "Time to response headers by route", ("method", "route")))
+http_requests = metrics.register(Counter(
+    "http_requests_total", "Requests by route and status code", ("method", "route", "status")))
+redis_latency = metrics.register(Histogram(
+    "redis_command_duration_seconds", "Redis round trips by command (pipelines as MULTI or PIPELINE)", ("command",)))
+broadcast_latency = metrics.register(Histogram(
+    "sync_broadcast_duration_seconds", "Request-path time spent building and queueing a peer sync", ("path",)))
+sync_payload = metrics.register(Histogram(
+    "sync_payload_bytes", "Encoded size of sync payloads sent to or fetched from peers", ("path",), SIZE_BUCKETS))
+peer_latency = metrics.register(Histogram(
+    "peer_send_duration_seconds", "Delivery time of one sync message, per peer", ("peer",)))
+peer_failures = metrics.register(Counter(
+    "peer_send_failures_total", "Failed sync deliveries, per peer", ("peer",)))
+admission_rejected = metrics.register(Counter(
+    "admission_rejected_total", "Requests answered 429 by admission control", ("reason",)))
+
+
+def record_send(peer: str, seconds: float, ok: bool):
+    peer_latency.observe(seconds, peer)
+    if not ok:
+        peer_failures.inc(peer)
+
+def record_broadcast(path: str, start: float, size: int):
+    broadcast_latency.observe(time.perf_counter() - start, path)
+    if size:
+        sync_payload.observe(size, path)
 
 
 # Redis connection
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+# Track records are binary (see codec.py), so they go through a raw-bytes client
+redis_bin = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+instrument_redis(redis_client, redis_latency)
+instrument_redis(redis_bin, redis_latency)
 
-app = FastAPI()
+# Read replicas of REDIS_HOST ("host:port,..."). /queue pages, /metadata and
+# /history read from a replica that has caught up to within
+# REPLICA_MAX_STALENESS_MS of the primary, else from the primary. Replica
+# reads can be up to three check intervals old (see replicas.py). The read
+# cache is always filled from the primary, so it never holds stale data.
+REDIS_REPLICAS = parse_replicas(os.getenv("REDIS_REPLICAS", ""))
+REPLICA_MAX_STALENESS_MS = float(os.getenv("REPLICA_MAX_STALENESS_MS", "1000"))
+replicas = ReplicaRouter(redis_bin, REDIS_REPLICAS, REPLICA_MAX_STALENESS_MS / 3000)
+for replica_client in replicas.replicas.values():
+    instrument_redis(replica_client, redis_latency)
+
+# Encoding for newly written track records: struct (default), msgpack or json
+TRACK_CODEC = get_codec(os.getenv("TRACK_CODEC", "struct"))
+
+# Peer synchronization: "delta" sends one sequenced op per mutation,
+# "full" pushes the whole queue to every peer (the original behaviour), and
+# "crdt" gives every node its own Redis and exchanges mergeable state.
+SYNC_MODE = os.getenv("SYNC_MODE", "delta")
+NODE_URL = os.getenv("NODE_URL", f"http://{socket.gethostname()}:8000")
+NODE_EPOCH = uuid.uuid4().hex  # changes on restart so peers reset their sequence
+
+# CRDT queue state (see crdt.py). NODE_ID names this node's vote counters and
+# add tags, so it must be unique per node and should survive restarts.
+NODE_ID = os.getenv("NODE_ID", hashlib.blake2b(NODE_URL.encode(), digest_size=4).hexdigest())
+crdt = CrdtQueue(redis_bin, NODE_ID, TRACK_CODEC) if SYNC_MODE == "crdt" else None
+
+# Peer fan-out runs on background sender threads, one bounded queue per peer
+broadcaster = Broadcaster(
+    queue_size=int(os.getenv("BROADCAST_QUEUE_SIZE", "1000")),
+    timeout=float(os.getenv("PEER_TIMEOUT", "3")),
+    failure_threshold=int(os.getenv("PEER_FAILURE_THRESHOLD", "3")),
+    cooldown=float(os.getenv("PEER_COOLDOWN", "10")),
+    on_send=record_send,
+)
+
+# Id of the Redis this node writes to (see changes.py). Sync payloads carry
+# it, and a peer on the same Redis drops them: the writes are already there,
+# and re-applying absolute votes or a snapshot would clobber newer ones.
+MEMBERSHIP_INTERVAL = float(os.getenv("MEMBERSHIP_INTERVAL", "5"))
+local_store = StoreId(redis_client, MEMBERSHIP_INTERVAL)
 
-# Models
-class Track(BaseModel):
-    id: int
-    title: str
-    artist: str
-    duration: int  # seconds
-    votes: int = 0
+# Peers to sync with: PEER_NODES (comma-separated URLs) plus every address
+# PEER_DNS ("host:port", e.g. the Compose service name) resolves to. Both are
+# re-read and health-checked every MEMBERSHIP_INTERVAL seconds; syncs only go
+# to peers that pass (see membership.py). Peers that turn out to use the same
+# Redis get no HTTP syncs at all, only change notifications (see changes.py).
+membership = Membership(
+    static=parse_peers(os.getenv("PEER_NODES", "")),
+    dns=os.getenv("PEER_DNS", ""),
+    node_url=NODE_URL,
+    session=broadcaster.session,
+    timeout=broadcaster.timeout,
+    interval=MEMBERSHIP_INTERVAL,
+    failure_threshold=broadcaster.failure_threshold,
+    store_id=local_store,
+    on_leave=broadcaster.remove,
+)
 
-class TrackAction(BaseModel):
-    id: int
+# Play history keeps at most this many entries in Redis (0 = unbounded)
+HISTORY_MAX = int(os.getenv("HISTORY_MAX", "10000"))
 
+# Most played tracks and artists for GET /stats/top, counted on every play in
+# Space-Saving summaries of TOP_CAPACITY entries each (see topk.py)
+TOP_CAPACITY = int(os.getenv("TOP_CAPACITY", "1000"))
+top_tracks = HeavyHitters(redis_bin, TOP_TRACKS_KEY, TOP_CAPACITY)
+top_artists = HeavyHitters(redis_bin, TOP_ARTISTS_KEY, TOP_CAPACITY)
 
-# Redis-backed storage
-QUEUE_KEY = "music_queue"
-HISTORY_KEY = "music_history"
+# Tiered history: with HISTORY_ARCHIVE set (an SQLite file shared by all
+# nodes), entries beyond the newest ARCHIVE_KEEP, or played more than
+# ARCHIVE_AGE_HOURS ago, are moved from Redis into compressed segments there
+# instead of being trimmed, and /history reads across both tiers. HISTORY_MAX
+# then no longer applies to the play history.
+HISTORY_ARCHIVE = os.getenv("HISTORY_ARCHIVE", "")
+ARCHIVE_KEEP = int(os.getenv("ARCHIVE_KEEP", "1000"))
+ARCHIVE_AGE_HOURS = float(os.getenv("ARCHIVE_AGE_HOURS", "24"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "60"))
+ARCHIVE_BATCH = 1000  # entries per segment
+# Archived history grows without bound, so with the archive on /history
+# returns HISTORY_PAGE_SIZE entries when no limit is given and never more
+# than HISTORY_PAGE_MAX; X-Next-Cursor continues from there.
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "1000"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "10000"))
+archive = HistoryArchive(HISTORY_ARCHIVE) if HISTORY_ARCHIVE else None
+
+# Read cache for /queue and /metadata. Writes made by other nodes against the
+# shared Redis invalidate it, reported by keyspace notifications and by the
+# nodes' own change notifications; it serves hits while either is subscribed.
+READ_CACHE = os.getenv("READ_CACHE", "1") == "1"
+read_cache = ReadCache()
+_announce = redis_client.register_script(ANNOUNCE)
+changes_seen = {"version": 0, "received": 0}
+
+# Change feed: one Redis subscription per node, fanned out to SSE listeners
+change_feed = ChangeFeed(queue_size=int(os.getenv("FEED_QUEUE_SIZE", "256")))
+FEED_PING_SECONDS = 15
+
+# Largest number of items accepted by /add_tracks and /votes
+MAX_BATCH = int(os.getenv("MAX_BATCH", "1000"))
+
+# One vote per listener per track, keyed by X-Listener-Id: "off" (default),
+# "set" (a Redis set of listener ids per track) or "bitmap" (one bit per
+# numeric listener id per track). Voter keys expire VOTERS_TTL seconds after
+# the track's last vote and are dropped when the track leaves the queue.
+VOTE_DEDUP = os.getenv("VOTE_DEDUP", "off")
+VOTERS_TTL = int(os.getenv("VOTERS_TTL", "86400"))
+# Largest listener id accepted in bitmap mode. A bitmap is as long as its
+# largest id, so this caps the memory one request can make a track's voter
+# key take: 2^20 ids is 128 KB of bits (up to ~256 KB allocated, see the
+# README), while Redis would go up to 2^32 (512 MB).
+BITMAP_MAX_LISTENER = min(int(os.getenv("BITMAP_MAX_LISTENER", str(2 ** 20 - 1))), 2 ** 32 - 1)
+
+# Single /vote calls are summed in memory and folded into the queue every
+# this many milliseconds (0 = apply each vote immediately)
+VOTE_FLUSH_MS = float(os.getenv("VOTE_FLUSH_MS", "0"))
+
+# Mutations within this many milliseconds are merged into one peer sync (0 = off)
+COALESCE_WINDOW_MS = float(os.getenv("COALESCE_WINDOW_MS", "0"))
+
+# Anti-entropy: every this many seconds each peer's queue digest is compared
+# with ours and a snapshot is pulled only if they differ (0 = off)
+ANTI_ENTROPY_SECONDS = float(os.getenv("ANTI_ENTROPY_SECONDS", "5"))
+
+# Responses to POSTs sent with an Idempotency-Key are kept this many seconds,
+# and a retry with the same key gets the stored response back
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# How long a key stays reserved while its first request runs; a retry after a
+# crashed request waits this long, not IDEMPOTENCY_TTL
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", "30"))
+IDEMPOTENT_PATHS = ("/add_track", "/remove_track", "/vote", "/add_tracks", "/votes", "/play_next")
+
+# Admission control: token buckets per client (X-Real-IP from nginx) and per
+# room (X-Room) in requests/second with a burst size (rate 0 = no limit), and a
+# cap on requests in progress in this process (0 = no cap). Over either limit
+# a request gets 429 with Retry-After instead of queueing up on Redis.
+CLIENT_RATE = float(os.getenv("CLIENT_RATE", "0"))
+CLIENT_BURST = int(os.getenv("CLIENT_BURST", "20"))
+ROOM_RATE = float(os.getenv("ROOM_RATE", "0"))
+ROOM_BURST = int(os.getenv("ROOM_BURST", "200"))
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", "256"))
+UNLIMITED_PATHS = ("/sync", "/metrics", "/queue/events")
+
+# Room-scoped queues (/rooms/{room}/...) are spread over these Redis shards by
+# a consistent-hash ring on the room name (see rooms.py): comma-separated
+# "name=host:port" or "host:port" entries. Every node must list the same
+# shards; after changing the list, move rooms with rebalance.py.
+REDIS_SHARDS = parse_shards(os.getenv("REDIS_SHARDS", f"{REDIS_HOST}:{REDIS_PORT}"))
+rooms = ShardedRooms(REDIS_SHARDS, TRACK_CODEC, HISTORY_MAX)
+for shard_client in rooms.clients.values():
+    instrument_redis(shard_client, redis_latency)
+
+app = FastAPI()
+# Added last runs first: metrics see every response, including 429s and replays
+app.add_middleware(IdempotencyMiddleware, redis_client=redis_bin, paths=IDEMPOTENT_PATHS,
+                   ttl=IDEMPOTENCY_TTL, lock_ttl=IDEMPOTENCY_LOCK_TTL, prefix=IDEMPOTENCY_KEY_PREFIX)
+app.add_middleware(AdmissionMiddleware, redis_client=redis_client, client_rate=CLIENT_RATE,
+                   client_burst=CLIENT_BURST, room_rate=ROOM_RATE, room_burst=ROOM_BURST,
+                   max_inflight=MAX_INFLIGHT, exempt=UNLIMITED_PATHS, prefix=RATE_LIMIT_KEY_PREFIX,
+                   rejected=admission_rejected)
+app.add_middleware(MetricsMiddleware, latency=http_latency, requests=http_requests)
+
+# Redis-backed storage (key layout and ordering are described in schema.py)
 
 
 def get_peers():
-    peers = os.getenv("PEER_NODES", "")
-    print(f"[DEBUG] PEER_NODES: {peers}")
-    return [p.strip() for p in peers.split(",") if p.strip()]
+    # Peers on our own Redis already have every write
+    return membership.remote()
+
+
+# Storage helpers work on plain record dicts; pydantic models are only built
+# to validate request bodies, never on the read path.
+def _record(body: bytes, score: float) -> dict:
+    return ranked_record(decode_record(body), score)
+
+# Read helpers take an optional raw-bytes `client` (a replica from
+# replicas.reader()); without one they read the primary.
+def _decode_ranked(ranked, client=None) -> List[dict]:
+    if not ranked:
+        return []
+    bodies = (client or redis_bin).hmget(TRACKS_KEY, [str(member_track_id(m)) for m, _ in ranked])
+    # Skips entries removed between ZRANGE and HMGET
+    return [_record(body, score) for (_, score), body in zip(ranked, bodies) if body is not None]
+
+def get_queue(start: int = 0, stop: int = -1, client=None) -> List[dict]:
+    return _decode_ranked((client or redis_bin).zrange(QUEUE_KEY, start, stop, withscores=True), client)
+
+def set_queue(records: List[dict]):
+    pipe = redis_bin.pipeline()
+    pipe.delete(QUEUE_KEY, TRACKS_KEY)
+    if records:
+        pipe.hset(TRACKS_KEY, mapping={str(r["id"]): encode_record(TRACK_CODEC, r) for r in records})
+        pipe.zadd(QUEUE_KEY, {queue_member(r["id"]): -r["votes"] for r in records})
+    pipe.execute()
+    read_cache.invalidate()
+
+def put_track(record: dict, tick: bool = True):
+    """Store one track; `tick` is False for writes applied from a peer."""
+    if crdt is not None:
+        put_tracks([record])
+        return
+    pipe = redis_bin.pipeline()
+    pipe.hset(TRACKS_KEY, str(record["id"]), encode_record(TRACK_CODEC, record))
+    pipe.zadd(QUEUE_KEY, {queue_member(record["id"]): -record["votes"]})
+    if tick:
+        tick_clock(pipe)
+    replies = pipe.execute()
+    read_cache.invalidate()
+    if tick:
+        saw_clock(replies[-1])
+
+def put_tracks(records: List[dict]) -> List[bool]:
+    """Store many tracks in one MULTI; True for each id that was not queued before."""
+    if crdt is not None:
+        added = crdt.add_many(records)
+        read_cache.invalidate()
+        return added
+    pipe = redis_bin.pipeline()
+    for record in records:
+        pipe.hset(TRACKS_KEY, str(record["id"]), encode_record(TRACK_CODEC, record))
+        pipe.zadd(QUEUE_KEY, {queue_member(record["id"]): -record["votes"]})
+    tick_clock(pipe)
+    *replies, clock = pipe.execute()
+    read_cache.invalidate()
+    saw_clock(clock)
+    return [bool(added) for added in replies[1::2]]
+
+def delete_track(track_id: int, tick: bool = True) -> bool:
+    if crdt is not None:
+        removed = crdt.remove(track_id)
+        redis_client.delete(voters_key(track_id))
+        read_cache.invalidate()
+        return removed
+    pipe = redis_client.pipeline()
+    pipe.zrem(QUEUE_KEY, queue_member(track_id))
+    pipe.hdel(TRACKS_KEY, str(track_id))
+    pipe.delete(voters_key(track_id))
+    if tick:
+        tick_clock(pipe)
+    replies = pipe.execute()
+    read_cache.invalidate()
+    if tick:
+        saw_clock(replies[-1])
+    return bool(replies[0])
+
+def change_votes(track_id: int, delta: int):
+    """Apply a vote delta; returns the new vote count, or None if the track is not queued."""
+    if crdt is not None:
+        return change_votes_many([(track_id, delta)])[0]
+    pipe = redis_client.pipeline()
+    pipe.zadd(QUEUE_KEY, {queue_member(track_id): -delta}, xx=True, incr=True)
+    tick_clock(pipe)
+    score, clock = pipe.execute()
+    read_cache.invalidate()
+    saw_clock(clock)
+    return None if score is None else int(-score)
 
+def change_votes_many(deltas: List[Tuple[int, int]]) -> List[Optional[int]]:
+    """Apply (id, delta) pairs in order in one MULTI; new counts, None where not queued."""
+    if crdt is not None:
+        counts = crdt.vote_many(deltas)
+        read_cache.invalidate()
+        return counts
+    pipe = redis_client.pipeline()
+    for track_id, delta in deltas:
+        pipe.zadd(QUEUE_KEY, {queue_member(track_id): -delta}, xx=True, incr=True)
+    tick_clock(pipe)
+    *scores, clock = pipe.execute()
+    read_cache.invalidate()
+    saw_clock(clock)
+    return [None if score is None else int(-score) for score in scores]
 
-def get_queue():
-    data = redis_client.lrange(QUEUE_KEY, 0, -1)
-    return [Track(**json.loads(item)) for item in data]
+_claim_votes = redis_client.register_script(CLAIM_VOTES)
 
-def set_queue(tracks: List[Track]):
-    redis_client.delete(QUEUE_KEY)
-    if tracks:
-        redis_client.rpush(QUEUE_KEY, *[t.json() for t in tracks])
+def claim_votes(claims: List[Tuple[int, str]]) -> List[Optional[bool]]:
+    """Record (track id, listener) pairs in one script run (see votes.py).
 
-def get_history():
-    data = redis_client.lrange(HISTORY_KEY, 0, -1)
-    return [Track(**json.loads(item)) for item in data]
+    True for a new vote, False for a repeat, None where the track is not
+    queued, in which case nothing is recorded. SETBIT and SADD both report
+    whether the listener was already present, so each check is O(1) and a
+    listener repeated within one batch is caught too."""
+    keys, args = claim_args(QUEUE_KEY, VOTE_DEDUP, VOTERS_TTL, [
+        (voters_key(track_id), queue_member(track_id), listener) for track_id, listener in claims
+    ])
+    return claim_results(_claim_votes(keys, args))
 
-def add_to_history(track: Track):
-    redis_client.rpush(HISTORY_KEY, track.json())
+def get_tracks(track_ids: List[int]) -> Dict[int, dict]:
+    """Current state of the given tracks; ids that are not queued are left out."""
+    if not track_ids:
+        return {}
+    pipe = redis_bin.pipeline(transaction=False)
+    pipe.hmget(TRACKS_KEY, [str(i) for i in track_ids])
+    pipe.zmscore(QUEUE_KEY, [queue_member(i) for i in track_ids])
+    bodies, scores = pipe.execute()
+    return {
+        track_id: _record(body, score)
+        for track_id, body, score in zip(track_ids, bodies, scores)
+        if body is not None and score is not None
+    }
+
+def set_votes(track_id: int, votes: int):
+    redis_client.zadd(QUEUE_KEY, {queue_member(track_id): -votes}, xx=True)
+    read_cache.invalidate()
+
+def get_track(track_id: int, client=None) -> Optional[dict]:
+    """One track by id: HGET on the record index plus its score, in one round trip."""
+    pipe = (client or redis_bin).pipeline()
+    pipe.hget(TRACKS_KEY, str(track_id))
+    pipe.zscore(QUEUE_KEY, queue_member(track_id))
+    body, score = pipe.execute()
+    if body is None or score is None:
+        return None
+    return _record(body, score)
+
+def pop_top() -> Optional[dict]:
+    if crdt is not None:
+        popped = crdt.pop()
+        read_cache.invalidate()
+        if popped is None:
+            return None
+        track = _record(*popped)
+        redis_client.delete(voters_key(track["id"]))
+        return track
+    # WATCH both keys so the ordering entry and its record leave together
+    popped = {}
+
+    def pop(pipe):
+        popped.clear()  # the callable reruns if a watched key changed
+        top = pipe.zrange(QUEUE_KEY, 0, 0, withscores=True)
+        if not top:
+            return
+        member, score = top[0]
+        field = str(member_track_id(member))
+        popped["track"] = pipe.hget(TRACKS_KEY, field), score
+        pipe.multi()
+        pipe.zrem(QUEUE_KEY, member)
+        pipe.hdel(TRACKS_KEY, field)
+        pipe.delete(voters_key(int(field)))
+        tick_clock(pipe)
+
+    replies = redis_bin.transaction(pop, QUEUE_KEY, TRACKS_KEY)
+    read_cache.invalidate()
+    if "track" not in popped:
+        return None
+    saw_clock(replies[-1])
+    body, score = popped["track"]
+    return None if body is None else _record(body, score)
+
+def cached_queue() -> List[dict]:
+    return read_cache.get("queue", get_queue)
+
+def cached_queue_json() -> bytes:
+    return read_cache.get("queue_json", lambda: json.dumps(cached_queue()).encode())
+
+def get_queue_page(cursor: int, limit: Optional[int]) -> Tuple[List[dict], Optional[int]]:
+    """One window of the ranked queue starting at rank `cursor`, plus the next cursor."""
+    cached = read_cache.peek("queue")
+    if cached is not None:
+        window = cached[cursor:] if limit is None else cached[cursor:cursor + limit + 1]
+    else:
+        window = get_queue(cursor, -1 if limit is None else cursor + limit, replicas.reader())
+    if limit is not None and len(window) > limit:
+        return window[:limit], cursor + limit
+    return window, None
+
+def cached_track_index() -> Dict[int, dict]:
+    return read_cache.get("index", lambda: {r["id"]: r for r in cached_queue()})
+
+def watch_keyspace():
+    """Invalidate the read cache whenever any queue key changes in Redis.
+
+    Enables keyspace notifications for generic, hash and sorted-set commands,
+    then keeps one pub/sub subscription open. The cache only serves hits
+    while subscribed; on any error it is disabled until the watch recovers."""
+    db = redis_client.connection_pool.connection_kwargs.get("db", 0)
+    pattern = f"__keyspace@{db}__:music_queue:*"
+    while True:
+        try:
+            flags = redis_client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+            wanted = set(flags) | set("Kghz")
+            if set(flags) != wanted:
+                redis_client.config_set("notify-keyspace-events", "".join(sorted(wanted)))
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(pattern)
+            read_cache.enable("keyspace")
+            log.info("Read cache enabled, watching %s", pattern)
+            for _ in pubsub.listen():
+                read_cache.invalidate()
+        except Exception as e:
+            read_cache.disable("keyspace")
+            log.error("Keyspace watch failed: %s", e)
+            time.sleep(5)
+
+def announce_change():
+    """Tell nodes sharing our Redis that the queue changed (see changes.py)."""
+    _announce(*announce_args(NODE_ID))
+
+def watch_changes():
+    """Invalidate the read cache on other nodes' change notifications.
+
+    Works where keyspace notifications cannot be enabled (no CONFIG access),
+    as long as every writer to the queue keys is a node, since nodes announce
+    each change they make or apply."""
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANGES_CHANNEL)
+            read_cache.enable("changes")
+            log.info("Read cache enabled, watching %s", CHANGES_CHANNEL)
+            for message in pubsub.listen():
+                change = parse_change(message["data"])
+                if change is None or change[1] == NODE_ID:
+                    continue
+                read_cache.invalidate()
+                changes_seen["version"] = max(changes_seen["version"], change[0])
+                changes_seen["received"] += 1
+        except Exception as e:
+            read_cache.disable("changes")
+            log.error("Change watch failed: %s", e)
+            time.sleep(5)
+
+def migrate_legacy_queue():
+    if redis_client.type(LEGACY_QUEUE_KEY) != "list":
+        return
+    data = redis_client.lrange(LEGACY_QUEUE_KEY, 0, -1)
+    records = [Track(**json.loads(item)).dict() for item in data]
+    if crdt is not None:
+        crdt.add_many(records)  # as local adds, so merges keep them
+    else:
+        set_queue(records)
+    redis_client.delete(LEGACY_QUEUE_KEY)
+    log.info("Migrated %d tracks from legacy list %s", len(data), LEGACY_QUEUE_KEY)
+    read_cache.invalidate()
+
+def get_history(cursor: int = 0, limit: Optional[int] = None, client=None) -> Tuple[List[dict], Optional[int]]:
+    """History from absolute play index `cursor` on, oldest first, plus the next cursor.
+
+    Indexes count every track ever played, so cursors stay valid while old
+    entries are trimmed or archived; a cursor that points at trimmed entries
+    resumes at the oldest one still kept. Archived entries come first, then
+    the ones still in Redis."""
+    client = client or redis_bin
+    pipe = client.pipeline(transaction=True)
+    pipe.llen(HISTORY_KEY)
+    pipe.get(HISTORY_COUNT_KEY)
+    length, total = pipe.execute()
+    base = max(int(total or 0) - length, 0)  # absolute index of the first entry in Redis
+    items = []  # (absolute index, encoded record)
+    if archive is not None and cursor < base:
+        items = archive.read(cursor, base, None if limit is None else limit + 1)
+    if limit is None or len(items) <= limit:
+        start = max(cursor - base, 0)
+        stop = -1 if limit is None else start + limit - len(items)
+        items += [(base + start + i, body) for i, body in enumerate(client.lrange(HISTORY_KEY, start, stop))]
+    tracks = [decode_record(body) for _, body in items]
+    if limit is not None and len(items) > limit:
+        return tracks[:limit], items[limit][0]
+    return tracks, None
+
+_index_since = redis_bin.register_script(INDEX_SINCE)
+
+def history_index_since(played_at: float) -> int:
+    """Cursor of the first history entry played at or after `played_at`.
+
+    Runs on the primary: the lookup is a script, and replicas may refuse those."""
+    position, times, length, total = _index_since([HISTORY_KEY, HISTORY_COUNT_KEY, HISTORY_TIMES_KEY],
+                                                  [repr(played_at)])
+    base = max(total - length, 0)
+    if archive is not None:
+        index = archive.index_since(played_at)
+        if index is not None and index < base:
+            return index
+    # Entries older than the times list (see migrate_history_times) count as played first
+    return base + length - times + position
+
+def history_page_limit(limit: Optional[int]) -> Optional[int]:
+    if archive is None:
+        return limit  # Redis holds at most HISTORY_MAX entries
+    return min(limit or HISTORY_PAGE_SIZE, HISTORY_PAGE_MAX)
+
+def add_to_history(record: dict):
+    pipe = redis_bin.pipeline()
+    pipe.rpush(HISTORY_KEY, encode_record(TRACK_CODEC, record))
+    pipe.rpush(HISTORY_TIMES_KEY, repr(time.time()))
+    pipe.incr(HISTORY_COUNT_KEY)
+    if HISTORY_MAX > 0 and archive is None:
+        pipe.ltrim(HISTORY_KEY, -HISTORY_MAX, -1)
+        pipe.ltrim(HISTORY_TIMES_KEY, -HISTORY_MAX, -1)
+    top_tracks.add(pipe, record["id"], json.dumps({"title": record["title"], "artist": record["artist"]}).encode())
+    top_artists.add(pipe, record["artist"])
+    pipe.execute()
+
+def migrate_history_count():
+    # Histories written before the counter existed start counting from their length
+    redis_client.setnx(HISTORY_COUNT_KEY, redis_client.llen(HISTORY_KEY))
+
+def migrate_history_times():
+    # Entries written before play times were kept are stamped with the migration time
+    def pad(pipe):
+        missing = pipe.llen(HISTORY_KEY) - pipe.llen(HISTORY_TIMES_KEY)
+        pipe.multi()
+        if missing > 0:
+            pipe.lpush(HISTORY_TIMES_KEY, *[repr(time.time())] * missing)
+    redis_client.transaction(pad, HISTORY_KEY, HISTORY_TIMES_KEY)
+
+def archive_history():
+    """Move old history into the archive, on one node at a time."""
+    while True:
+        time.sleep(ARCHIVE_INTERVAL)
+        try:
+            token = uuid.uuid4().hex
+            if not redis_client.set(ARCHIVER_LOCK_KEY, token, nx=True, ex=int(ARCHIVE_INTERVAL * 5) + 60):
+                continue
+            try:
+                moved = 0
+                while True:
+                    n = archive_step(redis_bin, archive, ARCHIVE_KEEP, ARCHIVE_AGE_HOURS * 3600, ARCHIVE_BATCH)
+                    moved += n
+                    if n < ARCHIVE_BATCH:
+                        break
+                if moved:
+                    log.info("Archived %d history entries", moved)
+            finally:
+                if redis_client.get(ARCHIVER_LOCK_KEY) == token:
+                    redis_client.delete(ARCHIVER_LOCK_KEY)
+        except Exception as e:
+            log.warning("History archiving failed: %s", e)
+
+def json_response(obj, headers: Optional[Dict[str, str]] = None) -> Response:
+    # Records are plain dicts, so skip FastAPI's model validation and encoding
+    return Response(content=json.dumps(obj).encode(), media_type="application/json", headers=headers)
+
+def page_response(items: List[dict], next_cursor: Optional[int]) -> Response:
+    headers = {} if next_cursor is None else {"X-Next-Cursor": str(next_cursor)}
+    return json_response(items, headers)
 
 def broadcast_queue():
+    start = time.perf_counter()
     peers = get_peers()
     queue = get_queue()
-    print(f"[DEBUG] Broadcasting queue to peers: {peers}")
-    for peer in peers:
-        try:
-            print(f"[DEBUG] Sending sync to {peer}/sync with queue: {[t.dict() for t in queue]}")
-            resp = requests.post(f"{peer}/sync", json=[t.dict() for t in queue], timeout=3)
-            print(f"[DEBUG] Sync response from {peer}: {resp.status_code}")
-        except Exception as e:
-            print(f"[ERROR] Failed to sync with {peer}: {e}")
+    log.debug("Broadcasting queue to peers: %s", peers)
+    _count("broadcasts")
+    record_broadcast("/sync", start, broadcaster.submit(peers, f"/sync?store={local_store()}", queue))
+
+
+# Delta sync state: our own op counter, and the last op applied per origin.
+# Ops carry absolute values (full track, final vote count) so replaying one
+# that is already reflected in a snapshot is harmless.
+_seq = 0
+_seq_lock = threading.Lock()
+_applied: Dict[str, Tuple[str, int]] = {}
+_applied_lock = threading.Lock()
+
+sync_stats = {"mutations": 0, "broadcasts": 0, "digest_checks": 0, "repairs": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _stats_lock:
+        sync_stats[name] += 1
+
+# Lamport clock over queue mutations, kept in Redis (CLOCK_KEY) so it survives
+# restarts and is shared by the nodes on one store: every local mutation INCRs
+# it in the same MULTI, and applying a peer's op or snapshot moves it up to
+# the peer's clock. When two digests differ, the side with the lower (clock,
+# node URL) pulls the other's snapshot, so replicas converge on the state that
+# saw the latest write. CRDT mode merges instead and does not use it.
+_raise_clock = redis_client.register_script(RAISE_CLOCK)
+# Highest clock this process has written or read; delta ops carry it without
+# a round trip. It may trail CLOCK_KEY, which only makes peers move up less.
+_clock = 0
+_clock_lock = threading.Lock()
+
+
+def tick_clock(pipe):
+    """Queue a clock tick in a local mutation's pipeline; pass its reply to saw_clock."""
+    pipe.incr(CLOCK_KEY)
+
+def saw_clock(clock):
+    global _clock
+    with _clock_lock:
+        _clock = max(_clock, int(clock))
+
+def read_clock() -> int:
+    clock = int(redis_client.get(CLOCK_KEY) or 0)
+    saw_clock(clock)
+    return clock
+
+def observe_clock(clock: Optional[int]):
+    if clock is not None:
+        saw_clock(_raise_clock([CLOCK_KEY], [clock]))
+
+def broadcast_op(op: dict):
+    start = time.perf_counter()
+    peers = get_peers()
+    log.debug("Broadcasting op %s #%d to peers: %s", op["op"], op["seq"], peers)
+    _count("broadcasts")
+    record_broadcast("/sync/delta", start, broadcaster.submit(peers, "/sync/delta", op))
+
+def send_op(op: str, fields_fn=None, **fields):
+    global _seq
+    # Enqueueing under the lock keeps each peer's queue in sequence order
+    with _seq_lock:
+        if fields_fn is not None:
+            fields.update(fields_fn())
+        _seq += 1
+        payload = {"origin": NODE_URL, "epoch": NODE_EPOCH, "seq": _seq, "clock": _clock,
+                   "store": local_store(), "op": op, **fields}
+        broadcast_op(payload)
+
+def broadcast_state(track_ids):
+    """CRDT mode: send peers the full mergeable state of the touched tracks."""
+    start = time.perf_counter()
+    peers = get_peers()
+    if not peers:
+        return
+    _count("broadcasts")
+    record_broadcast("/sync/crdt", start, broadcaster.submit(peers, "/sync/crdt", crdt.export(sorted(track_ids))))
+
+def flush_changes(track_ids):
+    """Send one sync covering every track touched during a coalescing window."""
+    if SYNC_MODE == "full":
+        broadcast_queue()
+        return
+    if crdt is not None:
+        broadcast_state(track_ids)
+        return
+
+    def final_state():
+        current = get_tracks(list(track_ids))
+        return {
+            "tracks": list(current.values()),
+            "ids": [i for i in track_ids if i not in current],
+        }
+    send_op("batch", final_state)
+
+coalescer = Coalescer(COALESCE_WINDOW_MS / 1000, flush_changes) if COALESCE_WINDOW_MS > 0 else None
+
 
+def publish_change(track_id: int, op: str, **fields):
+    _count("mutations")
+    announce_change()
+    if coalescer is not None:
+        coalescer.add(track_id)
+    elif SYNC_MODE == "delta":
+        send_op(op, **fields)
+    else:
+        flush_changes({track_id})
+
+def publish_changes(track_ids: List[int]):
+    """One peer sync for a batch: the final state of every touched track."""
+    if not track_ids:
+        return
+    _count("mutations")
+    announce_change()
+    if coalescer is not None:
+        for track_id in track_ids:
+            coalescer.add(track_id)
+    else:
+        flush_changes(set(track_ids))
+
+def publish_event(event_type: str, **data):
+    # Published by the node that served the client request; every node's
+    # change feed picks it up from the shared channel
+    redis_client.publish(EVENTS_CHANNEL, json.dumps({"type": event_type, **data}))
+
+def publish_events(events: List[dict]):
+    pipe = redis_client.pipeline(transaction=False)
+    for event in events:
+        pipe.publish(EVENTS_CHANNEL, json.dumps(event))
+    pipe.execute()
+
+def apply_op(op: SyncOp):
+    # Peers' writes move our clock up to theirs (observe_clock) but do not tick it
+    if op.op == "add":
+        put_track(op.track.dict(), tick=False)
+    elif op.op == "vote":
+        set_votes(op.id, op.votes)
+    elif op.op in ("remove", "pop"):
+        delete_track(op.id, tick=False)
+    elif op.op == "batch":
+        for track in op.tracks or []:
+            put_track(track.dict(), tick=False)
+        for track_id in op.ids or []:
+            delete_track(track_id, tick=False)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown op {op.op}")
+
+def resync_from(origin: str) -> Tuple[str, int]:
+    resp = broadcaster.session.get(f"{origin}/sync/snapshot", timeout=broadcaster.timeout)
+    resp.raise_for_status()
+    sync_payload.observe(len(resp.content), "/sync/snapshot")
+    snapshot = resp.json()
+    set_queue([Track(**t).dict() for t in snapshot["queue"]])
+    announce_change()
+    observe_clock(snapshot.get("clock"))
+    log.info("Resynced from %s at seq %d", origin, snapshot["seq"])
+    return snapshot["epoch"], snapshot["seq"]
+
+
+def queue_digest() -> str:
+    # Hashes the same rendered JSON that GET /queue serves, so it is usually a cache hit
+    return hashlib.blake2b(cached_queue_json(), digest_size=16).hexdigest()
+
+def reconcile(peer: str, digest: str) -> bool:
+    """Compare digests with one peer; pull its snapshot if it differs and is ahead."""
+    resp = broadcaster.session.get(f"{peer}/sync/digest", timeout=broadcaster.timeout)
+    resp.raise_for_status()
+    theirs = resp.json()
+    _count("digest_checks")
+    if theirs["digest"] == digest:
+        return False
+    if crdt is not None:
+        # Merging is symmetric and idempotent, so take the peer's state of every
+        # track queued on either side. Ids queued on neither are the same on
+        # both already, or only differ in tombstones that change nothing.
+        resp = broadcaster.session.post(f"{peer}/sync/crdt/export", json=crdt.live_ids(), timeout=broadcaster.timeout)
+        resp.raise_for_status()
+        sync_payload.observe(len(resp.content), "/sync/crdt/export")
+        merge_state(CrdtState(**resp.json()))
+        _count("repairs")
+        return True
+    if (theirs["clock"], theirs["node"]) < (read_clock(), NODE_URL):
+        # Equal, or we are ahead and the peer will pull from us on its own round
+        return False
+    with _applied_lock:
+        # Delta ops from that peer continue from the snapshot's sequence
+        _applied[theirs["node"]] = resync_from(peer)
+    _count("repairs")
+    return True
+
+def anti_entropy():
+    while True:
+        time.sleep(ANTI_ENTROPY_SECONDS)
+        peers = get_peers()
+        if not peers:
+            continue
+        digest = queue_digest()
+        for peer in peers:
+            try:
+                if reconcile(peer, digest):
+                    log.info("Anti-entropy repaired divergence from %s", peer)
+                    digest = queue_digest()
+            except Exception as e:
+                log.warning("Anti-entropy check with %s failed: %s", peer, e)
+
+
+@app.on_event("startup")
+def startup():
+    migrate_legacy_queue()
+    migrate_history_count()
+    migrate_history_times()
+    if READ_CACHE:
+        threading.Thread(target=watch_keyspace, name="keyspace-watch", daemon=True).start()
+        threading.Thread(target=watch_changes, name="change-watch", daemon=True).start()
+    threading.Thread(target=change_feed.run, args=(redis_client, EVENTS_CHANNEL),
+                     name="change-feed", daemon=True).start()
+    threading.Thread(target=membership.run, name="membership", daemon=True).start()
+    if REDIS_REPLICAS:
+        threading.Thread(target=replicas.run, name="replica-check", daemon=True).start()
+    if archive is not None:
+        threading.Thread(target=archive_history, name="history-archiver", daemon=True).start()
+    if ANTI_ENTROPY_SECONDS > 0:
+        threading.Thread(target=anti_entropy, name="anti-entropy", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    if vote_accumulator is not None:
+        vote_accumulator.stop()
+    if coalescer is not None:
+        coalescer.flush()
+    broadcaster.stop()
 
 
 @app.post("/add_track")
 def add_track(track: Track):
-    queue = get_queue()
-    queue.append(track)
-    # Always sort by votes descending, then by id ascending for stability
-    queue.sort(key=lambda x: (-x.votes, x.id))
-    set_queue(queue)
-    broadcast_queue()
-    return {"message": "Track added", "queue": queue}
+    record = track.dict()
+    put_track(record)
+    publish_change(track.id, "add", track=record)
+    publish_event("added", track=record)
+    return json_response({"message": "Track added", "track": record})
 
 
 @app.post("/remove_track")
 def remove_track(action: TrackAction):
-    queue = get_queue()
-    queue = [t for t in queue if t.id != action.id]
-    set_queue(queue)
-    broadcast_queue()
-    return {"message": "Track removed", "queue": queue}
+    if delete_track(action.id):
+        publish_change(action.id, "remove", id=action.id)
+        publish_event("removed", id=action.id)
+    return json_response({"message": "Track removed", "id": action.id})
 
 
 @app.post("/vote")
+def vote_track(action: TrackAction, up: bool = True, x_listener_id: Optional[str] = Header(None)):
+    if VOTE_DEDUP != "off" and claim_votes([(action.id, check_listener(x_listener_id))])[0] is False:
+        raise HTTPException(status_code=409, detail="Listener already voted for this track")
+    if vote_accumulator is not None:
+        # Counted in memory; the queue reflects it after the next flush
+        vote_accumulator.add(action.id, 1 if up else -1)
+        return json_response({"id": action.id, "pending": True})
+    votes = change_votes(action.id, 1 if up else -1)
+    if votes is not None:
+        publish_change(action.id, "vote", id=action.id, votes=votes)
+        publish_event("votes", id=action.id, votes=votes)
+    return json_response({"id": action.id, "votes": votes})
 
-@app.post("/vote")
-def vote_track(action: TrackAction, up: bool = True):
-    queue = get_queue()
-    for t in queue:
-        if t.id == action.id:
-            t.votes += 1 if up else -1
-    # Always sort by votes descending, then by id ascending for stability
-    queue.sort(key=lambda x: (-x.votes, t.id))
-    set_queue(queue)
-    broadcast_queue()
-    return {"queue": queue}
+
+def announce_votes(track_ids: List[int], counts: List[Optional[int]]):
+    """One peer sync and one event publish for votes applied in a batch."""
+    applied = [(track_id, c) for track_id, c in zip(track_ids, counts) if c is not None]
+    publish_changes([track_id for track_id, _ in applied])
+    if applied:
+        publish_events([{"type": "votes", "id": track_id, "votes": c} for track_id, c in applied])
+
+def apply_votes(deltas: Dict[int, int]):
+    """Fold net vote deltas into the ranked queue: one pipeline, one peer sync."""
+    track_ids = list(deltas)
+    announce_votes(track_ids, change_votes_many([(track_id, deltas[track_id]) for track_id in track_ids]))
+
+vote_accumulator = VoteAccumulator(VOTE_FLUSH_MS / 1000, apply_votes) if VOTE_FLUSH_MS > 0 else None
+
+
+def check_listener(listener: Optional[str]) -> str:
+    if not listener:
+        raise HTTPException(status_code=400, detail="X-Listener-Id is required when vote deduplication is on")
+    if VOTE_DEDUP == "bitmap" and not (listener.isascii() and listener.isdigit()
+                                       and int(listener) <= BITMAP_MAX_LISTENER):
+        raise HTTPException(status_code=400, detail=f"Listener ids must be integers 0..{BITMAP_MAX_LISTENER}")
+    return listener
+
+
+def check_batch_size(items: list):
+    if len(items) > MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch larger than {MAX_BATCH} items")
+
+
+def vote_results(votes: List[Vote], fresh: List[Optional[bool]], counts: List[Optional[int]]) -> List[dict]:
+    """Per-item /votes results from claim_votes; `counts` holds one entry per fresh vote."""
+    counts = iter(counts)
+    results = []
+    for v, ok in zip(votes, fresh):
+        c = next(counts) if ok else None
+        if ok is False:
+            results.append({"id": v.id, "status": "duplicate"})
+        elif c is None:
+            results.append({"id": v.id, "status": "not_found"})
+        else:
+            results.append({"id": v.id, "status": "ok", "votes": c})
+    return results
+
+
+# Batch endpoints: N operations, one Redis round trip, one peer sync
+@app.post("/add_tracks")
+def add_tracks(tracks: List[Track]):
+    check_batch_size(tracks)
+    records = [t.dict() for t in tracks]
+    added = put_tracks(records)
+    publish_changes([r["id"] for r in records])
+    if records:
+        publish_events([{"type": "added", "track": r} for r in records])
+    results = [{"id": r["id"], "status": "added" if new else "updated"} for r, new in zip(records, added)]
+    return json_response({"message": f"{len(records)} tracks processed", "results": results})
+
+
+@app.post("/votes")
+def cast_votes(votes: List[Vote], x_listener_id: Optional[str] = Header(None)):
+    check_batch_size(votes)
+    fresh = [True] * len(votes)
+    if VOTE_DEDUP != "off" and votes:
+        fresh = claim_votes([(v.id, check_listener(v.listener or x_listener_id)) for v in votes])
+    accepted = [v for v, ok in zip(votes, fresh) if ok]
+    results = vote_results(votes, fresh, change_votes_many([(v.id, 1 if v.up else -1) for v in accepted]))
+    announce_votes([r["id"] for r in results if r["status"] == "ok"], [r["votes"] for r in results if r["status"] == "ok"])
+    return json_response({"message": f"{len(votes)} votes processed", "results": results})
 
 
 @app.get("/queue")
-def api_get_queue():
-    return get_queue()
+def api_get_queue(limit: Optional[int] = Query(None, ge=1), cursor: int = Query(0, ge=0)):
+    if limit is None and cursor == 0 and (read_cache.enabled or not REDIS_REPLICAS):
+        # Served pre-rendered so cache hits skip both Redis and re-encoding
+        return Response(content=cached_queue_json(), media_type="application/json")
+    return page_response(*get_queue_page(cursor, limit))
+
+
+# Server-Sent Events stream of queue changes: added, removed, votes,
+# now_playing and cleared. A "resync" event means events were missed and the
+# client should refetch GET /queue.
+@app.get("/queue/events")
+async def queue_events():
+    async def stream():
+        q = change_feed.subscribe()
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(q.get(), timeout=FEED_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if frame is None:
+                    yield "event: resync\ndata: {}\n\n"
+                    return
+                yield frame
+        finally:
+            change_feed.unsubscribe(q)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.get("/metadata/{track_id}")
 def get_metadata(track_id: int):
-    queue = get_queue()
-    for t in queue:
-        if t.id == track_id:
-            return t
+    # Use the in-memory index when the queue is already cached, else one HGET
+    if read_cache.peek("queue") is not None:
+        track = cached_track_index().get(track_id)
+    else:
+        track = get_track(track_id, replicas.reader())
+    if track is not None:
+        return json_response(track)
     raise HTTPException(status_code=404, detail="Track not found")
 
 
 @app.post("/play_next")
 def play_next():
-    queue = get_queue()
-    if not queue:
+    track = pop_top()
+    if track is None:
         raise HTTPException(status_code=400, detail="Queue empty")
-    track = queue.pop(0)
-    set_queue(queue)
     add_to_history(track)
-    broadcast_queue()
-    return {"now_playing": track}
+    publish_change(track["id"], "pop", id=track["id"])
+    publish_event("now_playing", track=track)
+    return json_response({"now_playing": track})
 
 
 @app.get("/history")
-def api_get_history():
-    return get_history()
+def api_get_history(limit: Optional[int] = Query(None, ge=1), cursor: int = Query(0, ge=0),
+                    since: Optional[float] = Query(None)):
+    client = replicas.reader()
+    if since is not None:
+        # Unix time; starts at the first track played at or after it
+        cursor = max(cursor, history_index_since(since))
+    return page_response(*get_history(cursor, history_page_limit(limit), client))
+
+
+# Room-scoped queues. Each room lives on one Redis shard (see rooms.py) that
+# every node reaches directly, so these skip peer sync, the read cache, vote
+# batching and the change feed; the unscoped endpoints above are unchanged.
+def room_store(room: str) -> RoomStore:
+    if not valid_room(room):
+        raise HTTPException(status_code=400, detail="Room names are 1-64 letters, digits, '-' or '_' (not 'default')")
+    return rooms.store(room)
+
+
+@app.get("/rooms/{room}")
+def get_room(room: str):
+    room_store(room)
+    return {"room": room, "shard": rooms.shard_for(room)}
+
+
+@app.get("/rooms/{room}/queue")
+def get_room_queue(room: str, limit: Optional[int] = Query(None, ge=1), cursor: int = Query(0, ge=0)):
+    return page_response(*room_store(room).page(cursor, limit))
+
+
+@app.post("/rooms/{room}/add_track")
+def add_room_track(room: str, track: Track):
+    store = room_store(room)
+    record = track.dict()
+    store.put_tracks([record])
+    return json_response({"message": "Track added", "track": record})
+
+
+@app.post("/rooms/{room}/add_tracks")
+def add_room_tracks(room: str, tracks: List[Track]):
+    store = room_store(room)
+    check_batch_size(tracks)
+    records = [t.dict() for t in tracks]
+    added = store.put_tracks(records) if records else []
+    results = [{"id": r["id"], "status": "added" if new else "updated"} for r, new in zip(records, added)]
+    return json_response({"message": f"{len(records)} tracks processed", "results": results})
+
+
+@app.post("/rooms/{room}/remove_track")
+def remove_room_track(room: str, action: TrackAction):
+    store = room_store(room)
+    store.remove(action.id)
+    return json_response({"message": "Track removed", "id": action.id})
+
+
+@app.post("/rooms/{room}/vote")
+def vote_room_track(room: str, action: TrackAction, up: bool = True, x_listener_id: Optional[str] = Header(None)):
+    store = room_store(room)
+    if VOTE_DEDUP != "off" and store.claim_votes([(action.id, check_listener(x_listener_id))],
+                                                 VOTE_DEDUP, VOTERS_TTL)[0] is False:
+        raise HTTPException(status_code=409, detail="Listener already voted for this track")
+    votes, = store.change_votes_many([(action.id, 1 if up else -1)])
+    return json_response({"id": action.id, "votes": votes})
+
+
+@app.post("/rooms/{room}/votes")
+def cast_room_votes(room: str, votes: List[Vote], x_listener_id: Optional[str] = Header(None)):
+    store = room_store(room)
+    check_batch_size(votes)
+    fresh = [True] * len(votes)
+    if VOTE_DEDUP != "off" and votes:
+        fresh = store.claim_votes([(v.id, check_listener(v.listener or x_listener_id)) for v in votes],
+                                  VOTE_DEDUP, VOTERS_TTL)
+    accepted = [(v.id, 1 if v.up else -1) for v, ok in zip(votes, fresh) if ok]
+    counts = store.change_votes_many(accepted) if accepted else []
+    return json_response({"message": f"{len(votes)} votes processed", "results": vote_results(votes, fresh, counts)})
+
+
+@app.get("/rooms/{room}/metadata/{track_id}")
+def get_room_metadata(room: str, track_id: int):
+    track = room_store(room).get_track(track_id)
+    if track is None:
+        raise HTTPException(status_code=404, detail="Track not found")
+    return json_response(track)
+
+
+@app.post("/rooms/{room}/play_next")
+def play_room_next(room: str):
+    track = room_store(room).pop()
+    if track is None:
+        raise HTTPException(status_code=400, detail="Queue empty")
+    return json_response({"now_playing": track})
+
+
+@app.get("/rooms/{room}/history")
+def get_room_history(room: str, limit: Optional[int] = Query(None, ge=1), cursor: int = Query(0, ge=0)):
+    return page_response(*room_store(room).history(cursor, limit))
+
+
+# Most played tracks and artists since the last /clear. Counts are exact
+# unless `error` is above 0, in which case they are at most that much high.
+@app.get("/stats/top")
+def get_top(k: int = Query(min(10, TOP_CAPACITY), ge=1, le=TOP_CAPACITY)):
+    tracks = [
+        {"id": int(track_id), **json.loads(label), "plays": plays, "error": error}
+        for track_id, plays, error, label in top_tracks.top(k)
+    ]
+    artists = [{"artist": artist.decode(), "plays": plays, "error": error} for artist, plays, error, _ in top_artists.top(k)]
+    return json_response({"tracks": tracks, "artists": artists})
+
+
+def check_not_crdt():
+    # Full and delta syncs write the materialized keys directly, bypassing the
+    # OR-set, counters and played log, so the next merge would undo them
+    if crdt is not None:
+        raise HTTPException(status_code=409, detail="SYNC_MODE=crdt only accepts /sync/crdt")
 
 
-# Sync endpoint for receiving queue updates from peers
 # Sync endpoint for receiving queue updates from peers
 @app.post("/sync")
-def sync_queue(new_queue: List[Track]):
-    print(f"[DEBUG] Received sync: {new_queue}")
-    queue = [Track(**t.dict()) if isinstance(t, Track) else Track(**t) for t in new_queue]
+def sync_queue(new_queue: List[Track], store: Optional[str] = None):
+    check_not_crdt()
+    if store == local_store():
+        return json_response({"message": "Same store, sync ignored"})
+    log.debug("Received sync of %d tracks", len(new_queue))
+    queue = [t.dict() for t in new_queue]
     set_queue(queue)
-    print(f"[DEBUG] Queue after sync: {queue}")
-    return {"message": "Queue synchronized", "queue": queue}
+    announce_change()
+    log.debug("Queue after sync: %s", queue)
+    return json_response({"message": "Queue synchronized", "queue": queue})
+
+
+# Delta sync: apply one op from a peer, or resync in full if ops were missed
+@app.post("/sync/delta")
+def sync_delta(op: SyncOp):
+    check_not_crdt()
+    if op.origin == NODE_URL:
+        return {"message": "Own op ignored", "seq": op.seq}
+    if op.store == local_store():
+        # The origin wrote this to our Redis already
+        return {"message": "Same store, op ignored", "seq": op.seq}
+    with _applied_lock:
+        epoch, last = _applied.get(op.origin, (None, 0))
+        if epoch == op.epoch and op.seq <= last:
+            return {"message": "Duplicate op ignored", "seq": last}
+        expected = last + 1 if epoch == op.epoch else 1
+        if op.seq != expected:
+            log.info("Gap from %s: expected %d, got %d", op.origin, expected, op.seq)
+            try:
+                _applied[op.origin] = resync_from(op.origin)
+            except Exception as e:
+                raise HTTPException(status_code=503, detail=f"Resync from {op.origin} failed: {e}")
+            return {"message": "Queue resynchronized", "seq": _applied[op.origin][1]}
+        apply_op(op)
+        announce_change()
+        observe_clock(op.clock)
+        _applied[op.origin] = (op.epoch, op.seq)
+    return {"message": "Op applied", "seq": op.seq}
+
+
+# CRDT sync: merge a peer's state for some tracks (any order, any number of times)
+def merge_state(state: CrdtState) -> int:
+    if crdt is None:
+        raise HTTPException(status_code=409, detail="CRDT sync needs SYNC_MODE=crdt")
+    results = crdt.merge({"tracks": {i: t.dict() for i, t in state.tracks.items()}})
+    read_cache.invalidate()
+    if results:
+        announce_change()
+    # Each node has its own Redis here, so merged changes are announced locally
+    events = []
+    for track_id, before, after, played in results:
+        for record in played:
+            add_to_history(record)
+        if before is None and after is not None:
+            events.append({"type": "added", "track": get_track(track_id)})
+        elif before is not None and after is None:
+            events.append({"type": "removed", "id": track_id})
+        elif before != after:
+            events.append({"type": "votes", "id": track_id, "votes": after})
+    if events:
+        publish_events(events)
+    return len(results)
+
+@app.post("/sync/crdt")
+def sync_crdt(state: CrdtState):
+    return {"message": "State merged", "tracks": merge_state(state)}
+
+@app.get("/sync/crdt")
+def sync_crdt_state():
+    if crdt is None:
+        raise HTTPException(status_code=409, detail="CRDT sync needs SYNC_MODE=crdt")
+    return json_response(crdt.export())
+
+# State of the tracks queued here or in `track_ids` (the caller's queue), for anti-entropy
+@app.post("/sync/crdt/export")
+def sync_crdt_export(track_ids: List[int]):
+    if crdt is None:
+        raise HTTPException(status_code=409, detail="CRDT sync needs SYNC_MODE=crdt")
+    return json_response(crdt.export(sorted(set(crdt.live_ids()) | set(track_ids))))
+
+
+# Full state plus the sequence it reflects, served to peers that detect a gap
+@app.get("/sync/snapshot")
+def sync_snapshot():
+    with _seq_lock:
+        return json_response({"epoch": NODE_EPOCH, "seq": _seq, "clock": read_clock(), "queue": get_queue()})
+
+
+# Compact queue fingerprint polled by peers' anti-entropy rounds
+@app.get("/sync/digest")
+def sync_digest():
+    return {"node": NODE_URL, "digest": queue_digest(), "clock": read_clock()}
+
+
+# Liveness probe used by peers' membership checks
+@app.get("/sync/health")
+def sync_health():
+    return {"node": NODE_URL, "epoch": NODE_EPOCH, "store": local_store()}
+
+
+# Known peers and their health, as seen by this node
+@app.get("/sync/peers")
+def sync_peers():
+    return {
+        "store": local_store(),
+        "live": membership.live(),
+        "remote": membership.remote(),
+        "members": [m.as_dict() for m in membership.members()],
+    }
+
+
+# Coalescing counters, for tuning COALESCE_WINDOW_MS
+@app.get("/sync/stats")
+def get_sync_stats():
+    with _stats_lock:
+        stats = dict(sync_stats)
+    stats["window_ms"] = COALESCE_WINDOW_MS
+    stats["coalesced"] = coalescer.merged if coalescer is not None else 0
+    if vote_accumulator is not None:
+        stats["votes"] = {"accepted": vote_accumulator.accepted, "flushed": vote_accumulator.flushed}
+    stats["feed"] = {"listeners": change_feed.listeners, "events": change_feed.events}
+    stats["read_cache"] = {"enabled": read_cache.enabled, "hits": read_cache.hits, "misses": read_cache.misses}
+    stats["changes"] = dict(changes_seen)
+    return stats
+
+
+# Values read at scrape time
+metrics.register(Callback(
+    "queue_length", "Tracks in the queue", lambda: {(): redis_client.zcard(QUEUE_KEY)}))
+metrics.register(Callback(
+    "peer_send_dropped_total", "Sync messages dropped (queue full or breaker open), per peer",
+    lambda: {(s.url,): s.dropped for s in broadcaster.senders()}, ("peer",), "counter"))
+metrics.register(Callback(
+    "peer_up", "1 while a peer passes membership health checks",
+    lambda: {(m.url,): int(m.healthy) for m in membership.members()}, ("peer",)))
+metrics.register(Callback(
+    "peer_circuit_open", "1 while a peer's circuit breaker is open",
+    lambda: {(s.url,): int(s.breaker.is_open) for s in broadcaster.senders()}, ("peer",)))
+metrics.register(Callback(
+    "sync_messages_total", "Sync counters from /sync/stats (mutations, broadcasts, digest checks, repairs)",
+    lambda: {(k,): v for k, v in sync_stats.items()}, ("kind",), "counter"))
+metrics.register(Callback(
+    "read_cache_requests_total", "Read cache lookups by result",
+    lambda: {("hit",): read_cache.hits, ("miss",): read_cache.misses}, ("result",), "counter"))
+metrics.register(Callback(
+    "change_feed_listeners", "Open /queue/events streams", lambda: {(): change_feed.listeners}))
+metrics.register(Callback(
+    "history_entries", "Play history entries by tier",
+    lambda: {("redis",): redis_client.llen(HISTORY_KEY),
+             **({("archive",): archive.entries()} if archive is not None else {})}, ("tier",)))
+metrics.register(Callback(
+    "redis_replica_fresh", "1 while a read replica is within REPLICA_MAX_STALENESS_MS",
+    lambda: {(name,): int(ok) for name, ok in replicas.fresh.items()}, ("replica",)))
+metrics.register(Callback(
+    "redis_reads_total", "Routed reads (/queue pages, /metadata, /history) by target",
+    lambda: {(target,): n for target, n in replicas.reads.items()}, ("target",), "counter"))
+
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 # Test utility endpoint to clear queue and history (for test isolation)
 @app.post("/clear")
 def clear_all():
-    redis_client.delete(QUEUE_KEY)
-    redis_client.delete(HISTORY_KEY)
+    redis_client.delete(QUEUE_KEY, TRACKS_KEY, LEGACY_QUEUE_KEY, HISTORY_KEY, HISTORY_COUNT_KEY, HISTORY_TIMES_KEY)
+    if archive is not None:
+        archive.clear()
+    for prefix in (VOTERS_KEY_PREFIX, CRDT_KEY_PREFIX, IDEMPOTENCY_KEY_PREFIX, STATS_KEY_PREFIX):
+        for key in redis_client.scan_iter(match=f"{prefix}*", count=1000):
+            redis_client.delete(key)
+    rooms.clear()
+    read_cache.invalidate()
+    announce_change()
+    publish_event("cleared")
     return {"message": "Queue and history cleared"}
@@ -0,0 +1,481 @@
+"""Async variant of the REST node (run with APP_MODULE=main_async:app).
+
+Serves the same queue API against the same Redis layout and record codecs
+as main.py, but every endpoint is a coroutine: Redis goes through
+redis.asyncio with a bounded connection pool and peer sync goes through a
+pooled httpx.AsyncClient, so a worker is not capped by the threadpool size.
+
+Only the core API is here: /add_track, /remove_track, /vote, /queue,
+/metadata, /play_next, /history (no since=), /clear, and /sync, /sync/delta,
+/sync/snapshot and /sync/health. Everything else is only in main.py:
+
+- vote deduplication, Idempotency-Key replays and admission control
+- rooms, /add_tracks, /votes, /stats/top (plays here are still counted),
+  /queue/events (mutations here still publish change events), /metrics,
+  /sync/digest, /sync/peers, /sync/stats and /sync/crdt
+- anti-entropy, SYNC_MODE=crdt, PEER_DNS and health-checked membership,
+  broadcast coalescing
+- the read cache, VOTE_FLUSH_MS, replica reads and history archiving (the
+  archive is read, not written)
+
+Startup fails if the settings of the first three are on (see check_settings),
+since requests here would quietly bypass them.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import redis.asyncio as aioredis
+from fastapi import FastAPI, HTTPException, Query, Response
+from starlette.concurrency import run_in_threadpool
+
+from archive import HistoryArchive
+from changes import ANNOUNCE, RAISE_CLOCK, announce_args
+from codec import decode_record, encode_record, get_codec
+from log import get_logger
+from models import SyncOp, Track, TrackAction
+from peers import AsyncBroadcaster
+from topk import HeavyHitters
+from schema import (
+    CLOCK_KEY, EVENTS_CHANNEL, HISTORY_COUNT_KEY, HISTORY_KEY, HISTORY_TIMES_KEY, LEGACY_QUEUE_KEY, QUEUE_KEY, TRACKS_KEY,
+    STORE_ID_KEY, TOP_ARTISTS_KEY, TOP_TRACKS_KEY, member_track_id, queue_member, ranked_record, voters_key,
+)
+
+log = get_logger(__name__)
+
+
+# Redis connection pool; requests wait for a free connection instead of failing
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "64"))
+redis_pool = aioredis.BlockingConnectionPool(
+    host=REDIS_HOST, port=REDIS_PORT, max_connections=REDIS_POOL_SIZE, timeout=5,
+)
+redis_client = aioredis.Redis(connection_pool=redis_pool)
+
+TRACK_CODEC = get_codec(os.getenv("TRACK_CODEC", "struct"))
+HISTORY_MAX = int(os.getenv("HISTORY_MAX", "10000"))
+# Archived history is read here too; the threaded nodes do the archiving
+HISTORY_ARCHIVE = os.getenv("HISTORY_ARCHIVE", "")
+archive = HistoryArchive(HISTORY_ARCHIVE) if HISTORY_ARCHIVE else None
+# Same /history page bounds as main.py while the archive is on
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "1000"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "10000"))
+# Plays here feed the same /stats/top counters that main.py serves
+TOP_CAPACITY = int(os.getenv("TOP_CAPACITY", "1000"))
+top_tracks = HeavyHitters(None, TOP_TRACKS_KEY, TOP_CAPACITY)
+top_artists = HeavyHitters(None, TOP_ARTISTS_KEY, TOP_CAPACITY)
+
+SYNC_MODE = os.getenv("SYNC_MODE", "delta")
+NODE_URL = os.getenv("NODE_URL", f"http://{socket.gethostname()}:8000")
+NODE_EPOCH = uuid.uuid4().hex
+# Names this node in change notifications; same derivation as main.py
+NODE_ID = os.getenv("NODE_ID", hashlib.blake2b(NODE_URL.encode(), digest_size=4).hexdigest())
+PEER_TIMEOUT = float(os.getenv("PEER_TIMEOUT", "3"))
+
+# main.py settings for features this node lacks, with a test for "on"
+UNSUPPORTED_SETTINGS = {
+    "VOTE_DEDUP": lambda value: value != "off",
+    "SYNC_MODE": lambda value: value == "crdt",
+    "CLIENT_RATE": lambda value: float(value) > 0,
+    "ROOM_RATE": lambda value: float(value) > 0,
+    "MAX_INFLIGHT": lambda value: int(value) > 0,
+    "REDIS_SHARDS": lambda value: value != "",
+}
+
+
+def check_settings():
+    """Refuse settings this node would ignore, rather than bypass them silently."""
+    on = [name for name, is_on in UNSUPPORTED_SETTINGS.items() if name in os.environ and is_on(os.environ[name])]
+    if on:
+        raise ValueError(f"main_async does not support {', '.join(on)}; run main:app instead")
+PEER_POOL_SIZE = int(os.getenv("PEER_POOL_SIZE", "32"))
+
+app = FastAPI()
+
+http_client: Optional[httpx.AsyncClient] = None
+broadcaster: Optional[AsyncBroadcaster] = None
+
+
+def get_peers():
+    peers = os.getenv("PEER_NODES", "")
+    return [p.strip() for p in peers.split(",") if p.strip()]
+
+
+# Peers on our own Redis already see every write, so syncs only go to peers
+# whose /sync/health reports another store id (see changes.py). A background
+# task re-checks every STORE_CHECK_SECONDS, as membership.py does for main.py,
+# so requests only read the result; a peer not checked yet counts as remote.
+STORE_CHECK_SECONDS = float(os.getenv("STORE_CHECK_SECONDS", "60"))
+_stores: Dict[str, Optional[str]] = {}  # peer url ("" = us) -> store id, None if unknown
+_store_task: Optional[asyncio.Task] = None
+
+
+# Redis-backed storage, mirroring main.py
+def _record(body: bytes, score: float) -> dict:
+    return ranked_record(decode_record(body), score)
+
+async def get_queue(start: int = 0, stop: int = -1) -> List[dict]:
+    ranked = await redis_client.zrange(QUEUE_KEY, start, stop, withscores=True)
+    if not ranked:
+        return []
+    bodies = await redis_client.hmget(TRACKS_KEY, [str(member_track_id(m)) for m, _ in ranked])
+    return [_record(body, score) for (_, score), body in zip(ranked, bodies) if body is not None]
+
+async def set_queue(records: List[dict]):
+    async with redis_client.pipeline() as pipe:
+        pipe.delete(QUEUE_KEY, TRACKS_KEY)
+        if records:
+            pipe.hset(TRACKS_KEY, mapping={str(r["id"]): encode_record(TRACK_CODEC, r) for r in records})
+            pipe.zadd(QUEUE_KEY, {queue_member(r["id"]): -r["votes"] for r in records})
+        await pipe.execute()
+
+# Local mutations INCR the store's Lamport clock (CLOCK_KEY) in their MULTI,
+# as in main.py, so the threaded nodes' anti-entropy counts writes made here;
+# `tick` is False for writes applied from a peer.
+async def put_track(record: dict, tick: bool = True):
+    async with redis_client.pipeline() as pipe:
+        pipe.hset(TRACKS_KEY, str(record["id"]), encode_record(TRACK_CODEC, record))
+        pipe.zadd(QUEUE_KEY, {queue_member(record["id"]): -record["votes"]})
+        if tick:
+            pipe.incr(CLOCK_KEY)
+        await pipe.execute()
+
+async def delete_track(track_id: int, tick: bool = True) -> bool:
+    async with redis_client.pipeline() as pipe:
+        pipe.zrem(QUEUE_KEY, queue_member(track_id))
+        pipe.hdel(TRACKS_KEY, str(track_id))
+        pipe.delete(voters_key(track_id))
+        if tick:
+            pipe.incr(CLOCK_KEY)
+        replies = await pipe.execute()
+    return bool(replies[0])
+
+async def change_votes(track_id: int, delta: int) -> Optional[int]:
+    async with redis_client.pipeline() as pipe:
+        pipe.zadd(QUEUE_KEY, {queue_member(track_id): -delta}, xx=True, incr=True)
+        pipe.incr(CLOCK_KEY)
+        score, _ = await pipe.execute()
+    return None if score is None else int(-score)
+
+async def read_clock() -> int:
+    return int(await redis_client.get(CLOCK_KEY) or 0)
+
+async def observe_clock(clock: Optional[int]):
+    if clock is not None:
+        await redis_client.eval(RAISE_CLOCK, 1, CLOCK_KEY, clock)
+
+async def get_track(track_id: int) -> Optional[dict]:
+    async with redis_client.pipeline() as pipe:
+        pipe.hget(TRACKS_KEY, str(track_id))
+        pipe.zscore(QUEUE_KEY, queue_member(track_id))
+        body, score = await pipe.execute()
+    if body is None or score is None:
+        return None
+    return _record(body, score)
+
+async def pop_top() -> Optional[dict]:
+    async def pop(pipe):
+        top = await pipe.zrange(QUEUE_KEY, 0, 0, withscores=True)
+        if not top:
+            return None
+        member, score = top[0]
+        field = str(member_track_id(member))
+        body = await pipe.hget(TRACKS_KEY, field)
+        pipe.multi()
+        pipe.zrem(QUEUE_KEY, member)
+        pipe.hdel(TRACKS_KEY, field)
+        pipe.delete(voters_key(int(field)))
+        pipe.incr(CLOCK_KEY)
+        return body, score
+
+    popped = await redis_client.transaction(pop, QUEUE_KEY, TRACKS_KEY, value_from_callable=True)
+    if popped is None or popped[0] is None:
+        return None
+    return _record(*popped)
+
+async def get_history(cursor: int = 0, limit: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+    async with redis_client.pipeline() as pipe:
+        pipe.llen(HISTORY_KEY)
+        pipe.get(HISTORY_COUNT_KEY)
+        length, total = await pipe.execute()
+    base = max(int(total or 0) - length, 0)
+    items = []
+    if archive is not None and cursor < base:
+        items = await run_in_threadpool(archive.read, cursor, base, None if limit is None else limit + 1)
+    if limit is None or len(items) <= limit:
+        start = max(cursor - base, 0)
+        stop = -1 if limit is None else start + limit - len(items)
+        items += [(base + start + i, body) for i, body in enumerate(await redis_client.lrange(HISTORY_KEY, start, stop))]
+    tracks = [decode_record(body) for _, body in items]
+    if limit is not None and len(items) > limit:
+        return tracks[:limit], items[limit][0]
+    return tracks, None
+
+async def add_to_history(record: dict):
+    async with redis_client.pipeline() as pipe:
+        pipe.rpush(HISTORY_KEY, encode_record(TRACK_CODEC, record))
+        pipe.rpush(HISTORY_TIMES_KEY, repr(time.time()))
+        pipe.incr(HISTORY_COUNT_KEY)
+        if HISTORY_MAX > 0 and archive is None:
+            pipe.ltrim(HISTORY_KEY, -HISTORY_MAX, -1)
+            pipe.ltrim(HISTORY_TIMES_KEY, -HISTORY_MAX, -1)
+        top_tracks.add_eval(pipe, record["id"], json.dumps({"title": record["title"], "artist": record["artist"]}).encode())
+        top_artists.add_eval(pipe, record["artist"])
+        await pipe.execute()
+
+def json_response(obj, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=json.dumps(obj).encode(), media_type="application/json", headers=headers)
+
+def page_response(items: List[dict], next_cursor: Optional[int]) -> Response:
+    headers = {} if next_cursor is None else {"X-Next-Cursor": str(next_cursor)}
+    return json_response(items, headers)
+
+
+# Peer sync: the same /sync, /sync/delta and /sync/snapshot protocol as main.py.
+# The event loop is single-threaded, so assigning a sequence number and
+# enqueueing the op happen without interleaving.
+_seq = 0
+_applied: Dict[str, Tuple[str, int]] = {}
+_applied_lock = asyncio.Lock()
+
+
+async def announce_change():
+    # Lets the threaded nodes on this Redis drop their read caches (see changes.py)
+    keys, args = announce_args(NODE_ID)
+    await redis_client.eval(ANNOUNCE, len(keys), *keys, *args)
+
+async def read_store_id() -> str:
+    # Same id as changes.store_id
+    found = await redis_client.get(STORE_ID_KEY)
+    if found is None:
+        await redis_client.set(STORE_ID_KEY, uuid.uuid4().hex, nx=True)
+        found = await redis_client.get(STORE_ID_KEY)
+    try:
+        run_id = (await redis_client.info("server")).get("run_id")
+    except aioredis.ResponseError:
+        run_id = None
+    return f"{found.decode()}:{run_id}" if run_id else found.decode()
+
+async def peer_store(peer: str) -> Optional[str]:
+    try:
+        resp = await http_client.get(f"{peer}/sync/health")
+        resp.raise_for_status()
+        return resp.json().get("store")
+    except Exception as e:
+        log.warning("Store check of %s failed: %s", peer, e)
+        return None
+
+async def check_stores():
+    peers = get_peers()
+    found = await asyncio.gather(read_store_id(), *(peer_store(peer) for peer in peers))
+    _stores.clear()
+    _stores.update(zip(["", *peers], found))
+
+async def watch_stores():
+    while True:
+        try:
+            await check_stores()
+        except Exception as e:
+            log.warning("Store check failed: %s", e)
+        await asyncio.sleep(STORE_CHECK_SECONDS)
+
+def store_id() -> str:
+    return _stores[""]
+
+def remote_peers() -> List[str]:
+    local = store_id()
+    return [peer for peer in get_peers() if _stores.get(peer) != local]
+
+async def publish_change(op: str, **fields):
+    global _seq
+    await announce_change()
+    peers = remote_peers()
+    if SYNC_MODE == "full":
+        if peers:
+            broadcaster.submit(peers, f"/sync?store={store_id()}", await get_queue())
+        return
+    _seq += 1
+    payload = {"origin": NODE_URL, "epoch": NODE_EPOCH, "seq": _seq, "clock": await read_clock(),
+               "store": store_id(), "op": op, **fields}
+    broadcaster.submit(peers, "/sync/delta", payload)
+
+async def publish_event(event_type: str, **data):
+    # Feeds GET /queue/events on the threaded nodes
+    await redis_client.publish(EVENTS_CHANNEL, json.dumps({"type": event_type, **data}))
+
+async def apply_op(op: SyncOp):
+    if op.op == "add":
+        await put_track(op.track.dict(), tick=False)
+    elif op.op == "vote":
+        await redis_client.zadd(QUEUE_KEY, {queue_member(op.id): -op.votes}, xx=True)
+    elif op.op in ("remove", "pop"):
+        await delete_track(op.id, tick=False)
+    elif op.op == "batch":
+        for track in op.tracks or []:
+            await put_track(track.dict(), tick=False)
+        for track_id in op.ids or []:
+            await delete_track(track_id, tick=False)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown op {op.op}")
+
+async def resync_from(origin: str) -> Tuple[str, int]:
+    resp = await http_client.get(f"{origin}/sync/snapshot")
+    resp.raise_for_status()
+    snapshot = resp.json()
+    await set_queue([Track(**t).dict() for t in snapshot["queue"]])
+    await announce_change()
+    await observe_clock(snapshot.get("clock"))
+    log.info("Resynced from %s at seq %d", origin, snapshot["seq"])
+    return snapshot["epoch"], snapshot["seq"]
+
+
+@app.on_event("startup")
+async def startup():
+    global http_client, broadcaster, _store_task
+    check_settings()
+    limits = httpx.Limits(max_connections=PEER_POOL_SIZE, max_keepalive_connections=PEER_POOL_SIZE)
+    http_client = httpx.AsyncClient(timeout=PEER_TIMEOUT, limits=limits)
+    broadcaster = AsyncBroadcaster(
+        http_client,
+        queue_size=int(os.getenv("BROADCAST_QUEUE_SIZE", "1000")),
+        failure_threshold=int(os.getenv("PEER_FAILURE_THRESHOLD", "3")),
+        cooldown=float(os.getenv("PEER_COOLDOWN", "10")),
+    )
+    if await redis_client.type(LEGACY_QUEUE_KEY) == b"list":
+        data = await redis_client.lrange(LEGACY_QUEUE_KEY, 0, -1)
+        await set_queue([Track(**json.loads(item)).dict() for item in data])
+        await redis_client.delete(LEGACY_QUEUE_KEY)
+    await redis_client.setnx(HISTORY_COUNT_KEY, await redis_client.llen(HISTORY_KEY))
+    _stores[""] = await read_store_id()  # peers are checked in the background
+    _store_task = asyncio.create_task(watch_stores())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    _store_task.cancel()
+    await broadcaster.stop()
+    await http_client.aclose()
+    await redis_pool.disconnect()
+
+
+@app.post("/add_track")
+async def add_track(track: Track):
+    record = track.dict()
+    await put_track(record)
+    await publish_change("add", track=record)
+    await publish_event("added", track=record)
+    return json_response({"message": "Track added", "track": record})
+
+
+@app.post("/remove_track")
+async def remove_track(action: TrackAction):
+    if await delete_track(action.id):
+        await publish_change("remove", id=action.id)
+        await publish_event("removed", id=action.id)
+    return json_response({"message": "Track removed", "id": action.id})
+
+
+@app.post("/vote")
+async def vote_track(action: TrackAction, up: bool = True):
+    votes = await change_votes(action.id, 1 if up else -1)
+    if votes is not None:
+        await publish_change("vote", id=action.id, votes=votes)
+        await publish_event("votes", id=action.id, votes=votes)
+    return json_response({"id": action.id, "votes": votes})
+
+
+@app.get("/queue")
+async def api_get_queue(limit: Optional[int] = Query(None, ge=1), cursor: int = Query(0, ge=0)):
+    window = await get_queue(cursor, -1 if limit is None else cursor + limit)
+    if limit is not None and len(window) > limit:
+        return page_response(window[:limit], cursor + limit)
+    return page_response(window, None)
+
+
+@app.get("/metadata/{track_id}")
+async def get_metadata(track_id: int):
+    track = await get_track(track_id)
+    if track is None:
+        raise HTTPException(status_code=404, detail="Track not found")
+    return json_response(track)
+
+
+@app.post("/play_next")
+async def play_next():
+    track = await pop_top()
+    if track is None:
+        raise HTTPException(status_code=400, detail="Queue empty")
+    await add_to_history(track)
+    await publish_change("pop", id=track["id"])
+    await publish_event("now_playing", track=track)
+    return json_response({"now_playing": track})
+
+
+@app.get("/history")
+async def api_get_history(limit: Optional[int] = Query(None, ge=1), cursor: int = Query(0, ge=0)):
+    if archive is not None:
+        limit = min(limit or HISTORY_PAGE_SIZE, HISTORY_PAGE_MAX)
+    return page_response(*await get_history(cursor, limit))
+
+
+@app.post("/sync")
+async def sync_queue(new_queue: List[Track], store: Optional[str] = None):
+    if store == store_id():
+        return json_response({"message": "Same store, sync ignored"})
+    queue = [t.dict() for t in new_queue]
+    await set_queue(queue)
+    await announce_change()
+    return json_response({"message": "Queue synchronized", "queue": queue})
+
+
+@app.post("/sync/delta")
+async def sync_delta(op: SyncOp):
+    if op.origin == NODE_URL:
+        return {"message": "Own op ignored", "seq": op.seq}
+    if op.store == store_id():
+        return {"message": "Same store, op ignored", "seq": op.seq}
+    async with _applied_lock:
+        epoch, last = _applied.get(op.origin, (None, 0))
+        if epoch == op.epoch and op.seq <= last:
+            return {"message": "Duplicate op ignored", "seq": last}
+        expected = last + 1 if epoch == op.epoch else 1
+        if op.seq != expected:
+            try:
+                _applied[op.origin] = await resync_from(op.origin)
+            except Exception as e:
+                raise HTTPException(status_code=503, detail=f"Resync from {op.origin} failed: {e}")
+            return {"message": "Queue resynchronized", "seq": _applied[op.origin][1]}
+        await apply_op(op)
+        await announce_change()
+        await observe_clock(op.clock)
+        _applied[op.origin] = (op.epoch, op.seq)
+    return {"message": "Op applied", "seq": op.seq}
+
+
+@app.get("/sync/health")
+async def sync_health():
+    return {"node": NODE_URL, "epoch": NODE_EPOCH, "store": store_id()}
+
+
+@app.get("/sync/snapshot")
+async def sync_snapshot():
+    # Read the sequence first: ops that land during the read are replayed, which is harmless
+    seq = _seq
+    return json_response({"epoch": NODE_EPOCH, "seq": seq, "clock": await read_clock(), "queue": await get_queue()})
+
+
+@app.post("/clear")
+async def clear_all():
+    await redis_client.delete(QUEUE_KEY, TRACKS_KEY, LEGACY_QUEUE_KEY, HISTORY_KEY, HISTORY_COUNT_KEY, HISTORY_TIMES_KEY)
+    if archive is not None:
+        await run_in_threadpool(archive.clear)
+    await announce_change()
+    await publish_event("cleared")
+    return {"message": "Queue and history cleared"}
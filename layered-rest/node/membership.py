@@ -0,0 +1,187 @@
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+HEALTH_PATH = "/sync/health"
+
+
+def parse_peers(spec: str) -> List[str]:
+    return [p.strip() for p in spec.split(",") if p.strip()]
+
+
+def resolve(address: str) -> Set[str]:
+    """Every peer URL behind "host:port", one per address the name resolves to
+    (a scaled Compose service resolves to all of its replicas)."""
+    host, _, port = address.partition(":")
+    port = int(port or 8000)
+    urls = set()
+    for *_, sockaddr in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+        ip = sockaddr[0]
+        urls.add(f"http://[{ip}]:{port}" if ":" in ip else f"http://{ip}:{port}")
+    return urls
+
+
+class Member:
+    def __init__(self, url: str, static: bool):
+        self.url = url
+        self.static = static  # listed in PEER_NODES; never dropped
+        self.healthy = True  # until checks say otherwise, so new peers get syncs at once
+        self.failures = 0
+        self.last_seen: Optional[float] = None
+        self.store: Optional[str] = None  # its Redis store id, from the last health check
+
+    def as_dict(self) -> dict:
+        return {"url": self.url, "healthy": self.healthy, "static": self.static,
+                "last_seen": self.last_seen, "store": self.store}
+
+
+class Membership:
+    """The set of peers this node syncs with.
+
+    Members come from a static list (PEER_NODES) plus, optionally, a DNS name
+    re-resolved every `interval` seconds, so replicas added by scaling join
+    without restarts and removed ones leave. Each round also health-checks
+    every member in parallel: `failure_threshold` failed checks in a row mark
+    a peer down and it is left out of `live()` until a check succeeds again.
+    A discovered address that answers with our own node URL is this node and
+    is ignored from then on. A static URL that does (a round-robin name such
+    as http://node:8000 can resolve to us) just skips that round's check.
+
+    Health checks also exchange Redis store ids (`store_id` returns ours).
+    Peers on the same store already see every write, so `remote()` leaves
+    them out, and of the peers sharing some other store it keeps only one,
+    since writing to one of them reaches all. A peer whose store is not known
+    yet is treated as remote on its own."""
+
+    def __init__(self, static: List[str], dns: str, node_url: str, session, timeout: float,
+                 interval: float, failure_threshold: int, store_id: Callable[[], str],
+                 on_leave: Optional[Callable[[str], None]] = None):
+        self.dns = dns
+        self.node_url = node_url
+        self.store_id = store_id
+        self.session = session
+        self.timeout = timeout
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.on_leave = on_leave
+        self._members: Dict[str, Member] = {url: Member(url, True) for url in static if url != node_url}
+        self._self_urls: Set[str] = {node_url}
+        self._live: List[str] = list(self._members)
+        self._remote: List[str] = list(self._members)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="peer-health")
+
+    def live(self) -> List[str]:
+        """Peers that are currently healthy; cheap, never blocks on the network."""
+        return self._live
+
+    def remote(self) -> List[str]:
+        """The peers that need syncs: one healthy peer per Redis store other than ours."""
+        return self._remote
+
+    def members(self) -> List[Member]:
+        with self._lock:
+            return list(self._members.values())
+
+    def refresh(self):
+        if self.dns:
+            try:
+                found = resolve(self.dns) - self._self_urls
+            except OSError as e:
+                # Keep the last known members while DNS is unavailable
+                log.warning("Resolving %s failed: %s", self.dns, e)
+                found = None
+            if found is not None:
+                self._update(found)
+        try:
+            local = self.store_id()
+        except Exception as e:
+            log.warning("Reading the local store id failed: %s", e)
+            local = None
+        members = self.members()
+        for member, (ok, store) in zip(members, self._pool.map(self._check, members)):
+            self._record(member, ok, store)
+        with self._lock:
+            self._live = [m.url for m in self._members.values() if m.healthy]
+            self._remote = self._pick_remote(local)
+
+    def _pick_remote(self, local: Optional[str]) -> List[str]:
+        # The lowest URL per store, so the same peer keeps getting the syncs
+        picked: Dict[str, str] = {}
+        unknown = []
+        for m in sorted(self._members.values(), key=lambda m: m.url):
+            if not m.healthy or (local is not None and m.store == local):
+                continue
+            if m.store is None:
+                unknown.append(m.url)
+            else:
+                picked.setdefault(m.store, m.url)
+        return sorted(unknown + list(picked.values()))
+
+    def _update(self, found: Set[str]):
+        with self._lock:
+            left = [url for url, m in self._members.items() if not m.static and url not in found]
+            for url in left:
+                del self._members[url]
+            joined = [url for url in found if url not in self._members]
+            for url in joined:
+                self._members[url] = Member(url, False)
+        for url in joined:
+            log.info("Peer %s joined", url)
+        for url in left:
+            self._leave(url)
+
+    def _leave(self, url: str):
+        log.info("Peer %s left", url)
+        if self.on_leave is not None:
+            self.on_leave(url)
+
+    def _check(self, member: Member) -> Tuple[Optional[bool], Optional[str]]:
+        """(True if healthy, False if not, None if it turned out to be this node; its store id)."""
+        try:
+            resp = self.session.get(f"{member.url}{HEALTH_PATH}", timeout=self.timeout)
+            resp.raise_for_status()
+            health = resp.json()
+            return (None if health.get("node") == self.node_url else True), health.get("store")
+        except Exception as e:
+            log.debug("Health check of %s failed: %s", member.url, e)
+            return False, None
+
+    def _record(self, member: Member, ok: Optional[bool], store: Optional[str]):
+        if ok is None:
+            if member.static:
+                member.store = store  # still tells us which Redis the name leads to
+                return
+            with self._lock:
+                self._self_urls.add(member.url)
+                self._members.pop(member.url, None)
+            self._leave(member.url)
+            return
+        if ok:
+            if not member.healthy:
+                log.info("Peer %s is back", member.url)
+            if member.store != store:
+                log.info("Peer %s uses store %s", member.url, store)
+            member.healthy = True
+            member.failures = 0
+            member.last_seen = time.time()
+            member.store = store
+            return
+        member.failures += 1
+        if member.healthy and member.failures >= self.failure_threshold:
+            member.healthy = False
+            log.warning("Peer %s is down after %d failed checks", member.url, member.failures)
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                log.error("Membership refresh failed: %s", e)
+            time.sleep(self.interval)
@@ -0,0 +1,201 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from log import get_logger
+from rooms import ROOM_PATH_PREFIX, split_room_path
+
+log = get_logger(__name__)
+
+# Metrics in the Prometheus text exposition format. Kept dependency-free and
+# cheap on the hot path: an observation is one bisect and a few additions
+# under a per-metric lock; all formatting happens at scrape time.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, k)} {_number(v)}" for k, v in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(k, list(counts), total) for k, (counts, total) in self._series.items()]
+        lines = []
+        names = self.labels + ("le",)
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(names, key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Callback:
+    """Gauge or counter read at scrape time; `read` returns {label values: value}."""
+
+    def __init__(self, name: str, help: str, read: Callable[[], Dict[Tuple[str, ...], float]],
+                 labels: Sequence[str] = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.kind = kind
+        self.read = read
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labels, k)} {_number(v)}" for k, v in self.read().items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        out = []
+        for metric in self.metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # One failing callback (e.g. Redis down) must not hide the rest
+                log.error("Failed to collect %s: %s", metric.name, e)
+                continue
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(samples)
+        return "\n".join(out) + "\n"
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware timing each HTTP request up to its response headers.
+
+    Requests are labelled by route template (e.g. /metadata/{track_id}) so the
+    series count stays bounded; timing stops at the response start so
+    long-lived streams are measured by their time to first byte. Responses
+    sent before routing (admission 429s, idempotent replays) are labelled
+    with the template of their path when it is a fixed path or a room
+    endpoint, and as "other" otherwise."""
+
+    ROOM_ROUTE = ROOM_PATH_PREFIX + "{room}"
+
+    def __init__(self, app, latency: Histogram, requests: Counter):
+        self.app = app
+        self.latency = latency
+        self.requests = requests
+        self._fixed: Optional[Set[str]] = None  # route paths without parameters
+        self._room: Set[str] = set()  # room routes, after /rooms/{room}
+
+    def unrouted_label(self, scope) -> str:
+        if self._fixed is None:
+            # Read from the app on first use, once every route is registered
+            paths = [getattr(r, "path", "") for r in getattr(scope.get("app"), "routes", [])]
+            self._room = {p[len(self.ROOM_ROUTE):] for p in paths if p.startswith(self.ROOM_ROUTE + "/")}
+            self._fixed = {p for p in paths if "{" not in p}
+        room, rest = split_room_path(scope["path"])
+        if room is None:
+            return rest if rest in self._fixed else "other"
+        return self.ROOM_ROUTE + rest if rest in self._room else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                path = route.path if route is not None else self.unrouted_label(scope)
+                self.latency.observe(time.perf_counter() - start, scope["method"], path)
+                self.requests.inc(scope["method"], path, str(message["status"]))
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+def instrument_redis(client, histogram: Histogram):
+    """Time every command issued through a sync redis-py client.
+
+    Single commands are labelled by name; a pipeline is timed as one round
+    trip and labelled MULTI or PIPELINE depending on whether it is transactional."""
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def timed_command(*args, **options):
+        start = time.perf_counter()
+        try:
+            return execute_command(*args, **options)
+        finally:
+            histogram.observe(time.perf_counter() - start, str(args[0]).upper())
+
+    def timed_pipeline(transaction=True, shard_hint=None):
+        pipe = pipeline(transaction, shard_hint)
+        execute = pipe.execute
+        label = "MULTI" if transaction else "PIPELINE"
+
+        def timed_execute(raise_on_error=True):
+            start = time.perf_counter()
+            try:
+                return execute(raise_on_error)
+            finally:
+                histogram.observe(time.perf_counter() - start, label)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_command
+    client.pipeline = timed_pipeline
@@ -0,0 +1,41 @@
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class Track(BaseModel):
+    id: int
+    title: str
+    artist: str
+    duration: int  # seconds
+    votes: int = 0
+
+class TrackAction(BaseModel):
+    id: int
+
+class Vote(BaseModel):
+    id: int
+    up: bool = True
+    listener: Optional[str] = None  # defaults to the X-Listener-Id header
+
+class SyncOp(BaseModel):
+    origin: str
+    epoch: str
+    seq: int
+    op: str  # add | remove | vote | pop | batch
+    track: Optional[Track] = None
+    id: Optional[int] = None
+    votes: Optional[int] = None
+    tracks: Optional[List[Track]] = None  # batch: final state of touched tracks
+    ids: Optional[List[int]] = None  # batch: touched tracks no longer queued
+    clock: Optional[int] = None  # sender's mutation clock (see anti-entropy in main.py)
+    store: Optional[str] = None  # sender's Redis store id; ops from our own store are dropped
+
+class CrdtTrack(BaseModel):
+    adds: Dict[str, Track] = {}  # OR-set add tag -> record
+    removed: List[str] = []  # tombstoned add tags
+    votes: Dict[str, int] = {}  # PN-counter component -> count
+    played: Dict[str, float] = {}  # tombstoned add tag -> play time
+
+class CrdtState(BaseModel):
+    tracks: Dict[int, CrdtTrack]  # SYNC_MODE=crdt: state of some or all track ids
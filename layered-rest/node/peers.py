@@ -0,0 +1,278 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Called after every delivery attempt with (peer url, seconds taken, succeeded)
+SendHook = Callable[[str, float, bool], None]
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial request
+    through once `cooldown` seconds have passed."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def blocked(self) -> bool:
+        """True while open and still cooling down (does not consume the trial)."""
+        with self._lock:
+            return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Half-open: re-arm the timer so only one trial goes out per cooldown
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class PeerSender:
+    """Delivers messages to one peer in order from a bounded queue on its own thread."""
+
+    def __init__(self, url: str, session: requests.Session, queue_size: int, timeout: float,
+                 breaker: CircuitBreaker, on_send: Optional[SendHook] = None):
+        self.url = url
+        self.session = session
+        self.timeout = timeout
+        self.breaker = breaker
+        self.on_send = on_send
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name=f"peer-sender-{url}", daemon=True)
+        self._thread.start()
+
+    def submit(self, path: str, body: bytes) -> bool:
+        # While the breaker is open there is no point queueing work for this peer;
+        # delta sync recovers the skipped ops through a snapshot on the next gap.
+        if self.breaker.blocked():
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait((path, body))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            log.error("Send queue full for %s, dropping %s", self.url, path)
+            return False
+
+    def stop(self):
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path, body = item
+            if not self.breaker.allow():
+                self.dropped += 1
+                continue
+            start = time.perf_counter()
+            ok = False
+            try:
+                resp = self.session.post(f"{self.url}{path}", data=body, headers=JSON_HEADERS, timeout=self.timeout)
+                if resp.status_code >= 500:
+                    raise requests.HTTPError(f"status {resp.status_code}")
+                self.breaker.record_success()
+                ok = True
+                log.debug("Sync response from %s%s: %s", self.url, path, resp.status_code)
+            except Exception as e:
+                self.breaker.record_failure()
+                state = "open" if self.breaker.is_open else "closed"
+                log.error("Failed to sync with %s: %s (breaker %s)", self.url, e, state)
+            if self.on_send is not None:
+                self.on_send(self.url, time.perf_counter() - start, ok)
+
+
+class Broadcaster:
+    """Fans messages out to peers off the request path.
+
+    Each peer gets its own sender thread and bounded queue, so peers are
+    contacted in parallel, messages to any one peer stay in order, and a slow
+    peer only backs up its own queue. All senders share one pooled keep-alive
+    session, and each payload is serialized once however many peers get it."""
+
+    def __init__(self, queue_size: int = 1000, timeout: float = 3.0,
+                 failure_threshold: int = 3, cooldown: float = 10.0, on_send: Optional[SendHook] = None):
+        self.queue_size = queue_size
+        self.on_send = on_send
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._senders: Dict[str, PeerSender] = {}
+        self._lock = threading.Lock()
+
+    def sender(self, url: str) -> PeerSender:
+        with self._lock:
+            sender = self._senders.get(url)
+            if sender is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.cooldown)
+                sender = PeerSender(url, self.session, self.queue_size, self.timeout, breaker, self.on_send)
+                self._senders[url] = sender
+            return sender
+
+    def submit(self, peers: List[str], path: str, payload) -> int:
+        """Queue `payload` for every peer; returns the encoded size in bytes (0 if no peers)."""
+        if not peers:
+            return 0
+        body = json.dumps(payload).encode()
+        for peer in peers:
+            self.sender(peer).submit(path, body)
+        return len(body)
+
+    def remove(self, url: str):
+        """Stop and forget the sender of a peer that left the membership."""
+        with self._lock:
+            sender = self._senders.pop(url, None)
+        if sender is not None:
+            sender.stop()
+
+    def senders(self) -> List[PeerSender]:
+        with self._lock:
+            return list(self._senders.values())
+
+    def stop(self):
+        with self._lock:
+            for sender in self._senders.values():
+                sender.stop()
+            self._senders.clear()
+        self.session.close()
+
+
+class AsyncBroadcaster:
+    """asyncio counterpart of Broadcaster for the async node.
+
+    One sender task and bounded asyncio.Queue per peer, sharing a pooled
+    keep-alive async HTTP client (anything with an awaitable `post`, e.g.
+    httpx.AsyncClient) and the same per-peer circuit breaking."""
+
+    def __init__(self, client, queue_size: int = 1000, failure_threshold: int = 3, cooldown: float = 10.0):
+        self.client = client
+        self.queue_size = queue_size
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._queues: Dict[str, "asyncio.Queue"] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._tasks: List["asyncio.Task"] = []
+
+    def submit(self, peers: List[str], path: str, payload):
+        for peer in peers:
+            q = self._queues.get(peer)
+            if q is None:
+                q = self._queues[peer] = asyncio.Queue(maxsize=self.queue_size)
+                self._breakers[peer] = CircuitBreaker(self.failure_threshold, self.cooldown)
+                self._tasks.append(asyncio.create_task(self._run(peer, q, self._breakers[peer])))
+            if self._breakers[peer].blocked():
+                continue
+            try:
+                q.put_nowait((path, payload))
+            except asyncio.QueueFull:
+                log.error("Send queue full for %s, dropping %s", peer, path)
+
+    async def _run(self, peer: str, q: "asyncio.Queue", breaker: CircuitBreaker):
+        while True:
+            path, payload = await q.get()
+            if not breaker.allow():
+                continue
+            try:
+                resp = await self.client.post(f"{peer}{path}", json=payload)
+                if resp.status_code >= 500:
+                    raise RuntimeError(f"status {resp.status_code}")
+                breaker.record_success()
+            except Exception as e:
+                breaker.record_failure()
+                state = "open" if breaker.is_open else "closed"
+                log.error("Failed to sync with %s: %s (breaker %s)", peer, e, state)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._queues.clear()
+
+
+class Coalescer:
+    """Merges keys added within `window` seconds into a single flush.
+
+    The first key in a quiet period starts a timer; every key added before it
+    fires joins the same flush. `merged` counts keys that did not cause a
+    flush of their own."""
+
+    def __init__(self, window: float, flush: Callable[[Set[Hashable]], None]):
+        self.window = window
+        self._flush_cb = flush
+        self._pending: Set[Hashable] = set()
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self.added = 0
+        self.flushes = 0
+
+    @property
+    def merged(self) -> int:
+        with self._lock:
+            return self.added - self.flushes - (1 if self._timer is not None else 0)
+
+    def add(self, key: Hashable):
+        with self._lock:
+            self.added += 1
+            self._pending.add(key)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            keys, self._pending = self._pending, set()
+            if not keys:
+                return
+            self.flushes += 1
+        try:
+            self._flush_cb(keys)
+        except Exception as e:
+            log.error("Coalesced flush failed: %s", e)
@@ -0,0 +1,49 @@
+"""Move rooms to the shards that own them under a new REDIS_SHARDS list.
+
+Usage:
+    python rebalance.py --from "shard-0=redis:6379" --to "shard-0=redis:6379,shard-1=redis-shard-1:6379"
+
+Scans every shard in both lists for room keys and moves each room whose
+owner on the new ring differs from where its keys are. Run it right after
+the nodes restart with the new list (see move_room in rooms.py for how
+writes made in between are kept). --dry-run only prints the plan.
+"""
+import argparse
+import os
+
+import redis
+
+from rooms import HashRing, move_room, parse_shards, rooms_on
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move rooms between Redis shards after REDIS_SHARDS changes")
+    parser.add_argument("--from", dest="old", required=True, help="previous REDIS_SHARDS value")
+    parser.add_argument("--to", dest="new", default=os.getenv("REDIS_SHARDS"), help="new REDIS_SHARDS value")
+    parser.add_argument("--history-max", type=int, default=int(os.getenv("HISTORY_MAX", "10000")))
+    parser.add_argument("--dry-run", action="store_true", help="print the moves without making them")
+    args = parser.parse_args()
+    if not args.new:
+        parser.error("--to is required when REDIS_SHARDS is not set")
+
+    old, new = parse_shards(args.old), parse_shards(args.new)
+    ring = HashRing(new)
+    # A shard that left the ring still has to be drained
+    shards = {**old, **new}
+    clients = {name: redis.Redis(host=host, port=port) for name, (host, port) in shards.items()}
+
+    moved = 0
+    for name, client in clients.items():
+        for room, keys in sorted(rooms_on(client).items()):
+            owner = ring.shard_for(room)
+            if owner == name:
+                continue
+            print(f"{room}: {name} -> {owner} ({len(keys)} keys)")
+            if not args.dry_run:
+                move_room(keys, client, clients[owner], args.history_max)
+            moved += 1
+    print(f"{moved} rooms {'to move' if args.dry_run else 'moved'}")
+
+
+if __name__ == "__main__":
+    main()
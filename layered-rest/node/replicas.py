@@ -0,0 +1,89 @@
+import itertools
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import redis
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+
+def parse_replicas(spec: str) -> List[Tuple[str, int]]:
+    """Parse "host:port,host:port,..." (port defaults to 6379)."""
+    replicas = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if entry:
+            host, _, port = entry.partition(":")
+            replicas.append((host, int(port or 6379)))
+    return replicas
+
+
+class ReplicaRouter:
+    """Routes reads to Redis replicas that are known to be nearly caught up.
+
+    Every `interval` seconds a background check reads the primary's
+    replication offset and each replica's. A replica counts as fresh when its
+    link is up and it has applied everything the primary had written at the
+    previous check, so at that check it was at most one interval behind.
+    That verdict is used for up to two more intervals, so one late check is
+    tolerated and data read from a replica is at most about three intervals
+    old. Reads go round-robin to fresh replicas, or to the primary when none
+    is fresh or the checks themselves have stopped."""
+
+    def __init__(self, primary, replicas: List[Tuple[str, int]], interval: float):
+        self.primary = primary  # raw-bytes client
+        self.replicas: Dict[str, redis.Redis] = {
+            f"{host}:{port}": redis.Redis(host=host, port=port) for host, port in replicas
+        }
+        self.interval = interval
+        self.fresh: Dict[str, bool] = {name: False for name in self.replicas}
+        self.reads = {"replica": 0, "primary": 0}
+        self._target = None  # primary offset at the previous check
+        self._checked = 0.0
+        self._usable: List[redis.Redis] = []
+        self._cycle = itertools.cycle([])
+        self._lock = threading.Lock()
+
+    def reader(self):
+        """A client to read from: a fresh replica if there is one, else the primary."""
+        with self._lock:
+            if self._usable and time.monotonic() - self._checked < 2 * self.interval:
+                self.reads["replica"] += 1
+                return next(self._cycle)
+            self.reads["primary"] += 1
+            return self.primary
+
+    def check(self):
+        started = time.monotonic()  # replicas are judged as of this moment
+        offset = self.primary.info("replication")["master_repl_offset"]
+        fresh = {}
+        for name, client in self.replicas.items():
+            try:
+                info = client.info("replication")
+                caught_up = info.get("slave_repl_offset", info.get("master_repl_offset", -1))
+                fresh[name] = (info.get("master_link_status") == "up" and self._target is not None
+                               and caught_up >= self._target)
+            except Exception as e:
+                log.warning("Replica %s check failed: %s", name, e)
+                fresh[name] = False
+        usable = [self.replicas[name] for name, ok in fresh.items() if ok]
+        with self._lock:
+            self.fresh = fresh
+            self._usable = usable
+            self._cycle = itertools.cycle(usable)
+            self._checked = started
+        self._target = offset
+
+    def run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                # Without a primary offset no replica can be vouched for
+                with self._lock:
+                    self._usable = []
+                log.warning("Replica lag check failed, reading from the primary: %s", e)
+            time.sleep(self.interval)
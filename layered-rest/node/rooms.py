@@ -0,0 +1,239 @@
+import bisect
+import hashlib
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import redis
+
+from codec import decode_record, encode_record
+from schema import ROOM_KEY_PREFIX, key_room, member_track_id, queue_member, ranked_record, room_key
+from votes import CLAIM_VOTES, claim_args, claim_results
+
+# Room-scoped queues. Each room lives whole on one Redis shard, chosen by a
+# consistent-hash ring over the shard names, so adding a shard only moves the
+# rooms that land on its new ring points (about 1/N of them). Every node talks
+# to every shard directly, so rooms need no peer sync.
+
+ROOM_PATH_PREFIX = "/rooms/"
+ROOM_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+DEFAULT_ROOM = "default"  # the unscoped endpoints; not a valid /rooms/ name
+RING_REPLICAS = 128  # ring points per shard; more points, more even spread
+
+
+def valid_room(room: str) -> bool:
+    return room != DEFAULT_ROOM and ROOM_PATTERN.fullmatch(room) is not None
+
+
+def split_room_path(path: str) -> Tuple[Optional[str], str]:
+    """("a", "/vote") for /rooms/a/vote; (None, path) for unscoped paths."""
+    if not path.startswith(ROOM_PATH_PREFIX):
+        return None, path
+    room, _, rest = path[len(ROOM_PATH_PREFIX):].partition("/")
+    return room, "/" + rest
+
+
+def parse_shards(spec: str) -> Dict[str, Tuple[str, int]]:
+    """Parse "name=host:port,host:port,..." into {name: (host, port)}.
+
+    A shard without a name is named by its address. Names, not addresses,
+    place rooms on the ring, so a shard can move to a new address without
+    moving any rooms as long as it keeps its name."""
+    shards = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, address = entry.rpartition("=")
+        host, _, port = address.partition(":")
+        shards[name or address] = (host, int(port or 6379))
+    if not shards:
+        raise ValueError("REDIS_SHARDS lists no shards")
+    return shards
+
+
+def _point(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring mapping room names to shard names."""
+
+    def __init__(self, shards: Iterable[str], replicas: int = RING_REPLICAS):
+        points = sorted((_point(f"{shard}#{i}"), shard) for shard in shards for i in range(replicas))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, room: str) -> str:
+        i = bisect.bisect(self._points, _point(room)) % len(self._points)
+        return self._shards[i]
+
+
+class RoomStore:
+    """One room's queue and history on its shard. Same layout and commands as
+    the unscoped queue in main.py, under the room's own keys (see schema.py)."""
+
+    def __init__(self, client, room: str, codec, history_max: int):
+        self.client = client  # raw-bytes client of the room's shard
+        self.room = room
+        self.codec = codec
+        self.history_max = history_max
+        self.queue_key = room_key(room, "order")
+        self.tracks_key = room_key(room, "tracks")
+        self.history_key = room_key(room, "history")
+        self.count_key = room_key(room, "history:count")
+
+    def voters_key(self, track_id: int) -> str:
+        return room_key(self.room, f"voters:{track_id}")
+
+    def _decode_ranked(self, ranked) -> List[dict]:
+        if not ranked:
+            return []
+        bodies = self.client.hmget(self.tracks_key, [str(member_track_id(m)) for m, _ in ranked])
+        return [ranked_record(decode_record(body), score) for (_, score), body in zip(ranked, bodies) if body is not None]
+
+    def queue(self, start: int = 0, stop: int = -1) -> List[dict]:
+        return self._decode_ranked(self.client.zrange(self.queue_key, start, stop, withscores=True))
+
+    def page(self, cursor: int, limit: Optional[int]) -> Tuple[List[dict], Optional[int]]:
+        window = self.queue(cursor, -1 if limit is None else cursor + limit)
+        if limit is not None and len(window) > limit:
+            return window[:limit], cursor + limit
+        return window, None
+
+    def put_tracks(self, records: List[dict]) -> List[bool]:
+        """Store many tracks in one MULTI; True for each id that was not queued before."""
+        pipe = self.client.pipeline()
+        for record in records:
+            pipe.hset(self.tracks_key, str(record["id"]), encode_record(self.codec, record))
+            pipe.zadd(self.queue_key, {queue_member(record["id"]): -record["votes"]})
+        return [bool(added) for added in pipe.execute()[1::2]]
+
+    def remove(self, track_id: int) -> bool:
+        pipe = self.client.pipeline()
+        pipe.zrem(self.queue_key, queue_member(track_id))
+        pipe.hdel(self.tracks_key, str(track_id))
+        pipe.delete(self.voters_key(track_id))
+        removed, _, _ = pipe.execute()
+        return bool(removed)
+
+    def change_votes_many(self, deltas: List[Tuple[int, int]]) -> List[Optional[int]]:
+        """Apply (id, delta) pairs in order in one MULTI; new counts, None where not queued."""
+        pipe = self.client.pipeline()
+        for track_id, delta in deltas:
+            pipe.zadd(self.queue_key, {queue_member(track_id): -delta}, xx=True, incr=True)
+        return [None if score is None else int(-score) for score in pipe.execute()]
+
+    def claim_votes(self, claims: List[Tuple[int, str]], mode: str, ttl: int) -> List[Optional[bool]]:
+        """Record (track id, listener) pairs with VOTE_DEDUP `mode`; see claim_votes in main.py."""
+        keys, args = claim_args(self.queue_key, mode, ttl, [
+            (self.voters_key(track_id), queue_member(track_id), listener) for track_id, listener in claims
+        ])
+        return claim_results(self.client.eval(CLAIM_VOTES, len(keys), *keys, *args))
+
+    def get_track(self, track_id: int) -> Optional[dict]:
+        pipe = self.client.pipeline()
+        pipe.hget(self.tracks_key, str(track_id))
+        pipe.zscore(self.queue_key, queue_member(track_id))
+        body, score = pipe.execute()
+        if body is None or score is None:
+            return None
+        return ranked_record(decode_record(body), score)
+
+    def pop(self) -> Optional[dict]:
+        """Remove the top track and append it to the room's history."""
+        def pop(pipe):
+            top = pipe.zrange(self.queue_key, 0, 0, withscores=True)
+            if not top:
+                return None
+            member, score = top[0]
+            field = str(member_track_id(member))
+            body = pipe.hget(self.tracks_key, field)
+            if body is None:
+                return None
+            track = ranked_record(decode_record(body), score)
+            pipe.multi()
+            pipe.zrem(self.queue_key, member)
+            pipe.hdel(self.tracks_key, field)
+            pipe.delete(self.voters_key(int(field)))
+            pipe.rpush(self.history_key, encode_record(self.codec, track))
+            pipe.incr(self.count_key)
+            if self.history_max > 0:
+                pipe.ltrim(self.history_key, -self.history_max, -1)
+            return track
+
+        return self.client.transaction(pop, self.queue_key, self.tracks_key, value_from_callable=True)
+
+    def history(self, cursor: int = 0, limit: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+        """History from absolute play index `cursor` on; see get_history in main.py."""
+        pipe = self.client.pipeline()
+        pipe.llen(self.history_key)
+        pipe.get(self.count_key)
+        length, total = pipe.execute()
+        base = max(int(total or 0) - length, 0)
+        start = max(cursor - base, 0)
+        stop = -1 if limit is None else start + limit
+        tracks = [decode_record(item) for item in self.client.lrange(self.history_key, start, stop)]
+        if limit is not None and len(tracks) > limit:
+            return tracks[:limit], base + start + limit
+        return tracks, None
+
+
+class ShardedRooms:
+    """Room stores routed to their shard by a HashRing over `shards`."""
+
+    def __init__(self, shards: Dict[str, Tuple[str, int]], codec, history_max: int):
+        self.ring = HashRing(shards)
+        self.clients = {name: redis.Redis(host=host, port=port) for name, (host, port) in shards.items()}
+        self.codec = codec
+        self.history_max = history_max
+
+    def shard_for(self, room: str) -> str:
+        return self.ring.shard_for(room)
+
+    def store(self, room: str) -> RoomStore:
+        return RoomStore(self.clients[self.shard_for(room)], room, self.codec, self.history_max)
+
+    def clear(self):
+        for client in self.clients.values():
+            for key in client.scan_iter(match=f"{ROOM_KEY_PREFIX}*", count=1000):
+                client.delete(key)
+
+
+def rooms_on(client) -> Dict[str, List[bytes]]:
+    """Every room with keys on one shard, and those keys."""
+    rooms: Dict[str, List[bytes]] = {}
+    for key in client.scan_iter(match=f"{ROOM_KEY_PREFIX}*", count=1000):
+        rooms.setdefault(key_room(key.decode()), []).append(key)
+    return rooms
+
+
+def move_room(keys: List[bytes], source, target, history_max: int):
+    """Merge one room's keys from `source` into `target`, then delete them from `source`.
+
+    Meant to run just after nodes switch to the new shard list, so the target
+    may already hold writes made since. Those win: tracks and records already
+    on the target are kept, the source's history goes in front of the
+    target's, and voter keys are copied only where the target has none."""
+    pipe = target.pipeline()
+    for key in keys:
+        kind = key.decode().split("}:", 1)[1]
+        if kind == "order":
+            pipe.zadd(key, dict(source.zrange(key, 0, -1, withscores=True)), nx=True)
+        elif kind == "tracks":
+            for field, body in source.hgetall(key).items():
+                pipe.hsetnx(key, field, body)
+        elif kind == "history":
+            entries = source.lrange(key, 0, -1)
+            if entries:
+                pipe.lpush(key, *reversed(entries))
+                if history_max > 0:
+                    pipe.ltrim(key, -history_max, -1)
+        elif kind == "history:count":
+            pipe.incrby(key, int(source.get(key) or 0))
+        elif not target.exists(key):
+            ttl = source.pttl(key)
+            dump = source.dump(key)
+            if dump is not None:
+                pipe.restore(key, max(ttl, 0), dump)
+    pipe.execute()
+    source.delete(*keys)
@@ -0,0 +1,72 @@
+# Redis key layout shared by the sync (main.py) and async (main_async.py) nodes.
+#
+# The queue is kept as a sorted set of track ids (ordering) plus a hash of
+# track records keyed by id, so a vote is a single ZINCRBY instead of a full
+# rewrite and a lookup by id is a single HGET. Both keys change together in
+# one MULTI (or a WATCHed transaction) on every mutation.
+# Scores are negated vote counts; members are zero-padded ids, so ZRANGE
+# returns tracks by votes descending, then by id ascending for ties.
+from typing import List
+
+QUEUE_KEY = "music_queue:order"
+TRACKS_KEY = "music_queue:tracks"
+HISTORY_KEY = "music_history"
+HISTORY_COUNT_KEY = "music_history:count"  # total ever played; anchors history cursors
+HISTORY_TIMES_KEY = "music_history:times"  # play time of each history entry, same positions
+ARCHIVER_LOCK_KEY = "music_history:archiver"  # held by the node moving history to disk
+LEGACY_QUEUE_KEY = "music_queue"  # pre-sorted-set list layout
+VOTERS_KEY_PREFIX = "music_voters:"  # per-track voter set/bitmap; outside music_queue:* on purpose
+IDEMPOTENCY_KEY_PREFIX = "music_idempotency:"  # stored responses for retried POSTs
+RATE_LIMIT_KEY_PREFIX = "music_ratelimit:"  # token buckets per client and per room
+STATS_KEY_PREFIX = "music_stats:"  # heavy-hitter play counts (see topk.py)
+TOP_TRACKS_KEY = "music_stats:top_tracks"
+TOP_ARTISTS_KEY = "music_stats:top_artists"
+EVENTS_CHANNEL = "music_queue:events"  # pub/sub channel feeding GET /queue/events
+CHANGES_CHANNEL = "music_queue:changes"  # "<version> <node id>" per queue change, for read caches
+CHANGES_VERSION_KEY = "music_store:version"  # bumped with every message on CHANGES_CHANNEL
+STORE_ID_KEY = "music_store:id"  # random id of this Redis; nodes reading the same id share a store
+CLOCK_KEY = "music_store:clock"  # Lamport clock of queue mutations, for anti-entropy (main.py)
+
+# SYNC_MODE=crdt state (see crdt.py); the keys above become its materialized view
+CRDT_KEY_PREFIX = "music_crdt:"
+CRDT_IDS_KEY = "music_crdt:ids"  # every id ever added, for full-state export
+CRDT_PLAYED_KEY = "music_crdt:played"  # played log: add tag -> first play time
+
+# Room-scoped queues (/rooms/{room}/..., see rooms.py) use the same layout under
+# music_room:{<room>}:order, :tracks, :history, :history:count and :voters:<id>.
+# The braces are a Redis Cluster hash tag, keeping one room's keys together.
+ROOM_KEY_PREFIX = "music_room:"
+
+ID_OFFSET = 2 ** 63  # keeps negative ids in numeric order inside the padding
+
+
+def queue_member(track_id: int) -> str:
+    return f"{track_id + ID_OFFSET:020d}"
+
+
+def member_track_id(member) -> int:
+    return int(member) - ID_OFFSET
+
+
+def voters_key(track_id: int) -> str:
+    return f"{VOTERS_KEY_PREFIX}{track_id}"
+
+
+def crdt_keys(track_id: int) -> List[str]:
+    """OR-set adds, OR-set tombstones and PN-counter components for one track."""
+    return [f"{CRDT_KEY_PREFIX}{kind}:{track_id}" for kind in ("adds", "removed", "votes")]
+
+
+def room_key(room: str, kind: str) -> str:
+    return f"{ROOM_KEY_PREFIX}{{{room}}}:{kind}"
+
+
+def key_room(key: str) -> str:
+    """The room a music_room:{<room>}:... key belongs to."""
+    return key[len(ROOM_KEY_PREFIX) + 1:key.index("}:")]
+
+
+def ranked_record(record: dict, score: float) -> dict:
+    """A decoded record with its live vote count taken from the sorted-set score."""
+    record["votes"] = int(-score)
+    return record
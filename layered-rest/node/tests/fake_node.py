@@ -0,0 +1,75 @@
+"""In-process REST nodes (main.py) on fakeredis, for tests of the endpoints.
+
+Every load_node call executes main.py as a new module, so each node has its
+own settings and in-memory state, and all of its Redis clients talk to the
+given FakeServer. Nothing is started in the background (no startup event), so
+tests drive anti-entropy, membership and the like by calling them directly.
+"""
+import importlib.util
+import itertools
+import os
+from unittest import mock
+
+import fakeredis
+import redis
+import requests
+from fastapi.testclient import TestClient
+
+NODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# No peers, background loops or admission limits unless a test asks for them
+DEFAULTS = {
+    "PEER_NODES": "", "PEER_DNS": "", "ANTI_ENTROPY_SECONDS": "0", "READ_CACHE": "0",
+    "MAX_INFLIGHT": "0", "REDIS_REPLICAS": "", "HISTORY_ARCHIVE": "",
+}
+
+_count = itertools.count()
+
+
+def load_node(server, url: str = "http://node-a:8000", **env):
+    def fake_redis(host=None, port=None, decode_responses=False, **_):
+        return fakeredis.FakeRedis(server=server, decode_responses=decode_responses)
+
+    spec = importlib.util.spec_from_file_location(f"node_under_test_{next(_count)}", os.path.join(NODE_DIR, "main.py"))
+    node = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(os.environ, {**DEFAULTS, "NODE_URL": url, **env}), mock.patch.object(redis, "Redis", fake_redis):
+        spec.loader.exec_module(node)
+    return node
+
+
+def add(client, track_id: int, votes: int = 0, **params):
+    return client.post("/add_track", params=params, json={
+        "id": track_id, "title": f"Song{track_id}", "artist": "A", "duration": 200, "votes": votes})
+
+
+def queue(client) -> list:
+    """(id, votes) of GET /queue."""
+    return [(t["id"], t["votes"]) for t in client.get("/queue").json()]
+
+
+class Network:
+    """Stands in for the requests session nodes reach peers with, routing each
+    peer URL to that node's TestClient; unknown URLs fail to connect."""
+
+    def __init__(self):
+        self.clients = {}
+
+    def join(self, node) -> TestClient:
+        client = self.clients[node.NODE_URL] = TestClient(node.app)
+        node.broadcaster.session = self
+        node.membership.session = self
+        return client
+
+    def _route(self, url: str):
+        for base, client in self.clients.items():
+            if url.startswith(base + "/"):
+                return client, url[len(base):]
+        raise requests.ConnectionError(f"no route to {url}")
+
+    def get(self, url: str, timeout=None):
+        client, path = self._route(url)
+        return client.get(path)
+
+    def post(self, url: str, data=None, json=None, headers=None, timeout=None):
+        client, path = self._route(url)
+        return client.post(path, content=data, json=json, headers=headers)
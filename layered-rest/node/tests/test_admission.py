@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis runs the Lua scripts with it)
+except ImportError:
+    fakeredis = None
+
+from admission import AdmissionMiddleware
+from metrics import Counter
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def request(middleware, path: str = "/vote", client: str = "10.0.0.1", room: str = None):
+    """(status, headers) of one request sent through `middleware`."""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    headers = [(b"x-real-ip", client.encode())] + ([(b"x-room", room.encode())] if room else [])
+    scope = {"type": "http", "path": path, "headers": headers, "client": ("127.0.0.1", 5000)}
+    asyncio.run(middleware(scope, receive, send))
+    return sent[0]["status"], dict(sent[0]["headers"])
+
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+class TestAdmission(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server)
+        self.rejected = Counter("admission_rejected_total", "", ("reason",))
+
+    def middleware(self, client_rate=0.0, client_burst=20, room_rate=0.0, room_burst=200, max_inflight=0):
+        return AdmissionMiddleware(ok_app, self.redis, client_rate=client_rate, client_burst=client_burst,
+                                   room_rate=room_rate, room_burst=room_burst, max_inflight=max_inflight,
+                                   exempt=("/sync", "/metrics"), prefix="test_ratelimit:", rejected=self.rejected)
+
+    def test_client_bucket_answers_429_with_retry_after(self) -> None:
+        mw = self.middleware(client_rate=0.5, client_burst=2)
+        self.assertEqual(request(mw)[0], 200)
+        self.assertEqual(request(mw)[0], 200)
+        status, headers = request(mw)
+        self.assertEqual(status, 429)
+        # One token comes back every 2 s
+        self.assertIn(int(headers[b"retry-after"]), (1, 2))
+        self.assertEqual(self.rejected.samples(), ['admission_rejected_total{reason="rate"} 1'])
+
+    def test_buckets_are_per_client(self) -> None:
+        mw = self.middleware(client_rate=0.5, client_burst=1)
+        self.assertEqual(request(mw, client="10.0.0.1")[0], 200)
+        self.assertEqual(request(mw, client="10.0.0.1")[0], 429)
+        self.assertEqual(request(mw, client="10.0.0.2")[0], 200)
+
+    def test_room_bucket_covers_room_paths_and_header(self) -> None:
+        mw = self.middleware(room_rate=0.5, room_burst=2)
+        self.assertEqual(request(mw, "/rooms/jazz/vote", client="a")[0], 200)
+        self.assertEqual(request(mw, "/vote", client="b", room="jazz")[0], 200)
+        self.assertEqual(request(mw, "/rooms/jazz/vote", client="c")[0], 429)
+        self.assertEqual(request(mw, "/rooms/rock/vote", client="c")[0], 200)
+
+    def test_inflight_cap(self) -> None:
+        mw = self.middleware(max_inflight=1)
+        mw.inflight = 1  # one request already running
+        status, headers = request(mw)
+        self.assertEqual(status, 429)
+        self.assertEqual(headers[b"retry-after"], b"1")
+        self.assertEqual(self.rejected.samples(), ['admission_rejected_total{reason="inflight"} 1'])
+        mw.inflight = 0
+        self.assertEqual(request(mw)[0], 200)
+        self.assertEqual(mw.inflight, 0)
+
+    def test_exempt_paths_are_never_limited(self) -> None:
+        mw = self.middleware(client_rate=0.5, client_burst=1, max_inflight=1)
+        mw.inflight = 1
+        for _ in range(3):
+            self.assertEqual(request(mw, "/sync/delta")[0], 200)
+
+    def test_admits_when_redis_is_down(self) -> None:
+        mw = self.middleware(client_rate=0.5, client_burst=1)
+        self.server.connected = False
+        self.assertEqual(request(mw)[0], 200)
+        self.assertEqual(request(mw)[0], 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
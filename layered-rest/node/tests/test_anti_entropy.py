@@ -0,0 +1,68 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis runs the Lua scripts with it)
+    from tests.fake_node import Network, add, load_node, queue
+except ImportError:
+    fakeredis = None
+
+A, B = "http://node-a:8000", "http://node-b:8000"
+
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+class TestAntiEntropy(unittest.TestCase):
+    """Two nodes on separate stores and no peer lists, so writes do not sync
+    and only the reconcile rounds called here repair divergence."""
+
+    def setUp(self) -> None:
+        self.net = Network()
+        self.server_a = fakeredis.FakeServer()
+        self.a = load_node(self.server_a, A)
+        self.b = load_node(fakeredis.FakeServer(), B)
+        self.client_a, self.client_b = self.net.join(self.a), self.net.join(self.b)
+
+    def test_local_writes_tick_the_clock(self) -> None:
+        add(self.client_a, 1)
+        add(self.client_a, 2)
+        self.client_a.post("/vote", json={"id": 1})
+        self.client_a.post("/remove_track", json={"id": 2})
+        self.assertEqual(self.a.read_clock(), 4)
+        self.assertEqual(self.client_a.get("/sync/digest").json()["clock"], 4)
+
+    def test_node_behind_pulls_the_peer_ahead(self) -> None:
+        add(self.client_a, 1)
+        add(self.client_a, 2, votes=3)
+        add(self.client_b, 7)
+        self.assertTrue(self.b.reconcile(A, self.b.queue_digest()))
+        self.assertEqual(queue(self.client_b), [(2, 3), (1, 0)])
+        self.assertEqual(self.b.read_clock(), 2)
+        # Converged: the next round finds equal digests on both sides
+        self.assertFalse(self.a.reconcile(B, self.a.queue_digest()))
+        self.assertFalse(self.b.reconcile(A, self.b.queue_digest()))
+
+    def test_node_ahead_does_not_pull(self) -> None:
+        add(self.client_a, 1)
+        add(self.client_b, 7)
+        add(self.client_b, 8)
+        self.assertFalse(self.b.reconcile(A, self.b.queue_digest()))
+        self.assertEqual(queue(self.client_b), [(7, 0), (8, 0)])
+
+    def test_clock_survives_a_restart(self) -> None:
+        for track_id in (1, 2, 3):
+            add(self.client_a, track_id)
+        add(self.client_b, 7)
+        # A new process on A's store starts from the stored clock, not zero
+        restarted = load_node(self.server_a, A)
+        self.net.join(restarted)
+        self.assertFalse(restarted.reconcile(B, restarted.queue_digest()))
+        self.assertTrue(self.b.reconcile(A, self.b.queue_digest()))
+        self.assertEqual(queue(self.client_b), [(1, 0), (2, 0), (3, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis runs the Lua scripts with it)
+    from tests.fake_node import load_node
+    from fastapi.testclient import TestClient
+except ImportError:
+    fakeredis = None
+
+from archive import archive_step
+
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+class TestHistoryArchive(unittest.TestCase):
+    """Ten plays at t=1000..1009, the oldest six moved to the archive."""
+
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.node = load_node(fakeredis.FakeServer(), HISTORY_ARCHIVE=os.path.join(tmp.name, "history.db"),
+                              HISTORY_PAGE_SIZE="4")
+        self.client = TestClient(self.node.app)
+        for i in range(10):
+            with mock.patch("time.time", return_value=1000.0 + i):
+                self.node.add_to_history({"id": i, "title": f"Song{i}", "artist": "A", "duration": 200, "votes": 0})
+
+    def step(self, keep: int = 4) -> int:
+        return archive_step(self.node.redis_bin, self.node.archive, keep, 0, 100)
+
+    def history(self, **params) -> list:
+        """Ids of every page of GET /history, following X-Next-Cursor."""
+        ids = []
+        while True:
+            resp = self.client.get("/history", params=params)
+            ids += [t["id"] for t in resp.json()]
+            if "X-Next-Cursor" not in resp.headers:
+                return ids
+            params["cursor"] = resp.headers["X-Next-Cursor"]
+
+    def test_step_moves_the_oldest_entries(self) -> None:
+        self.assertEqual(self.step(), 6)
+        self.assertEqual(self.step(), 0)
+        self.assertEqual(self.node.archive.entries(), 6)
+        self.assertEqual(self.node.redis_bin.llen(self.node.HISTORY_KEY), 4)
+        self.assertEqual(self.node.redis_bin.llen(self.node.HISTORY_TIMES_KEY), 4)
+
+    def test_age_limit_moves_old_entries(self) -> None:
+        with mock.patch("time.time", return_value=1010.0):
+            self.assertEqual(archive_step(self.node.redis_bin, self.node.archive, 100, 7.5, 100), 3)
+
+    def test_step_after_a_crash_only_trims(self) -> None:
+        # The segment was written but the process died before trimming Redis
+        bodies = self.node.redis_bin.lrange(self.node.HISTORY_KEY, 0, 5)
+        self.node.archive.append(0, [(1000.0 + i, body) for i, body in enumerate(bodies)])
+        self.assertEqual(self.step(), 6)
+        self.assertEqual(self.node.archive.entries(), 6)
+        self.assertEqual(self.history(), list(range(10)))
+
+    def test_history_pages_across_tiers(self) -> None:
+        self.step()
+        self.assertEqual(self.history(limit=3), list(range(10)))
+        # Without a limit pages are HISTORY_PAGE_SIZE long
+        self.assertEqual([t["id"] for t in self.client.get("/history").json()], [0, 1, 2, 3])
+        self.assertEqual(self.history(cursor=5), list(range(5, 10)))
+
+    def test_since_finds_entries_in_either_tier(self) -> None:
+        self.step()
+        self.assertEqual(self.node.history_index_since(1002.0), 2)
+        self.assertEqual(self.node.history_index_since(1007.5), 8)
+        self.assertEqual(self.node.history_index_since(2000.0), 10)
+        self.assertEqual(self.history(since=1002.5), list(range(3, 10)))
+        self.assertEqual(self.history(since=1008), [8, 9])
+
+    def test_since_without_archive(self) -> None:
+        self.node.archive = None
+        self.assertEqual(self.node.history_index_since(0), 0)
+        self.assertEqual(self.node.history_index_since(1004.0), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis runs the Lua scripts with it)
+    from tests.fake_node import add, load_node, queue
+    from fastapi.testclient import TestClient
+except ImportError:
+    fakeredis = None
+
+from cache import ReadCache
+
+
+class TestReadCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = ReadCache()
+        self.builds = 0
+
+    def build(self) -> int:
+        self.builds += 1
+        return self.builds
+
+    def test_disabled_cache_always_builds(self) -> None:
+        self.assertEqual(self.cache.get("queue", self.build), 1)
+        self.assertEqual(self.cache.get("queue", self.build), 2)
+        self.assertIsNone(self.cache.peek("queue"))
+
+    def test_enabled_cache_serves_until_invalidated(self) -> None:
+        self.cache.enable("keyspace")
+        self.assertEqual(self.cache.get("queue", self.build), 1)
+        self.assertEqual(self.cache.get("queue", self.build), 1)
+        self.assertEqual(self.cache.peek("queue"), 1)
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.peek("queue"))
+        self.assertEqual(self.cache.get("queue", self.build), 2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_disabled_once_every_source_is_gone(self) -> None:
+        self.cache.enable("keyspace")
+        self.cache.enable("changes")
+        self.cache.get("queue", self.build)
+        self.cache.disable("keyspace")
+        # Each source change drops entries: writes may have been missed meanwhile
+        self.assertIsNone(self.cache.peek("queue"))
+        self.assertTrue(self.cache.enabled)
+        self.cache.disable("changes")
+        self.assertFalse(self.cache.enabled)
+
+    def test_build_overlapping_a_write_is_not_stored(self) -> None:
+        self.cache.enable("keyspace")
+
+        def build_during_write():
+            self.cache.invalidate()  # a write lands while the value is being built
+            return "stale"
+
+        self.assertEqual(self.cache.get("queue", build_during_write), "stale")
+        self.assertIsNone(self.cache.peek("queue"))
+        self.assertEqual(self.cache.get("queue", self.build), 1)
+
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+class TestNodeReadCache(unittest.TestCase):
+    def setUp(self) -> None:
+        server = fakeredis.FakeServer()
+        self.node = load_node(server)
+        self.node.read_cache.enable("test")
+        self.client = TestClient(self.node.app)
+        # A second node on the same store, whose writes only a watcher would report
+        self.other = TestClient(load_node(server, "http://node-b:8000").app)
+
+    def test_local_writes_invalidate(self) -> None:
+        add(self.client, 1)
+        self.assertEqual(queue(self.client), [(1, 0)])
+        hits = self.node.read_cache.hits
+        self.assertEqual(queue(self.client), [(1, 0)])
+        self.assertGreater(self.node.read_cache.hits, hits)
+        self.client.post("/vote", json={"id": 1})
+        add(self.client, 2)
+        self.assertEqual(queue(self.client), [(1, 1), (2, 0)])
+        self.client.post("/remove_track", json={"id": 1})
+        self.assertEqual(queue(self.client), [(2, 0)])
+
+    def test_remote_writes_need_a_notification(self) -> None:
+        add(self.client, 1)
+        queue(self.client)
+        add(self.other, 2)
+        self.assertEqual(queue(self.client), [(1, 0)])
+        self.node.read_cache.invalidate()  # what the keyspace and change watchers do
+        self.assertEqual(queue(self.client), [(1, 0), (2, 0)])
+
+    def test_without_a_watcher_reads_go_to_redis(self) -> None:
+        self.node.read_cache.disable("test")
+        add(self.client, 1)
+        queue(self.client)
+        add(self.other, 2)
+        self.assertEqual(queue(self.client), [(1, 0), (2, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
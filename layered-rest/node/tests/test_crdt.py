@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis runs the Lua scripts with it)
+except ImportError:
+    fakeredis = None
+
+from codec import decode_record, get_codec
+from crdt import CrdtQueue
+from schema import CRDT_PLAYED_KEY, QUEUE_KEY, TRACKS_KEY, member_track_id
+
+
+def track(track_id: int, votes: int = 0) -> dict:
+    return {"id": track_id, "title": f"Song{track_id}", "artist": "A", "duration": 200, "votes": votes}
+
+
+def queue(node: CrdtQueue) -> list:
+    """(id, votes) of the materialized queue, in queue order."""
+    ranked = node.client.zrange(QUEUE_KEY, 0, -1, withscores=True)
+    bodies = node.client.hmget(TRACKS_KEY, [str(member_track_id(m)) for m, _ in ranked]) if ranked else []
+    return [(decode_record(body)["id"], int(-score)) for (_, score), body in zip(ranked, bodies)]
+
+
+def sync(source: CrdtQueue, target: CrdtQueue) -> list:
+    return target.merge(source.export())
+
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+class TestCrdtQueue(unittest.TestCase):
+    def setUp(self) -> None:
+        codec = get_codec("struct")
+        self.a = CrdtQueue(fakeredis.FakeRedis(server=fakeredis.FakeServer()), "a", codec)
+        self.b = CrdtQueue(fakeredis.FakeRedis(server=fakeredis.FakeServer()), "b", codec)
+
+    def test_merge_commutes(self) -> None:
+        self.a.add_many([track(1), track(2, votes=3)])
+        self.b.add_many([track(3)])
+        self.a.vote_many([(1, 2)])
+        self.b.vote_many([(3, -1)])
+        state_a, state_b = self.a.export(), self.b.export()
+        # b applies a then b's own; a applies b then its own
+        self.a.merge(state_b)
+        self.b.merge(state_a)
+        self.assertEqual(queue(self.a), queue(self.b))
+        self.assertEqual(queue(self.a), [(2, 3), (1, 2), (3, -1)])
+
+    def test_merge_is_idempotent(self) -> None:
+        self.a.add_many([track(1)])
+        self.a.vote_many([(1, 1)])
+        sync(self.a, self.b)
+        before = queue(self.b)
+        for _, votes_before, votes_after, played in sync(self.a, self.b):
+            self.assertEqual(votes_before, votes_after)
+            self.assertEqual(played, [])
+        self.assertEqual(queue(self.b), before)
+        self.assertEqual(before, [(1, 1)])
+
+    def test_votes_from_two_nodes_add_up(self) -> None:
+        self.a.add_many([track(1)])
+        sync(self.a, self.b)
+        self.a.vote_many([(1, 1), (1, 1)])
+        self.b.vote_many([(1, 1)])
+        sync(self.a, self.b)
+        sync(self.b, self.a)
+        self.assertEqual(queue(self.a), [(1, 3)])
+        self.assertEqual(queue(self.b), [(1, 3)])
+
+    def test_concurrent_pop_plays_once(self) -> None:
+        self.a.add_many([track(1), track(2)])
+        self.a.vote_many([(1, 1)])
+        sync(self.a, self.b)
+        self.assertIsNotNone(self.a.pop())
+        self.assertIsNotNone(self.b.pop())
+        # Each node already logged its own play, so neither merge reports a new one
+        self.assertEqual([r for *_, played in sync(self.a, self.b) for r in played], [])
+        self.assertEqual([r for *_, played in sync(self.b, self.a) for r in played], [])
+        self.assertEqual(queue(self.a), [(2, 0)])
+        self.assertEqual(queue(self.b), [(2, 0)])
+        self.assertEqual(self.a.client.zcard(CRDT_PLAYED_KEY), 1)
+        self.assertEqual(self.b.client.zcard(CRDT_PLAYED_KEY), 1)
+
+    def test_pop_reaches_peer_as_one_play(self) -> None:
+        self.a.add_many([track(1, votes=2)])
+        sync(self.a, self.b)
+        self.a.pop()
+        results = sync(self.a, self.b)
+        played = [r for *_, records in results for r in records]
+        self.assertEqual([(r["id"], r["votes"]) for r in played], [(1, 2)])
+        self.assertEqual(queue(self.b), [])
+        self.assertEqual([r for *_, records in sync(self.a, self.b) for r in records], [])
+
+    def test_readd_after_remove(self) -> None:
+        self.a.add_many([track(1)])
+        self.a.vote_many([(1, 5)])
+        sync(self.a, self.b)
+        self.b.remove(1)
+        sync(self.b, self.a)
+        self.assertEqual(queue(self.a), [])
+        self.assertEqual(self.a.add_many([track(1)]), [True])
+        sync(self.a, self.b)
+        # The new add starts from its own votes, not the removed add's
+        self.assertEqual(queue(self.a), [(1, 0)])
+        self.assertEqual(queue(self.b), [(1, 0)])
+
+    def test_concurrent_add_survives_remove(self) -> None:
+        self.a.add_many([track(1)])
+        sync(self.a, self.b)
+        self.b.remove(1)
+        self.a.add_many([track(1)])  # not yet seen by b: add wins
+        sync(self.a, self.b)
+        sync(self.b, self.a)
+        self.assertEqual(queue(self.a), [(1, 0)])
+        self.assertEqual(queue(self.b), [(1, 0)])
+
+    def test_export_of_live_ids(self) -> None:
+        self.a.add_many([track(1), track(2)])
+        self.a.remove(1, played_at=time.time())
+        self.assertEqual(self.a.live_ids(), [2])
+        self.assertEqual(list(self.a.export(self.a.live_ids())["tracks"]), [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
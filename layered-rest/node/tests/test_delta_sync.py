@@ -0,0 +1,81 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis runs the Lua scripts with it)
+    from tests.fake_node import Network, add, load_node, queue
+except ImportError:
+    fakeredis = None
+
+A, B = "http://node-a:8000", "http://node-b:8000"
+
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+class TestDeltaSync(unittest.TestCase):
+    """Ops from A posted straight to B's /sync/delta; A itself has no peers,
+    so its snapshot is all B can learn from it besides these ops."""
+
+    def setUp(self) -> None:
+        self.net = Network()
+        self.a = load_node(fakeredis.FakeServer(), A)
+        self.b = load_node(fakeredis.FakeServer(), B)
+        self.client_a, self.client_b = self.net.join(self.a), self.net.join(self.b)
+        for track_id in (1, 2, 3):
+            add(self.client_a, track_id)
+
+    def op(self, seq: int, track_id: int, **fields) -> dict:
+        track = {"id": track_id, "title": f"Song{track_id}", "artist": "A", "duration": 200, "votes": 0}
+        return {"origin": A, "epoch": self.a.NODE_EPOCH, "seq": seq, "op": "add", "track": track,
+                "store": self.a.local_store(), **fields}
+
+    def send(self, op: dict) -> dict:
+        resp = self.client_b.post("/sync/delta", json=op)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        return resp.json()
+
+    def test_ops_in_sequence_are_applied(self) -> None:
+        self.assertEqual(self.send(self.op(1, 1))["message"], "Op applied")
+        self.assertEqual(self.send(self.op(2, 2))["message"], "Op applied")
+        self.assertEqual(queue(self.client_b), [(1, 0), (2, 0)])
+
+    def test_gap_resyncs_from_the_origin(self) -> None:
+        self.send(self.op(1, 1))
+        reply = self.send(self.op(3, 3))
+        self.assertEqual(reply["message"], "Queue resynchronized")
+        self.assertEqual(queue(self.client_b), queue(self.client_a))
+        # Ops continue from the snapshot's sequence
+        self.assertEqual(reply["seq"], self.b._applied[A][1])
+        self.assertEqual(self.send(self.op(reply["seq"] + 1, 4))["message"], "Op applied")
+
+    def test_failed_resync_is_503(self) -> None:
+        self.send(self.op(1, 1))
+        del self.net.clients[A]
+        self.assertEqual(self.client_b.post("/sync/delta", json=self.op(3, 3)).status_code, 503)
+        self.assertEqual(queue(self.client_b), [(1, 0)])
+
+    def test_duplicates_are_ignored(self) -> None:
+        self.send(self.op(1, 1))
+        self.send(self.op(2, 2))
+        self.assertEqual(self.send(self.op(1, 9))["message"], "Duplicate op ignored")
+        self.assertEqual(queue(self.client_b), [(1, 0), (2, 0)])
+
+    def test_new_epoch_starts_over(self) -> None:
+        self.send(self.op(1, 1))
+        self.send(self.op(2, 2))
+        # The origin restarted: its sequence starts at 1 again
+        self.assertEqual(self.send(self.op(1, 5, epoch="restarted"))["message"], "Op applied")
+        self.assertEqual(queue(self.client_b), [(1, 0), (2, 0), (5, 0)])
+
+    def test_same_store_and_own_ops_are_ignored(self) -> None:
+        reply = self.send(self.op(1, 1, store=self.b.local_store()))
+        self.assertEqual(reply["message"], "Same store, op ignored")
+        self.assertEqual(self.send(self.op(1, 1, origin=B))["message"], "Own op ignored")
+        self.assertEqual(queue(self.client_b), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
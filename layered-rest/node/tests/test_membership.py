@@ -0,0 +1,122 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import membership
+from membership import Membership, parse_peers
+
+SELF = "http://node-a:8000"
+
+
+class FakeResponse:
+    def __init__(self, body: dict):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self) -> dict:
+        return self.body
+
+
+class FakeSession:
+    """Answers health checks for the URLs in `nodes` ({url: (node url, store)}); others fail."""
+
+    def __init__(self):
+        self.nodes = {}
+
+    def get(self, url: str, timeout=None):
+        base = url[:-len(membership.HEALTH_PATH)]
+        if base not in self.nodes:
+            raise ConnectionError(f"no route to {base}")
+        node, store = self.nodes[base]
+        return FakeResponse({"node": node, "store": store})
+
+
+class TestMembership(unittest.TestCase):
+    def setUp(self) -> None:
+        self.session = FakeSession()
+        self.dns = set()
+        self.left = []
+        patcher = mock.patch.object(membership, "resolve", lambda address: set(self.dns))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def membership(self, static=(), dns: str = "", local_store: str = "store-a") -> Membership:
+        m = Membership(list(static), dns, SELF, self.session, timeout=1, interval=1,
+                       failure_threshold=2, store_id=lambda: local_store, on_leave=self.left.append)
+        self.addCleanup(m._pool.shutdown)
+        return m
+
+    def peer(self, url: str, store: str = "store-b") -> str:
+        self.session.nodes[url] = (url, store)
+        return url
+
+    def test_dns_adds_and_removes_peers(self) -> None:
+        m = self.membership(dns="node:8000")
+        self.dns = {self.peer("http://10.0.0.2:8000"), self.peer("http://10.0.0.3:8000", "store-c")}
+        m.refresh()
+        self.assertEqual(sorted(m.live()), ["http://10.0.0.2:8000", "http://10.0.0.3:8000"])
+        self.dns = {"http://10.0.0.3:8000"}
+        m.refresh()
+        self.assertEqual(m.live(), ["http://10.0.0.3:8000"])
+        self.assertEqual(self.left, ["http://10.0.0.2:8000"])
+
+    def test_dns_failure_keeps_members(self) -> None:
+        m = self.membership(dns="node:8000")
+        self.dns = {self.peer("http://10.0.0.2:8000")}
+        m.refresh()
+        with mock.patch.object(membership, "resolve", side_effect=OSError("no such host")):
+            m.refresh()
+        self.assertEqual(m.live(), ["http://10.0.0.2:8000"])
+
+    def test_failed_checks_drop_a_peer_until_it_is_back(self) -> None:
+        m = self.membership(static=[self.peer("http://node-b:8000")])
+        del self.session.nodes["http://node-b:8000"]
+        m.refresh()
+        self.assertEqual(m.live(), ["http://node-b:8000"])  # one failure is under the threshold
+        m.refresh()
+        self.assertEqual(m.live(), [])
+        self.peer("http://node-b:8000")
+        m.refresh()
+        self.assertEqual(m.live(), ["http://node-b:8000"])
+
+    def test_static_peers_are_never_removed(self) -> None:
+        m = self.membership(static=[SELF, self.peer("http://node-b:8000"), "http://node:8000"], dns="node:8000")
+        # The round-robin name answered from this node this time
+        self.session.nodes["http://node:8000"] = (SELF, "store-a")
+        m.refresh()
+        self.assertEqual(sorted(x.url for x in m.members()), ["http://node-b:8000", "http://node:8000"])
+        self.assertEqual(self.left, [])
+
+    def test_discovered_self_is_ignored_for_good(self) -> None:
+        m = self.membership(dns="node:8000")
+        self.dns = {"http://10.0.0.1:8000"}
+        self.session.nodes["http://10.0.0.1:8000"] = (SELF, "store-a")
+        m.refresh()
+        self.assertEqual(m.members(), [])
+        m.refresh()
+        self.assertEqual(m.members(), [])
+
+    def test_remote_picks_one_peer_per_other_store(self) -> None:
+        m = self.membership(static=[
+            self.peer("http://node-b:8000", "store-a"),
+            self.peer("http://node-d:8000", "store-c"),
+            self.peer("http://node-c:8000", "store-c"),
+            self.peer("http://node-e:8000", "store-e"),
+        ])
+        self.assertEqual(len(m.remote()), 4)  # stores are unknown before the first check
+        m.refresh()
+        self.assertEqual(m.remote(), ["http://node-c:8000", "http://node-e:8000"])
+
+
+class TestParsePeers(unittest.TestCase):
+    def test_parse(self) -> None:
+        self.assertEqual(parse_peers(" http://a:8000,,http://b:8000 "), ["http://a:8000", "http://b:8000"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis runs the Lua scripts with it)
+    from tests.fake_node import add, load_node
+    from fastapi.testclient import TestClient
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+class TestRequestLabels(unittest.TestCase):
+    def test_unrouted_responses_are_labelled_by_template(self) -> None:
+        # Three requests' worth of tokens, then every request is refused before routing
+        node = load_node(fakeredis.FakeServer(), CLIENT_RATE="0.001", CLIENT_BURST="3")
+        client = TestClient(node.app)
+        add(client, 1)
+        for _ in range(2):
+            self.assertEqual(client.post("/vote", json={"id": 1}, headers={"Idempotency-Key": "k1"}).status_code, 200)
+        for path in ("/vote", "/rooms/jazz/vote", "/rooms/rock/vote", "/metadata/1", "/no-such-path"):
+            self.assertEqual(client.post(path, json={"id": 1}).status_code, 429, path)
+        self.assertEqual(sorted(node.http_requests.samples()), [
+            'http_requests_total{method="POST",route="/add_track",status="200"} 1',
+            'http_requests_total{method="POST",route="/rooms/{room}/vote",status="429"} 2',
+            'http_requests_total{method="POST",route="/vote",status="200"} 2',  # the second one replayed
+            'http_requests_total{method="POST",route="/vote",status="429"} 1',
+            'http_requests_total{method="POST",route="other",status="429"} 2',
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
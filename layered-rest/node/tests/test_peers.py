@@ -0,0 +1,167 @@
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peers import CircuitBreaker, Coalescer, PeerSender
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class FakeSession:
+    """Records posted URLs; answers with `status`, or fails to connect when it
+    is None. Posts wait until `released` is set."""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.posted = queue.Queue()
+        self.released = threading.Event()
+        self.released.set()
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        self.posted.put(url)
+        self.released.wait()
+        if self.status is None:
+            raise ConnectionError("connection refused")
+        return FakeResponse(self.status)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 100.0
+        patcher = mock.patch("peers.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(threshold=2, cooldown=10)
+
+    def test_opens_after_threshold_failures_in_a_row(self) -> None:
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open)
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open)
+        self.assertTrue(self.breaker.blocked())
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_lets_one_trial_through_per_cooldown(self) -> None:
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 10
+        self.assertFalse(self.breaker.blocked())
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        # The trial failed: closed again only after another cooldown
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.blocked())
+        self.now += 10
+        self.assertTrue(self.breaker.allow())
+
+    def test_successful_trial_closes(self) -> None:
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.is_open)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+
+class TestPeerSender(unittest.TestCase):
+    def sender(self, session: FakeSession, breaker: CircuitBreaker, queue_size: int = 10) -> PeerSender:
+        sender = PeerSender("http://node-b:8000", session, queue_size=queue_size, timeout=1, breaker=breaker)
+        self.addCleanup(sender.stop)
+        self.addCleanup(session.released.set)
+        return sender
+
+    def test_delivers_in_order(self) -> None:
+        session = FakeSession()
+        sender = self.sender(session, CircuitBreaker(3, 10))
+        for path in ("/sync/delta?1", "/sync/delta?2"):
+            self.assertTrue(sender.submit(path, b"{}"))
+        self.assertEqual([session.posted.get(timeout=5) for _ in range(2)],
+                         ["http://node-b:8000/sync/delta?1", "http://node-b:8000/sync/delta?2"])
+
+    def test_drops_while_the_breaker_is_open(self) -> None:
+        session = FakeSession(status=503)
+        breaker = CircuitBreaker(1, 60)
+        sender = self.sender(session, breaker)
+        self.assertTrue(sender.submit("/sync/delta", b"{}"))
+        session.posted.get(timeout=5)
+        for _ in range(100):
+            if breaker.is_open:
+                break
+            time.sleep(0.01)
+        self.assertTrue(breaker.is_open)
+        self.assertFalse(sender.submit("/sync/delta", b"{}"))
+        self.assertEqual(sender.dropped, 1)
+
+    def test_full_queue_drops(self) -> None:
+        session = FakeSession()
+        session.released.clear()
+        sender = self.sender(session, CircuitBreaker(3, 10), queue_size=1)
+        self.assertTrue(sender.submit("/sync/delta?1", b"{}"))
+        session.posted.get(timeout=5)  # taken off the queue, stuck in flight
+        self.assertTrue(sender.submit("/sync/delta?2", b"{}"))
+        self.assertFalse(sender.submit("/sync/delta?3", b"{}"))
+        self.assertEqual(sender.dropped, 1)
+
+
+class TestCoalescer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.flushes = queue.Queue()
+
+    def coalescer(self, window: float) -> Coalescer:
+        coalescer = Coalescer(window, self.flushes.put)
+        self.addCleanup(coalescer.flush)
+        return coalescer
+
+    def test_keys_within_the_window_share_one_flush(self) -> None:
+        coalescer = self.coalescer(3600)
+        for key in (1, 2, 1, 3):
+            coalescer.add(key)
+        # The first key is waiting on the timer, the other three joined it
+        self.assertEqual(coalescer.merged, 3)
+        coalescer.flush()
+        self.assertEqual(self.flushes.get_nowait(), {1, 2, 3})
+        self.assertEqual(coalescer.merged, 3)
+        coalescer.add(4)
+        coalescer.flush()
+        self.assertEqual(self.flushes.get_nowait(), {4})
+        self.assertEqual((coalescer.added, coalescer.flushes, coalescer.merged), (5, 2, 3))
+
+    def test_timer_flushes_after_the_window(self) -> None:
+        coalescer = self.coalescer(0.05)
+        coalescer.add(1)
+        coalescer.add(2)
+        self.assertEqual(self.flushes.get(timeout=5), {1, 2})
+        coalescer.add(3)
+        self.assertEqual(self.flushes.get(timeout=5), {3})
+
+    def test_failed_flush_does_not_stop_later_ones(self) -> None:
+        calls = []
+
+        def flush(keys):
+            calls.append(keys)
+            if len(calls) == 1:
+                raise ConnectionError("peer down")
+
+        coalescer = Coalescer(3600, flush)
+        coalescer.add(1)
+        coalescer.flush()
+        coalescer.add(2)
+        coalescer.flush()
+        self.assertEqual(calls, [{1}, {2}])
+
+
+if __name__ == "__main__":
+    unittest.main()
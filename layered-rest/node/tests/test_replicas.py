@@ -0,0 +1,89 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replicas import ReplicaRouter, parse_replicas
+
+
+class FakeRedis:
+    """Answers INFO replication with a settable offset and link status."""
+
+    def __init__(self, offset: int = 0, link: str = "up", primary: bool = False):
+        self.offset, self.link, self.primary = offset, link, primary
+        self.down = False
+
+    def info(self, section):
+        if self.down:
+            raise ConnectionError("connection refused")
+        if self.primary:
+            return {"role": "master", "master_repl_offset": self.offset}
+        return {"role": "slave", "master_link_status": self.link, "slave_repl_offset": self.offset}
+
+
+class TestReplicaRouter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 100.0
+        patcher = mock.patch("replicas.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.primary = FakeRedis(primary=True)
+        self.r1, self.r2 = FakeRedis(), FakeRedis()
+        self.router = ReplicaRouter(self.primary, [], interval=1.0)
+        self.router.replicas = {"r1": self.r1, "r2": self.r2}
+
+    def write(self, n: int = 10) -> None:
+        """Writes on the primary that replicas r1 and r2 have not applied yet."""
+        self.primary.offset += n
+
+    def test_no_replica_is_fresh_before_two_checks(self) -> None:
+        # The first check only records the primary offset to compare against
+        self.router.check()
+        self.assertEqual(self.router.fresh, {"r1": False, "r2": False})
+        self.assertIs(self.router.reader(), self.primary)
+
+    def test_caught_up_replicas_are_read_round_robin(self) -> None:
+        self.write()
+        self.router.check()
+        self.r1.offset = self.r2.offset = self.primary.offset
+        self.router.check()
+        self.assertEqual(self.router.fresh, {"r1": True, "r2": True})
+        self.assertEqual({id(self.router.reader()) for _ in range(4)}, {id(self.r1), id(self.r2)})
+        self.assertEqual(self.router.reads, {"replica": 4, "primary": 0})
+
+    def test_lagging_or_unlinked_replicas_are_stale(self) -> None:
+        self.write()
+        self.router.check()
+        self.r1.offset = self.primary.offset - 1
+        self.r2.offset, self.r2.link = self.primary.offset, "down"
+        self.router.check()
+        self.assertEqual(self.router.fresh, {"r1": False, "r2": False})
+        self.assertIs(self.router.reader(), self.primary)
+
+    def test_failed_replica_check_counts_as_stale(self) -> None:
+        self.router.check()
+        self.r2.down = True
+        self.router.check()
+        self.assertEqual(self.router.fresh, {"r1": True, "r2": False})
+        self.assertIs(self.router.reader(), self.r1)
+
+    def test_falls_back_to_primary_when_checks_stop(self) -> None:
+        self.router.check()
+        self.router.check()
+        self.now += 1.9
+        self.assertIsNot(self.router.reader(), self.primary)
+        # Two intervals without a check: the verdict is too old to trust
+        self.now += 0.2
+        self.assertIs(self.router.reader(), self.primary)
+
+
+class TestParseReplicas(unittest.TestCase):
+    def test_parse(self) -> None:
+        self.assertEqual(parse_replicas("a:6380, b ,"), [("a", 6380), ("b", 6379)])
+        self.assertEqual(parse_replicas(""), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis runs the Lua scripts with it)
+    from tests.fake_node import add, load_node, queue
+    from fastapi.testclient import TestClient
+except ImportError:
+    fakeredis = None
+
+from schema import QUEUE_KEY, queue_member, voters_key
+from votes import CLAIM_VOTES, VoteAccumulator, claim_args, claim_results
+
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+class TestClaimVotes(unittest.TestCase):
+    def setUp(self) -> None:
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        self.redis.zadd(QUEUE_KEY, {queue_member(1): 0, queue_member(2): 0})
+
+    def claim(self, mode: str, claims) -> list:
+        keys, args = claim_args(QUEUE_KEY, mode, 60, [
+            (voters_key(track_id), queue_member(track_id), listener) for track_id, listener in claims
+        ])
+        return claim_results(self.redis.eval(CLAIM_VOTES, len(keys), *keys, *args))
+
+    def test_set_mode(self) -> None:
+        self.assertEqual(self.claim("set", [(1, "ann"), (1, "bob"), (2, "ann")]), [True, True, True])
+        self.assertEqual(self.claim("set", [(1, "ann"), (2, "cid")]), [False, True])
+        self.assertEqual(self.redis.smembers(voters_key(1)), {b"ann", b"bob"})
+        self.assertGreater(self.redis.ttl(voters_key(1)), 0)
+
+    def test_bitmap_mode(self) -> None:
+        self.assertEqual(self.claim("bitmap", [(1, "7"), (1, "1048575")]), [True, True])
+        self.assertEqual(self.claim("bitmap", [(1, "7"), (2, "7")]), [False, True])
+        self.assertEqual(self.redis.getbit(voters_key(1), 7), 1)
+
+    def test_repeat_within_one_batch(self) -> None:
+        self.assertEqual(self.claim("set", [(1, "ann"), (1, "ann")]), [True, False])
+
+    def test_unqueued_track_records_nothing(self) -> None:
+        self.assertEqual(self.claim("set", [(3, "ann")]), [None])
+        self.assertFalse(self.redis.exists(voters_key(3)))
+
+
+@unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+class TestVoteDedup(unittest.TestCase):
+    def node(self, mode: str) -> TestClient:
+        client = TestClient(load_node(fakeredis.FakeServer(), VOTE_DEDUP=mode).app)
+        add(client, 1)
+        return client
+
+    def test_repeat_vote_is_409(self) -> None:
+        client = self.node("set")
+        self.assertEqual(client.post("/vote", json={"id": 1}, headers={"X-Listener-Id": "ann"}).json(),
+                         {"id": 1, "votes": 1})
+        repeat = client.post("/vote", json={"id": 1}, headers={"X-Listener-Id": "ann"})
+        self.assertEqual(repeat.status_code, 409)
+        self.assertEqual(client.post("/vote", json={"id": 1}, headers={"X-Listener-Id": "bob"}).status_code, 200)
+        self.assertEqual(queue(client), [(1, 2)])
+
+    def test_listener_id_required(self) -> None:
+        self.assertEqual(self.node("set").post("/vote", json={"id": 1}).status_code, 400)
+
+    def test_batch_reports_duplicates(self) -> None:
+        client = self.node("set")
+        add(client, 2)
+        resp = client.post("/votes", json=[{"id": 1}, {"id": 1}, {"id": 2, "listener": "bob"}, {"id": 9}],
+                           headers={"X-Listener-Id": "ann"})
+        self.assertEqual([r["status"] for r in resp.json()["results"]], ["ok", "duplicate", "ok", "not_found"])
+        self.assertEqual(queue(client), [(1, 1), (2, 1)])
+
+    def test_vote_before_add_does_not_block(self) -> None:
+        client = self.node("set")
+        headers = {"X-Listener-Id": "ann"}
+        self.assertEqual(client.post("/vote", json={"id": 5}, headers=headers).json(), {"id": 5, "votes": None})
+        add(client, 5)
+        self.assertEqual(client.post("/vote", json={"id": 5}, headers=headers).json(), {"id": 5, "votes": 1})
+
+    def test_bitmap_listener_ids_are_bounded_integers(self) -> None:
+        client = self.node("bitmap")
+        # Headers are latin-1, so "²" (a digit to str.isdigit) can be sent as bytes
+        for listener in (b"ann", b"-1", b"1048576", "²".encode("latin-1")):
+            self.assertEqual(client.post("/vote", json={"id": 1}, headers={"X-Listener-Id": listener}).status_code,
+                             400, listener)
+        self.assertEqual(client.post("/vote", json={"id": 1}, headers={"X-Listener-Id": "1048575"}).status_code, 200)
+        self.assertEqual(client.post("/vote", json={"id": 1}, headers={"X-Listener-Id": "1048575"}).status_code, 409)
+
+    def test_room_votes_are_deduplicated(self) -> None:
+        client = self.node("set")
+        client.post("/rooms/jazz/add_track", json={"id": 1, "title": "S", "artist": "A", "duration": 1})
+        headers = {"X-Listener-Id": "ann"}
+        self.assertEqual(client.post("/rooms/jazz/vote", json={"id": 1}, headers=headers).status_code, 200)
+        self.assertEqual(client.post("/rooms/jazz/vote", json={"id": 1}, headers=headers).status_code, 409)
+
+
+class TestVoteAccumulator(unittest.TestCase):
+    def setUp(self) -> None:
+        self.flushes = []
+        self.fail = False
+        # Long interval: the tests flush by hand
+        self.acc = VoteAccumulator(3600, self.record)
+        self.addCleanup(self.acc._stop.set)
+
+    def record(self, deltas) -> None:
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.flushes.append(deltas)
+
+    def test_votes_are_folded_per_track(self) -> None:
+        for track_id, delta in [(1, 1), (1, 1), (2, 1), (1, -1), (3, 1), (3, -1)]:
+            self.acc.add(track_id, delta)
+        self.acc.flush()
+        # Track 3 nets out and is left out of the flush, but its votes count
+        self.assertEqual(self.flushes, [{1: 1, 2: 1}])
+        self.assertEqual((self.acc.accepted, self.acc.flushed), (6, 6))
+        self.acc.flush()
+        self.assertEqual(len(self.flushes), 1)
+
+    def test_failed_flush_is_requeued(self) -> None:
+        self.acc.add(1, 1)
+        self.fail = True
+        self.acc.flush()
+        self.acc.add(1, 1)
+        self.fail = False
+        self.acc.flush()
+        self.assertEqual(self.flushes, [{1: 2}])
+        self.assertEqual((self.acc.accepted, self.acc.flushed), (2, 2))
+
+    def test_stop_flushes_pending_votes(self) -> None:
+        self.acc.add(1, 1)
+        self.acc.stop()
+        self.assertEqual(self.flushes, [{1: 1}])
+
+    @unittest.skipIf(fakeredis is None, "needs fakeredis with Lua support (lupa)")
+    def test_node_applies_votes_on_flush(self) -> None:
+        node = load_node(fakeredis.FakeServer(), VOTE_FLUSH_MS="3600000")
+        self.addCleanup(node.vote_accumulator._stop.set)
+        client = TestClient(node.app)
+        add(client, 1)
+        for _ in range(3):
+            self.assertEqual(client.post("/vote", json={"id": 1}).json(), {"id": 1, "pending": True})
+        self.assertEqual(queue(client), [(1, 0)])
+        node.vote_accumulator.flush()
+        self.assertEqual(queue(client), [(1, 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+from typing import List, Optional, Tuple
+
+# Streaming heavy hitters (the Space-Saving algorithm) kept in Redis. At most
+# `capacity` items are counted at once, in a sorted set by count. A new item
+# arriving when the set is full takes over the smallest counter, inheriting
+# its count as the new item's possible overcount ("error"). Any item played
+# more than total plays / capacity times is guaranteed to be counted, each
+# count is at most `error` too high, and a top-K query is one ZREVRANGE.
+
+# KEYS: counts (zset), errors (hash), labels (hash)
+# ARGV: item, capacity, label ('' for none)
+# Returns the item's new count.
+_SPACE_SAVING = """
+local count = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if count then
+  count = redis.call('ZINCRBY', KEYS[1], 1, ARGV[1])
+elseif redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+  redis.call('ZADD', KEYS[1], 1, ARGV[1])
+  count = 1
+else
+  local evicted = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+  redis.call('ZREM', KEYS[1], evicted[1])
+  redis.call('HDEL', KEYS[2], evicted[1])
+  redis.call('HDEL', KEYS[3], evicted[1])
+  count = tonumber(evicted[2]) + 1
+  redis.call('ZADD', KEYS[1], count, ARGV[1])
+  redis.call('HSET', KEYS[2], ARGV[1], evicted[2])
+end
+if ARGV[3] ~= '' then
+  redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+end
+return tonumber(count)
+"""
+
+# KEYS: counts, errors, labels; ARGV: k
+# Returns {item, count, error or false, label or false, ...} by count descending.
+_TOP = """
+local top = redis.call('ZREVRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1, 'WITHSCORES')
+local out = {}
+for i = 1, #top, 2 do
+  table.insert(out, top[i])
+  table.insert(out, top[i + 1])
+  table.insert(out, redis.call('HGET', KEYS[2], top[i]))
+  table.insert(out, redis.call('HGET', KEYS[3], top[i]))
+end
+return out
+"""
+
+
+class HeavyHitters:
+    """One Space-Saving summary under `prefix` (counts, :error and :labels keys)."""
+
+    def __init__(self, client, prefix: str, capacity: int):
+        self.keys = [prefix, f"{prefix}:error", f"{prefix}:labels"]
+        self.capacity = capacity
+        self._add = client.register_script(_SPACE_SAVING) if client is not None else None
+        self._top = client.register_script(_TOP) if client is not None else None
+
+    def args(self, item, label: bytes = b"") -> list:
+        return [item, self.capacity, label]
+
+    def add(self, pipe, item, label: bytes = b""):
+        """Count one occurrence of `item` as part of `pipe`; `label` is kept for display."""
+        self._add(self.keys, self.args(item, label), client=pipe)
+
+    def add_eval(self, pipe, item, label: bytes = b""):
+        """`add` for clients without registered scripts (the asyncio node)."""
+        pipe.eval(_SPACE_SAVING, len(self.keys), *self.keys, *self.args(item, label))
+
+    def top(self, k: int) -> List[Tuple[bytes, int, int, Optional[bytes]]]:
+        """(item, count, error, label) for the k largest counts, largest first."""
+        flat = self._top(self.keys, [k])
+        return [
+            (flat[i], int(flat[i + 1]), int(flat[i + 2] or 0), flat[i + 3] or None)
+            for i in range(0, len(flat), 4)
+        ]
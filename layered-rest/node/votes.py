@@ -0,0 +1,101 @@
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+# Per-listener vote deduplication (VOTE_DEDUP). A listener is only recorded
+# for a track that is queued, in the same script that checks it, so a vote
+# for a track that does not exist yet cannot block that listener's real vote.
+# KEYS: the queue sorted set, then one voter key per claim
+# ARGV: mode ("set" or "bitmap"), ttl, then a queue member and a listener per claim
+# Returns per claim 1 (new vote), 0 (repeat vote) or -1 (track not queued).
+CLAIM_VOTES = """
+local bitmap, ttl = ARGV[1] == 'bitmap', tonumber(ARGV[2])
+local out = {}
+for i = 2, #KEYS do
+  local member, listener = ARGV[2 * i - 1], ARGV[2 * i]
+  if not redis.call('ZSCORE', KEYS[1], member) then
+    out[i - 1] = -1
+  else
+    local fresh
+    if bitmap then
+      fresh = redis.call('SETBIT', KEYS[i], tonumber(listener), 1) == 0
+    else
+      fresh = redis.call('SADD', KEYS[i], listener) == 1
+    end
+    redis.call('EXPIRE', KEYS[i], ttl)
+    out[i - 1] = fresh and 1 or 0
+  end
+end
+return out
+"""
+
+
+def claim_args(queue_key: str, mode: str, ttl: int,
+               claims: List[Tuple[str, str, str]]) -> Tuple[list, list]:
+    """CLAIM_VOTES keys and args for (voter key, queue member, listener) claims."""
+    keys, args = [queue_key], [mode, ttl]
+    for key, member, listener in claims:
+        keys.append(key)
+        args += [member, listener]
+    return keys, args
+
+
+def claim_results(replies) -> List[Optional[bool]]:
+    """True for new votes, False for repeats, None where the track is not queued."""
+    return [None if r < 0 else r == 1 for r in replies]
+
+
+class VoteAccumulator:
+    """Write-behind vote counter for hot tracks.
+
+    `add` only bumps an in-process per-track delta; a background thread swaps
+    the pending deltas out every `interval` seconds and hands them to `flush`
+    as {track_id: net_delta}, so a burst of votes on one track becomes a
+    single sorted-set increment. Votes still pending when the process dies
+    are lost, so `stop` flushes once more on shutdown. `accepted` and
+    `flushed` both count votes, so their difference is the number pending."""
+
+    def __init__(self, interval: float, flush: Callable[[Dict[int, int]], None]):
+        self.interval = interval
+        self._flush_cb = flush
+        self._pending: Dict[int, int] = {}
+        self._votes = 0  # votes behind _pending, including ones that cancel out
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.accepted = 0
+        self.flushed = 0
+        self._thread = threading.Thread(target=self._run, name="vote-flusher", daemon=True)
+        self._thread.start()
+
+    def add(self, track_id: int, delta: int):
+        with self._lock:
+            self._pending[track_id] = self._pending.get(track_id, 0) + delta
+            self._votes += 1
+            self.accepted += 1
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            votes, self._votes = self._votes, 0
+        pending = {track_id: delta for track_id, delta in pending.items() if delta}
+        try:
+            if pending:
+                self._flush_cb(pending)
+            self.flushed += votes
+        except Exception as e:
+            log.error("Vote flush failed, re-queueing %d tracks: %s", len(pending), e)
+            with self._lock:
+                for track_id, delta in pending.items():
+                    self._pending[track_id] = self._pending.get(track_id, 0) + delta
+                self._votes += votes
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
@@ -11,6 +11,13 @@ def main():
         "test_sync.py",
         "test_metadata.py",
         "test_history.py",
+        "test_pagination.py",
+        "test_events.py",
+        "test_batch.py",
+        "test_metrics.py",
+        "test_idempotency.py",
+        "test_rooms.py",
+        "test_stats.py",
     ]
     all_passed = True
     for test in test_files:
@@ -0,0 +1,26 @@
+import requests
+import time
+
+base_url = "http://nginx:8080"
+
+def clear_queue():
+    requests.post(f"{base_url}/clear")
+
+def test_batch():
+    clear_queue()
+    tracks = [{"id": i, "title": f"Batch{i}", "artist": "B", "duration": 100} for i in range(1, 4)]
+    r = requests.post(f"{base_url}/add_tracks", json=tracks)
+    assert r.status_code == 200, "Batch add failed"
+    assert [item["status"] for item in r.json()["results"]] == ["added"] * 3, "Batch add results incorrect"
+    r = requests.post(f"{base_url}/votes", json=[{"id": 3}, {"id": 3}, {"id": 99}])
+    assert r.status_code == 200, "Batch vote failed"
+    results = r.json()["results"]
+    assert results[1] == {"id": 3, "status": "ok", "votes": 2}, "Batch vote count incorrect"
+    assert results[2]["status"] == "not_found", "Unknown track not reported"
+    time.sleep(1)
+    queue = requests.get(f"{base_url}/queue").json()
+    assert [t["id"] for t in queue] == [3, 1, 2], "Batch votes did not reorder queue"
+    print("test_batch: PASS")
+
+if __name__ == "__main__":
+    test_batch()
@@ -0,0 +1,40 @@
+import json
+import threading
+import requests
+import time
+
+base_url = "http://nginx:8080"
+
+def clear_queue():
+    requests.post(f"{base_url}/clear")
+
+def listen(events, stop):
+    with requests.get(f"{base_url}/queue/events", stream=True, timeout=10) as resp:
+        event_type = None
+        for line in resp.iter_lines(decode_unicode=True):
+            if stop.is_set():
+                return
+            if line.startswith("event: "):
+                event_type = line[len("event: "):]
+            elif line.startswith("data: ") and event_type:
+                events.append((event_type, json.loads(line[len("data: "):])))
+
+def test_events():
+    clear_queue()
+    events, stop = [], threading.Event()
+    threading.Thread(target=listen, args=(events, stop), daemon=True).start()
+    time.sleep(1)
+    track = {"id": 1, "title": "EventSong", "artist": "E", "duration": 90}
+    requests.post(f"{base_url}/add_track", json=track)
+    requests.post(f"{base_url}/vote", json={"id": 1}, params={"up": True})
+    requests.post(f"{base_url}/play_next")
+    time.sleep(2)
+    stop.set()
+    types = [t for t, _ in events]
+    assert "added" in types, "No added event received"
+    assert ("votes", {"id": 1, "votes": 1}) in events, "No vote change event received"
+    assert "now_playing" in types, "No now_playing event received"
+    print("test_events: PASS")
+
+if __name__ == "__main__":
+    test_events()
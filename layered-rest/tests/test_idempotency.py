@@ -0,0 +1,24 @@
+import requests
+import time
+
+base_url = "http://nginx:8080"
+
+def clear_queue():
+    requests.post(f"{base_url}/clear")
+
+def test_idempotency():
+    clear_queue()
+    requests.post(f"{base_url}/add_track", json={"id": 1, "title": "Retry", "artist": "R", "duration": 100})
+    headers = {"Idempotency-Key": f"vote-{time.time()}"}
+    first = requests.post(f"{base_url}/vote", json={"id": 1}, headers=headers)
+    retry = requests.post(f"{base_url}/vote", json={"id": 1}, headers=headers)
+    assert first.status_code == 200 and retry.status_code == 200, "Vote with Idempotency-Key failed"
+    assert retry.headers.get("Idempotent-Replayed") == "true", "Retry was not replayed"
+    assert retry.json() == first.json(), "Replayed response differs"
+    time.sleep(1)
+    queue = requests.get(f"{base_url}/queue").json()
+    assert queue[0]["votes"] == 1, "Retried vote was counted twice"
+    print("test_idempotency: PASS")
+
+if __name__ == "__main__":
+    test_idempotency()
@@ -0,0 +1,24 @@
+import requests
+import time
+
+base_url = "http://nginx:8080"
+
+def clear_queue():
+    requests.post(f"{base_url}/clear")
+
+def test_metrics():
+    clear_queue()
+    for i in (1, 2):
+        requests.post(f"{base_url}/add_track", json={"id": i, "title": f"Metric{i}", "artist": "M", "duration": 100})
+    time.sleep(1)
+    r = requests.get(f"{base_url}/metrics")
+    assert r.status_code == 200, "Metrics endpoint failed"
+    assert r.headers["content-type"].startswith("text/plain"), "Metrics not served as text"
+    lines = r.text.splitlines()
+    assert "queue_length 2" in lines, "Queue length gauge incorrect"
+    assert "# TYPE http_request_duration_seconds histogram" in lines, "Route latency missing"
+    assert any(l.startswith("redis_command_duration_seconds_bucket{") for l in lines), "Redis timings missing"
+    print("test_metrics: PASS")
+
+if __name__ == "__main__":
+    test_metrics()
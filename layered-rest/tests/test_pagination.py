@@ -0,0 +1,32 @@
+import requests
+import time
+
+base_url = "http://nginx:8080"
+
+def clear_queue():
+    requests.post(f"{base_url}/clear")
+
+def test_pagination():
+    clear_queue()
+    for i in range(1, 6):
+        requests.post(f"{base_url}/add_track", json={"id": i, "title": f"Page{i}", "artist": "P", "duration": 60})
+    time.sleep(1)
+    resp = requests.get(f"{base_url}/queue", params={"limit": 2})
+    assert resp.status_code == 200, "Paged queue endpoint failed"
+    assert [t["id"] for t in resp.json()] == [1, 2], "First queue page incorrect"
+    cursor = resp.headers.get("X-Next-Cursor")
+    assert cursor is not None, "Missing next cursor on first queue page"
+    resp = requests.get(f"{base_url}/queue", params={"limit": 10, "cursor": cursor})
+    assert [t["id"] for t in resp.json()] == [3, 4, 5], "Second queue page incorrect"
+    assert "X-Next-Cursor" not in resp.headers, "Last queue page should not have a cursor"
+    for _ in range(3):
+        requests.post(f"{base_url}/play_next")
+    time.sleep(1)
+    resp = requests.get(f"{base_url}/history", params={"limit": 2})
+    assert [t["id"] for t in resp.json()] == [1, 2], "First history page incorrect"
+    resp = requests.get(f"{base_url}/history", params={"limit": 2, "cursor": resp.headers["X-Next-Cursor"]})
+    assert [t["id"] for t in resp.json()] == [3], "Second history page incorrect"
+    print("test_pagination: PASS")
+
+if __name__ == "__main__":
+    test_pagination()
@@ -0,0 +1,31 @@
+import requests
+import time
+
+base_url = "http://nginx:8080"
+
+def clear_queue():
+    requests.post(f"{base_url}/clear")
+
+def test_rooms():
+    clear_queue()
+    requests.post(f"{base_url}/rooms/jazz/add_track", json={"id": 1, "title": "So What", "artist": "Miles", "duration": 545})
+    requests.post(f"{base_url}/rooms/jazz/add_track", json={"id": 2, "title": "Blue", "artist": "Miles", "duration": 337})
+    requests.post(f"{base_url}/rooms/rock/add_track", json={"id": 1, "title": "Rock Song", "artist": "Band", "duration": 200})
+    requests.post(f"{base_url}/rooms/jazz/vote", json={"id": 2})
+    time.sleep(1)
+    jazz = requests.get(f"{base_url}/rooms/jazz/queue").json()
+    rock = requests.get(f"{base_url}/rooms/rock/queue").json()
+    assert [t["id"] for t in jazz] == [2, 1], "Room queue not ranked by votes"
+    assert [t["title"] for t in rock] == ["Rock Song"], "Rooms are not isolated"
+    assert requests.get(f"{base_url}/queue").json() == [], "Room track leaked into the unscoped queue"
+    playing = requests.post(f"{base_url}/rooms/jazz/play_next").json()["now_playing"]
+    assert playing["id"] == 2, "play_next did not pop the room's top track"
+    history = requests.get(f"{base_url}/rooms/jazz/history").json()
+    assert [t["id"] for t in history] == [2], "Room history missing played track"
+    shard = requests.get(f"{base_url}/rooms/jazz").json()["shard"]
+    assert shard, "Room has no shard"
+    assert requests.get(f"{base_url}/rooms/no%20spaces/queue").status_code == 400, "Invalid room name accepted"
+    print("test_rooms: PASS")
+
+if __name__ == "__main__":
+    test_rooms()
@@ -0,0 +1,25 @@
+import requests
+import time
+
+base_url = "http://nginx:8080"
+
+def clear_queue():
+    requests.post(f"{base_url}/clear")
+
+def test_stats():
+    clear_queue()
+    plays = [(1, "Hit", "Star"), (2, "Other", "Star"), (1, "Hit", "Star"), (3, "Solo", "Indie")]
+    for track_id, title, artist in plays:
+        requests.post(f"{base_url}/add_track", json={"id": track_id, "title": title, "artist": artist, "duration": 100})
+        requests.post(f"{base_url}/play_next")
+    time.sleep(1)
+    resp = requests.get(f"{base_url}/stats/top", params={"k": 2})
+    assert resp.status_code == 200, "Stats endpoint failed"
+    top = resp.json()
+    assert [(t["id"], t["plays"]) for t in top["tracks"]][0] == (1, 2), "Most played track wrong"
+    assert len(top["tracks"]) == 2, "k not applied"
+    assert (top["artists"][0]["artist"], top["artists"][0]["plays"]) == ("Star", 3), "Most played artist wrong"
+    print("test_stats: PASS")
+
+if __name__ == "__main__":
+    test_stats()
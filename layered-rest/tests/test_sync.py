@@ -22,5 +22,16 @@ def test_sync():
     assert all_ok, "Not all nodes have the track after sync"
     print("test_sync: PASS")
 
+def test_shared_store():
+    # Every replica uses the same Redis, so none of them should get HTTP syncs
+    for i in range(10):
+        peers = requests.get(f"{base_url}/sync/peers").json()
+        assert peers["remote"] == [], f"Node {i+1} syncs peers on its own store: {peers['remote']}"
+        for member in peers["members"]:
+            if member["healthy"]:
+                assert member["store"] == peers["store"], f"Node {i+1} sees another store at {member['url']}"
+    print("test_shared_store: PASS")
+
 if __name__ == "__main__":
     test_sync()
+    test_shared_store()
@@ -6,6 +6,9 @@ import os
 import redis
 import queue_pb2
 import queue_pb2_grpc
+from log import get_logger
+
+log = get_logger(__name__)
 
 
 class QueueServiceServicer(queue_pb2_grpc.QueueServiceServicer):
@@ -95,7 +98,7 @@ def serve():
     queue_pb2_grpc.add_QueueServiceServicer_to_server(QueueServiceServicer(), server)
     server.add_insecure_port('[::]:50051')
     server.start()
-    print("gRPC QueueService running on port 50051...")
+    log.info("gRPC QueueService running on port 50051...")
     try:
         while True:
             time.sleep(86400)